@@ -0,0 +1,32 @@
+"""Add covering index for the level-1 bear limit check
+
+Revision ID: 003
+Revises: 002
+Create Date: 2026-10-19 10:00:00.000000
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '003'
+down_revision = '002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    """
+    Create ix_bears_owner_type_level so COUNT(*) of level-1 bears is an index-only scan
+    """
+    op.create_index(
+        'ix_bears_owner_type_level',
+        'bears',
+        ['owner_id', 'bear_type', 'level', 'is_on_sale'],
+    )
+
+
+def downgrade():
+    """
+    Drop ix_bears_owner_type_level
+    """
+    op.drop_index('ix_bears_owner_type_level', table_name='bears')
@@ -0,0 +1,60 @@
+"""Denormalize bear fields onto p2p_listings and add order-book indexes
+
+Revision ID: 004
+Revises: 003
+Create Date: 2026-10-19 11:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '004'
+down_revision = '003'
+branch_labels = None
+depends_on = None
+
+ACTIVE = sa.text("status = 'active'")
+
+INDEXES = [
+    ('ix_p2p_active_newest', ['created_at', 'id']),
+    ('ix_p2p_active_price', ['price_coins', 'id']),
+    ('ix_p2p_active_type_newest', ['bear_type', 'created_at', 'id']),
+    ('ix_p2p_active_type_price', ['bear_type', 'price_coins', 'id']),
+    ('ix_p2p_active_type_variant_price', ['bear_type', 'bear_variant', 'price_coins', 'id']),
+    ('ix_p2p_active_type_level_price', ['bear_type', 'bear_level', 'price_coins', 'id']),
+]
+
+
+def upgrade():
+    """
+    Add bear_type/bear_variant/bear_level to p2p_listings, backfill them and
+    create partial indexes over active listings, one per filter shape
+    """
+    op.add_column('p2p_listings', sa.Column('bear_type', sa.String(50), nullable=True))
+    op.add_column('p2p_listings', sa.Column('bear_variant', sa.Integer(), nullable=True))
+    op.add_column('p2p_listings', sa.Column('bear_level', sa.Integer(), nullable=True))
+    
+    op.execute(
+        """
+        UPDATE p2p_listings AS l
+        SET bear_type = b.bear_type, bear_variant = b.variant, bear_level = b.level
+        FROM bears AS b
+        WHERE b.id = l.bear_id
+        """
+    )
+    
+    for name, columns in INDEXES:
+        op.create_index(name, 'p2p_listings', columns, postgresql_where=ACTIVE)
+
+
+def downgrade():
+    """
+    Drop order-book indexes and denormalized columns
+    """
+    for name, _ in INDEXES:
+        op.drop_index(name, table_name='p2p_listings')
+    
+    op.drop_column('p2p_listings', 'bear_level')
+    op.drop_column('p2p_listings', 'bear_variant')
+    op.drop_column('p2p_listings', 'bear_type')
@@ -0,0 +1,34 @@
+"""Add partial index on sold P2P listings for the market price index warm-up
+
+Revision ID: 005
+Revises: 004
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '005'
+down_revision = '004'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    """
+    Create ix_p2p_sold_at over sold listings
+    """
+    op.create_index(
+        'ix_p2p_sold_at',
+        'p2p_listings',
+        ['sold_at'],
+        postgresql_where=sa.text("status = 'sold'"),
+    )
+
+
+def downgrade():
+    """
+    Drop ix_p2p_sold_at
+    """
+    op.drop_index('ix_p2p_sold_at', table_name='p2p_listings')
@@ -0,0 +1,42 @@
+"""Add pvp_stats table with Elo ratings
+
+Revision ID: 006
+Revises: 005
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '006'
+down_revision = '005'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    """
+    Create pvp_stats
+    """
+    op.create_table(
+        'pvp_stats',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id'), nullable=False),
+        sa.Column('rating', sa.Integer(), nullable=False, server_default='1000'),
+        sa.Column('wins', sa.Integer(), server_default='0'),
+        sa.Column('losses', sa.Integer(), server_default='0'),
+        sa.Column('created_at', sa.DateTime()),
+        sa.Column('updated_at', sa.DateTime()),
+    )
+    op.create_index('ix_pvp_stats_user_id', 'pvp_stats', ['user_id'], unique=True)
+    op.create_index('ix_pvp_stats_rating', 'pvp_stats', ['rating'])
+
+
+def downgrade():
+    """
+    Drop pvp_stats
+    """
+    op.drop_index('ix_pvp_stats_rating', table_name='pvp_stats')
+    op.drop_index('ix_pvp_stats_user_id', table_name='pvp_stats')
+    op.drop_table('pvp_stats')
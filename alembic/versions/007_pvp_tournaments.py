@@ -0,0 +1,71 @@
+"""Add weekly PvP tournament tables
+
+Revision ID: 007
+Revises: 006
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '007'
+down_revision = '006'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    """
+    Create tournaments, tournament_entries and tournament_matches
+    """
+    op.create_table(
+        'tournaments',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('week_start', sa.DateTime(), nullable=False, unique=True),
+        sa.Column('status', sa.String(20), server_default='registration'),
+        sa.Column('registration_ends_at', sa.DateTime(), nullable=False),
+        sa.Column('entry_fee', sa.Float(), nullable=False),
+        sa.Column('prize_pool', sa.Float(), server_default='0'),
+        sa.Column('players_count', sa.Integer(), server_default='0'),
+        sa.Column('rounds', sa.Integer(), server_default='0'),
+        sa.Column('created_at', sa.DateTime()),
+        sa.Column('finished_at', sa.DateTime(), nullable=True),
+    )
+    op.create_index('ix_tournaments_status', 'tournaments', ['status'])
+    
+    op.create_table(
+        'tournament_entries',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('tournament_id', sa.Integer(), sa.ForeignKey('tournaments.id'), nullable=False),
+        sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id'), nullable=False),
+        sa.Column('team_power', sa.Float(), server_default='0'),
+        sa.Column('score', sa.Integer(), server_default='0'),
+        sa.Column('place', sa.Integer(), nullable=True),
+        sa.Column('prize_coins', sa.Float(), server_default='0'),
+        sa.Column('created_at', sa.DateTime()),
+        sa.UniqueConstraint('tournament_id', 'user_id', name='uq_tournament_entry_user'),
+    )
+    op.create_index('ix_tournament_entries_tournament_id', 'tournament_entries', ['tournament_id'])
+    op.create_index('ix_tournament_entries_user_id', 'tournament_entries', ['user_id'])
+    
+    op.create_table(
+        'tournament_matches',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('tournament_id', sa.Integer(), sa.ForeignKey('tournaments.id'), nullable=False),
+        sa.Column('round', sa.Integer(), nullable=False),
+        sa.Column('player1_id', sa.Integer(), sa.ForeignKey('users.id'), nullable=False),
+        sa.Column('player2_id', sa.Integer(), sa.ForeignKey('users.id'), nullable=True),
+        sa.Column('winner_id', sa.Integer(), sa.ForeignKey('users.id'), nullable=False),
+        sa.Column('created_at', sa.DateTime()),
+    )
+    op.create_index('ix_tournament_matches_tournament_id', 'tournament_matches', ['tournament_id'])
+
+
+def downgrade():
+    """
+    Drop tournament tables
+    """
+    op.drop_table('tournament_matches')
+    op.drop_table('tournament_entries')
+    op.drop_table('tournaments')
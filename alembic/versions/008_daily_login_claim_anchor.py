@@ -0,0 +1,38 @@
+"""Anchor daily login streaks on claims instead of views
+
+Revision ID: 008
+Revises: 007
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '008'
+down_revision = '007'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    """
+    Views used to move last_login_date and pre-increment streak_days before
+    the reward was claimed. Roll such unclaimed advances back so that
+    last_login_date means "last claimed reward" for every row.
+    """
+    op.execute(
+        """
+        UPDATE user_daily_logins
+        SET last_login_date = last_reward_claimed_at,
+            streak_days = GREATEST(streak_days - 1, 0)
+        WHERE reward_claimed_today = false
+          AND last_login_date IS NOT NULL
+        """
+    )
+
+
+def downgrade():
+    """
+    Data-only migration, nothing to undo
+    """
+    pass
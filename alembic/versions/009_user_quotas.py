@@ -0,0 +1,37 @@
+"""Add user_quotas table for daily action limits
+
+Revision ID: 009
+Revises: 008
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '009'
+down_revision = '008'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    """
+    Create user_quotas
+    """
+    op.create_table(
+        'user_quotas',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id'), nullable=False),
+        sa.Column('action', sa.String(50), nullable=False),
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.Column('used', sa.Integer(), nullable=False, server_default='0'),
+        sa.UniqueConstraint('user_id', 'action', 'day', name='uq_user_quota_day'),
+    )
+
+
+def downgrade():
+    """
+    Drop user_quotas
+    """
+    op.drop_table('user_quotas')
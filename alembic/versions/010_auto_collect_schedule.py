@@ -0,0 +1,45 @@
+"""Add auto-collect schedule columns to users
+
+Revision ID: 010
+Revises: 009
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '010'
+down_revision = '009'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    """
+    Add last/next auto-collect timestamps and schedule users that already
+    own the auto_collect upgrade
+    """
+    op.add_column('users', sa.Column('last_auto_collect_at', sa.DateTime(), nullable=True))
+    op.add_column('users', sa.Column('next_auto_collect_at', sa.DateTime(), nullable=True))
+    op.create_index('ix_users_next_auto_collect_at', 'users', ['next_auto_collect_at'])
+    op.execute(
+        """
+        UPDATE users
+        SET last_auto_collect_at = now() AT TIME ZONE 'utc',
+            next_auto_collect_at = now() AT TIME ZONE 'utc'
+        WHERE id IN (
+            SELECT user_id FROM user_upgrades
+            WHERE upgrade_type = 'auto_collect' AND current_level > 0
+        )
+        """
+    )
+
+
+def downgrade():
+    """
+    Drop auto-collect schedule columns
+    """
+    op.drop_index('ix_users_next_auto_collect_at', table_name='users')
+    op.drop_column('users', 'next_auto_collect_at')
+    op.drop_column('users', 'last_auto_collect_at')
@@ -0,0 +1,49 @@
+"""Add partial indexes for the expiry engine
+
+Revision ID: 011
+Revises: 010
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '011'
+down_revision = '010'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    """
+    Create partial indexes over boost, premium and insurance due times
+    (stale listings use ix_p2p_active_newest)
+    """
+    op.create_index(
+        'ix_bears_boost_until',
+        'bears',
+        ['boost_until'],
+        postgresql_where=sa.text('boost_until IS NOT NULL'),
+    )
+    op.create_index(
+        'ix_users_premium_until',
+        'users',
+        ['premium_until'],
+        postgresql_where=sa.text('is_premium'),
+    )
+    op.create_index(
+        'ix_bear_insurance_expires_at',
+        'bear_insurance',
+        ['expires_at'],
+        postgresql_where=sa.text('is_active'),
+    )
+
+
+def downgrade():
+    """
+    Drop expiry indexes
+    """
+    op.drop_index('ix_bear_insurance_expires_at', table_name='bear_insurance')
+    op.drop_index('ix_users_premium_until', table_name='users')
+    op.drop_index('ix_bears_boost_until', table_name='bears')
@@ -0,0 +1,114 @@
+"""Partition coin_transactions by month on created_at
+
+Revision ID: 012
+Revises: 011
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from datetime import datetime
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '012'
+down_revision = '011'
+branch_labels = None
+depends_on = None
+
+PARTITIONS_AHEAD = 2  # Как LEDGER_PARTITIONS_AHEAD в app/services/ledger_archive.py
+
+
+def _add_months(month: datetime, months: int) -> datetime:
+    index = month.year * 12 + month.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def upgrade():
+    """
+    Recreate coin_transactions as a RANGE (created_at) partitioned table:
+    one partition per month from the oldest row to PARTITIONS_AHEAD months
+    ahead, plus a default partition. Rows are copied over and the id
+    sequence is kept. coin_transaction_totals keeps per-user sums of
+    archived months
+    """
+    op.execute("UPDATE coin_transactions SET created_at = now() AT TIME ZONE 'utc' WHERE created_at IS NULL")
+    op.execute('ALTER TABLE coin_transactions RENAME TO coin_transactions_legacy')
+    op.execute('ALTER TABLE coin_transactions_legacy RENAME CONSTRAINT coin_transactions_pkey TO coin_transactions_legacy_pkey')
+    op.execute('ALTER INDEX ix_coin_transactions_user_id RENAME TO ix_coin_transactions_legacy_user_id')
+
+    op.execute(
+        """
+        CREATE TABLE coin_transactions (
+            id INTEGER NOT NULL DEFAULT nextval('coin_transactions_id_seq'),
+            user_id INTEGER NOT NULL REFERENCES users (id),
+            amount DOUBLE PRECISION NOT NULL,
+            transaction_type VARCHAR(50) NOT NULL,
+            description TEXT,
+            created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            PRIMARY KEY (id, created_at)
+        ) PARTITION BY RANGE (created_at)
+        """
+    )
+    op.execute('ALTER SEQUENCE coin_transactions_id_seq OWNED BY coin_transactions.id')
+    op.create_index('ix_coin_transactions_user_created', 'coin_transactions', ['user_id', 'created_at'])
+
+    oldest = op.get_bind().execute(sa.text('SELECT min(created_at) FROM coin_transactions_legacy')).scalar()
+    now = datetime.utcnow()
+    month = datetime((oldest or now).year, (oldest or now).month, 1)
+    last = _add_months(datetime(now.year, now.month, 1), PARTITIONS_AHEAD)
+    while month <= last:
+        op.execute(
+            f"CREATE TABLE coin_transactions_y{month:%Y}m{month:%m} PARTITION OF coin_transactions "
+            f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{_add_months(month, 1):%Y-%m-%d}')"
+        )
+        month = _add_months(month, 1)
+    op.execute('CREATE TABLE coin_transactions_default PARTITION OF coin_transactions DEFAULT')
+
+    op.execute(
+        """
+        INSERT INTO coin_transactions (id, user_id, amount, transaction_type, description, created_at)
+        SELECT id, user_id, amount, transaction_type, description, created_at
+        FROM coin_transactions_legacy
+        """
+    )
+    op.execute('DROP TABLE coin_transactions_legacy')
+
+    op.create_table(
+        'coin_transaction_totals',
+        sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id'), primary_key=True),
+        sa.Column('transaction_type', sa.String(50), primary_key=True),
+        sa.Column('amount', sa.Float(), nullable=False, server_default='0'),
+        sa.Column('count', sa.Integer(), nullable=False, server_default='0'),
+    )
+
+
+def downgrade():
+    """
+    Merge partitions back into a plain coin_transactions table (archived
+    months stay in their files)
+    """
+    op.drop_table('coin_transaction_totals')
+    op.execute(
+        """
+        CREATE TABLE coin_transactions_flat (
+            id INTEGER NOT NULL DEFAULT nextval('coin_transactions_id_seq'),
+            user_id INTEGER NOT NULL REFERENCES users (id),
+            amount DOUBLE PRECISION NOT NULL,
+            transaction_type VARCHAR(50) NOT NULL,
+            description TEXT,
+            created_at TIMESTAMP WITHOUT TIME ZONE
+        )
+        """
+    )
+    op.execute(
+        """
+        INSERT INTO coin_transactions_flat (id, user_id, amount, transaction_type, description, created_at)
+        SELECT id, user_id, amount, transaction_type, description, created_at
+        FROM coin_transactions
+        """
+    )
+    op.execute('ALTER SEQUENCE coin_transactions_id_seq OWNED BY coin_transactions_flat.id')
+    op.execute('DROP TABLE coin_transactions CASCADE')
+    op.execute('ALTER TABLE coin_transactions_flat RENAME TO coin_transactions')
+    op.execute('ALTER TABLE coin_transactions ADD CONSTRAINT coin_transactions_pkey PRIMARY KEY (id)')
+    op.create_index('ix_coin_transactions_user_id', 'coin_transactions', ['user_id'])
@@ -0,0 +1,50 @@
+"""Add payment_intents table for TON wallet top-ups
+
+Revision ID: 013
+Revises: 012
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '013'
+down_revision = '012'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    """
+    Create payment_intents with the admin queue index and a partial index
+    over open intents for expiry
+    """
+    op.create_table(
+        'payment_intents',
+        sa.Column('id', sa.String(32), primary_key=True),
+        sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id'), nullable=False),
+        sa.Column('package_id', sa.String(50), nullable=False),
+        sa.Column('ton_amount', sa.Numeric(10, 4), nullable=False),
+        sa.Column('memo', sa.String(100), nullable=False),
+        sa.Column('status', sa.String(20), nullable=False, server_default='pending'),
+        sa.Column('resolved_by', sa.Integer(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.Column('expires_at', sa.DateTime(), nullable=False),
+    )
+    op.create_index('ix_payment_intents_user_id', 'payment_intents', ['user_id'])
+    op.create_index('ix_payment_intents_status_created', 'payment_intents', ['status', 'created_at'])
+    op.create_index(
+        'ix_payment_intents_expires_at',
+        'payment_intents',
+        ['expires_at'],
+        postgresql_where=sa.text("status IN ('pending', 'waiting_confirmation')"),
+    )
+
+
+def downgrade():
+    """
+    Drop payment_intents
+    """
+    op.drop_table('payment_intents')
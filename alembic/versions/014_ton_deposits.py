@@ -0,0 +1,49 @@
+"""Add ton_deposits table for the deposit watcher
+
+Revision ID: 014
+Revises: 013
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '014'
+down_revision = '013'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    """
+    Create ton_deposits (one row per incoming transfer, keyed by tx hash)
+    and index payment intents by memo for deposit matching
+    """
+    op.create_table(
+        'ton_deposits',
+        sa.Column('tx_hash', sa.String(64), primary_key=True),
+        sa.Column('lt', sa.BigInteger(), nullable=False),
+        sa.Column('source', sa.String(100), nullable=True),
+        sa.Column('amount', sa.Numeric(20, 9), nullable=False),
+        sa.Column('memo', sa.String(255), nullable=True),
+        sa.Column('status', sa.String(20), nullable=False),
+        sa.Column('intent_id', sa.String(32), sa.ForeignKey('payment_intents.id'), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+    )
+    op.create_index('ix_ton_deposits_lt', 'ton_deposits', ['lt'])
+    # Наблюдатель ищет заявки по memo среди открытых и истёкших - без скана всех истёкших
+    op.create_index(
+        'ix_payment_intents_memo_status',
+        'payment_intents',
+        ['memo', 'status'],
+        postgresql_where=sa.text("status IN ('pending', 'waiting_confirmation', 'expired')"),
+    )
+
+
+def downgrade():
+    """
+    Drop ton_deposits and the memo index
+    """
+    op.drop_index('ix_payment_intents_memo_status', table_name='payment_intents')
+    op.drop_table('ton_deposits')
@@ -0,0 +1,40 @@
+"""Add stars_payments table for idempotent Telegram Stars credits
+
+Revision ID: 015
+Revises: 014
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '015'
+down_revision = '014'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    """
+    Create stars_payments keyed by telegram_payment_charge_id
+    """
+    op.create_table(
+        'stars_payments',
+        sa.Column('telegram_payment_charge_id', sa.String(255), primary_key=True),
+        sa.Column('provider_payment_charge_id', sa.String(255), nullable=True),
+        sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id'), nullable=False),
+        sa.Column('product', sa.String(20), nullable=False),
+        sa.Column('package_id', sa.String(50), nullable=False),
+        sa.Column('stars', sa.Integer(), nullable=False),
+        sa.Column('amount', sa.Float(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+    )
+    op.create_index('ix_stars_payments_user_id', 'stars_payments', ['user_id'])
+
+
+def downgrade():
+    """
+    Drop stars_payments
+    """
+    op.drop_table('stars_payments')
@@ -0,0 +1,52 @@
+"""Add withdrawal pipeline columns and queue indexes
+
+Revision ID: 016
+Revises: 015
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '016'
+down_revision = '015'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    """
+    Add batch / confirmation tracking columns and partial indexes over the
+    pending and processing queues
+    """
+    op.add_column('withdrawals', sa.Column('batch_id', sa.String(32), nullable=True))
+    op.add_column('withdrawals', sa.Column('claimed_at', sa.DateTime(), nullable=True))
+    op.add_column('withdrawals', sa.Column('check_attempts', sa.Integer(), nullable=False, server_default='0'))
+    op.add_column('withdrawals', sa.Column('next_check_at', sa.DateTime(), nullable=True))
+    op.create_index('ix_withdrawals_batch_id', 'withdrawals', ['batch_id'])
+    op.create_index(
+        'ix_withdrawals_pending',
+        'withdrawals',
+        ['created_at'],
+        postgresql_where=sa.text("status = 'pending'"),
+    )
+    op.create_index(
+        'ix_withdrawals_processing',
+        'withdrawals',
+        ['next_check_at'],
+        postgresql_where=sa.text("status = 'processing'"),
+    )
+
+
+def downgrade():
+    """
+    Drop withdrawal pipeline columns and indexes
+    """
+    op.drop_index('ix_withdrawals_processing', table_name='withdrawals')
+    op.drop_index('ix_withdrawals_pending', table_name='withdrawals')
+    op.drop_index('ix_withdrawals_batch_id', table_name='withdrawals')
+    op.drop_column('withdrawals', 'next_check_at')
+    op.drop_column('withdrawals', 'check_attempts')
+    op.drop_column('withdrawals', 'claimed_at')
+    op.drop_column('withdrawals', 'batch_id')
@@ -0,0 +1,40 @@
+"""Add analytics_events table
+
+Revision ID: 017
+Revises: 016
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = '017'
+down_revision = '016'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    """
+    Create the append-only analytics_events table with a (name, created_at)
+    index and a BRIN index over created_at
+    """
+    op.create_table(
+        'analytics_events',
+        sa.Column('id', sa.BigInteger(), primary_key=True, autoincrement=True),
+        sa.Column('name', sa.String(50), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=True),
+        sa.Column('properties', postgresql.JSONB(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+    )
+    op.create_index('ix_analytics_events_name_created', 'analytics_events', ['name', 'created_at'])
+    op.create_index('ix_analytics_events_created_brin', 'analytics_events', ['created_at'], postgresql_using='brin')
+
+
+def downgrade():
+    """
+    Drop analytics_events
+    """
+    op.drop_table('analytics_events')
@@ -0,0 +1,34 @@
+"""Add activity_bitmaps table for DAU / retention
+
+Revision ID: 018
+Revises: 017
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '018'
+down_revision = '017'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    """
+    Create activity_bitmaps: one bitmap of user ids per (kind, day)
+    """
+    op.create_table(
+        'activity_bitmaps',
+        sa.Column('kind', sa.String(10), primary_key=True),
+        sa.Column('day', sa.Date(), primary_key=True),
+        sa.Column('bitmap', sa.LargeBinary(), nullable=False),
+    )
+
+
+def downgrade():
+    """
+    Drop activity_bitmaps
+    """
+    op.drop_table('activity_bitmaps')
@@ -0,0 +1,32 @@
+"""case_history.bear_id: ON DELETE SET NULL
+
+Revision ID: 019
+Revises: 018
+Create Date: 2026-10-19 18:00:00.000000
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '019'
+down_revision = '018'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    """
+    History rows must not block selling or fusing a bear won from a case
+    """
+    op.drop_constraint('case_history_bear_id_fkey', 'case_history', type_='foreignkey')
+    op.create_foreign_key(
+        'case_history_bear_id_fkey', 'case_history', 'bears', ['bear_id'], ['id'], ondelete='SET NULL'
+    )
+
+
+def downgrade():
+    """
+    Restore the plain foreign key
+    """
+    op.drop_constraint('case_history_bear_id_fkey', 'case_history', type_='foreignkey')
+    op.create_foreign_key('case_history_bear_id_fkey', 'case_history', 'bears', ['bear_id'], ['id'])
@@ -0,0 +1,47 @@
+"""Foreign keys to bears: fusion output and listings SET NULL, insurance CASCADE
+
+Revision ID: 020
+Revises: 019
+Create Date: 2026-10-19 19:00:00.000000
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '020'
+down_revision = '019'
+branch_labels = None
+depends_on = None
+
+# (таблица, колонка, ondelete)
+REFERENCES = [
+    ('bear_fusions', 'output_bear_id', 'SET NULL'),
+    ('p2p_listings', 'bear_id', 'SET NULL'),
+    ('bear_insurance', 'bear_id', 'CASCADE'),
+]
+
+
+def _recreate_fk(table: str, column: str, ondelete: str | None):
+    name = f'{table}_{column}_fkey'
+    op.drop_constraint(name, table, type_='foreignkey')
+    op.create_foreign_key(name, table, 'bears', [column], ['id'], ondelete=ondelete)
+
+
+def upgrade():
+    """
+    Selling or fusing a bear must not fail on rows that reference it:
+    fusion and trade history lose the link, insurance goes with the bear
+    """
+    op.alter_column('p2p_listings', 'bear_id', nullable=True)
+    for table, column, ondelete in REFERENCES:
+        _recreate_fk(table, column, ondelete)
+
+
+def downgrade():
+    """
+    Restore the plain foreign keys; listings whose bear is gone are dropped
+    """
+    for table, column, _ in REFERENCES:
+        _recreate_fk(table, column, None)
+    op.execute('DELETE FROM p2p_listings WHERE bear_id IS NULL')
+    op.alter_column('p2p_listings', 'bear_id', nullable=False)
@@ -3,6 +3,7 @@ from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.database.database import get_session
 from app.services.features import FeaturesService
+from app.services.p2p_market import P2PMarketService
 from app.services.utils import get_current_user
 from pydantic import BaseModel
 from datetime import datetime
@@ -129,14 +130,36 @@ async def insure_bear(
 @router.get("/p2p-marketplace")
 async def get_marketplace(
     limit: int = 50,
-    offset: int = 0,
+    cursor: str | None = None,
+    sort: str = 'newest',
+    bear_type: str | None = None,
+    variant: int | None = None,
+    min_level: int | None = None,
+    max_level: int | None = None,
+    min_price: float | None = None,
+    max_price: float | None = None,
     session: AsyncSession = Depends(get_session),
 ):
-    """Get all available bears on P2P marketplace."""
-    listings = await FeaturesService.get_available_listings(session, limit, offset)
+    """Get available bears on P2P marketplace (filtered, keyset-paginated by cursor)."""
+    try:
+        page = await P2PMarketService.get_listings(
+            session,
+            limit=limit,
+            cursor=cursor,
+            sort=sort,
+            bear_type=bear_type,
+            variant=variant,
+            min_level=min_level,
+            max_level=max_level,
+            min_price=min_price,
+            max_price=max_price,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     return {
-        'listings': listings,
-        'count': len(listings),
+        'listings': page['listings'],
+        'count': len(page['listings']),
+        'next_cursor': page['next_cursor'],
     }
 
 
@@ -1,4 +1,5 @@
 """Bot initialization and dispatcher setup."""
+import asyncio
 import logging
 from aiogram import Bot, Dispatcher
 from aiogram.fsm.storage.memory import MemoryStorage
@@ -16,6 +17,9 @@ except Exception as e:
     logger.error(f"❌ Error creating bot: {e}")
     raise
 
+# Background tasks started in setup_bot and cancelled in close_bot
+background_tasks: list[asyncio.Task] = []
+
 
 def setup_handlers():
     """
@@ -75,6 +79,7 @@ def setup_middlewares():
     try:
         from app.middlewares.rate_limit import RateLimitMiddleware
         from app.middlewares.logging_middleware import LoggingMiddleware
+        from app.middlewares.activity import ActivityMiddleware
         
         # Add rate limiting
         dp.message.middleware(RateLimitMiddleware())
@@ -84,11 +89,68 @@ def setup_middlewares():
         dp.message.middleware(LoggingMiddleware())
         dp.callback_query.middleware(LoggingMiddleware())
         
+        # Add activity tracking
+        dp.message.middleware(ActivityMiddleware())
+        dp.callback_query.middleware(ActivityMiddleware())
+        
         logger.info("✅ Middlewares setup completed")
     except Exception as e:
         logger.warning(f"⚠️ Could not setup middlewares: {e}")
 
 
+def setup_background_tasks():
+    """
+    Start background workers (notification sender, ledger flusher, analytics events, activity, tournament scheduler, auto-collect, expiry, ledger archive, TON deposits, withdrawals).
+    """
+    from app.services.notifications import notification_queue
+    from app.services.ledger import ledger
+    from app.services.events import event_pipeline
+    from app.services.activity import activity
+    from app.services.tournament import tournament_worker
+    from app.services.auto_collect import auto_collect_worker
+    from app.services.expiry import expiry_engine
+    from app.services.ledger_archive import ledger_archive_worker
+    from app.services.ton_deposits import deposit_watcher
+    from app.services.withdrawals import withdrawal_pipeline
+    
+    notification_queue.start(bot)
+    ledger.start()
+    event_pipeline.start()
+    activity.start()
+    background_tasks.append(asyncio.create_task(tournament_worker()))
+    background_tasks.append(asyncio.create_task(auto_collect_worker()))
+    background_tasks.append(asyncio.create_task(expiry_engine.run()))
+    background_tasks.append(asyncio.create_task(ledger_archive_worker()))
+    if deposit_watcher.enabled:
+        background_tasks.append(asyncio.create_task(deposit_watcher.run()))
+    if withdrawal_pipeline.enabled:
+        background_tasks.append(asyncio.create_task(withdrawal_pipeline.run()))
+    logger.info("✅ Background tasks started")
+
+
+async def stop_background_tasks():
+    """
+    Cancel background workers and flush buffered ledger entries, analytics events and activity marks.
+    """
+    from app.services.notifications import notification_queue
+    from app.services.ledger import ledger
+    from app.services.events import event_pipeline
+    from app.services.activity import activity
+    from app.services.ton_deposits import deposit_watcher
+    from app.services.withdrawals import withdrawal_pipeline
+    
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    background_tasks.clear()
+    await deposit_watcher.stop()
+    await withdrawal_pipeline.stop()
+    await ledger.stop()
+    await event_pipeline.stop()
+    await activity.stop()
+    await notification_queue.stop()
+
+
 async def setup_bot():
     """
     Setup bot before polling starts.
@@ -109,8 +171,12 @@ async def setup_bot():
         logger.info("🔧 Setting up middlewares...")
         setup_middlewares()
         
-        logger.info("🚀 Bot setup completed successfully!")
+        # Start background workers
+        logger.info("🔧 Starting background tasks...")
+        setup_background_tasks()
         
+        logger.info("🚀 Bot setup completed successfully!")
+    
     except Exception as e:
         logger.error(f"❌ Error in setup_bot: {e}", exc_info=True)
         raise
@@ -121,6 +187,9 @@ async def close_bot():
     Close bot gracefully.
     """
     try:
+        logger.info("🔧 Stopping background tasks...")
+        await stop_background_tasks()
+        
         logger.info("🔧 Closing database connection...")
         from app.database.db import close_db
         await close_db()
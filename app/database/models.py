@@ -1,8 +1,9 @@
 """SQLAlchemy models for the database."""
 from datetime import datetime
 from sqlalchemy import (
-    Column, Integer, String, Float, Boolean, DateTime, Text, ForeignKey, Enum, Numeric
+    Column, Integer, String, Float, Boolean, Date, DateTime, Text, ForeignKey, Enum, Numeric, Index, UniqueConstraint, text, DDL, event, BigInteger, LargeBinary
 )
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import relationship
 import enum
 
@@ -33,6 +34,10 @@ class User(Base):
     referral_earnings_tier2 = Column(Float, default=0)  # Заработок со 2 круга (10%)
     referral_earnings_tier3 = Column(Float, default=0)  # Заработок с 3 круга (5%)
     
+    # Автосбор (улучшение auto_collect): доход начисляется фоновым воркером
+    last_auto_collect_at = Column(DateTime, nullable=True)
+    next_auto_collect_at = Column(DateTime, nullable=True, index=True)
+    
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
@@ -54,6 +59,11 @@ class User(Base):
     # Реферальная система: связь с реферером и рефералами
     referrer = relationship('User', remote_side=[id], foreign_keys=[referred_by], backref='referrals')
 
+    __table_args__ = (
+        # Движок истечения: ближайший конец премиума
+        Index('ix_users_premium_until', 'premium_until', postgresql_where=text('is_premium')),
+    )
+
 
 class Bear(Base):
     """Bear model."""
@@ -78,23 +88,55 @@ class Bear(Base):
     
     # Relationships
     owner = relationship('User', back_populates='bears', foreign_keys=[owner_id])
-    insurance = relationship('BearInsurance', back_populates='bear', uselist=False)
-    p2p_listings = relationship('P2PListing', back_populates='bear')
+    # Строки страховки и лотов удаляет/отвязывает сама БД (ondelete), без загрузки в сессию
+    insurance = relationship('BearInsurance', back_populates='bear', uselist=False, passive_deletes=True)
+    p2p_listings = relationship('P2PListing', back_populates='bear', passive_deletes=True)
+    
+    __table_args__ = (
+        # Покрывающий индекс для лимита медведей 1-го уровня (COUNT(*) без чтения строк)
+        Index('ix_bears_owner_type_level', 'owner_id', 'bear_type', 'level', 'is_on_sale'),
+        # Движок истечения: только медведи с активным бустом
+        Index('ix_bears_boost_until', 'boost_until', postgresql_where=text('boost_until IS NOT NULL')),
+    )
 
 
 class CoinTransaction(Base):
-    """Coin transaction model."""
+    """Coin transaction model (monthly partitions by created_at, see services/ledger_archive.py)."""
     __tablename__ = 'coin_transactions'
     
-    id = Column(Integer, primary_key=True)
-    user_id = Column(Integer, ForeignKey('users.id'), nullable=False, index=True)
+    # Ключ партиционированной таблицы обязан включать created_at
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
     amount = Column(Float, nullable=False)
     transaction_type = Column(String(50), nullable=False)  # 'earn', 'spend', 'quest_reward', 'referral', 'exchange_to_ton', 'exchange_from_ton', 'upgrade'
     description = Column(Text)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, primary_key=True, default=datetime.utcnow)
     
     # Relationships
     user = relationship('User', back_populates='coins_transactions')
+    
+    __table_args__ = (
+        Index('ix_coin_transactions_user_created', 'user_id', 'created_at'),
+        {'postgresql_partition_by': 'RANGE (created_at)'},
+    )
+
+
+# Свежая БД (init_db): партиция по умолчанию, месячные создаёт LedgerArchiveService.ensure_partitions
+event.listen(
+    CoinTransaction.__table__,
+    'after_create',
+    DDL('CREATE TABLE IF NOT EXISTS coin_transactions_default PARTITION OF coin_transactions DEFAULT'),
+)
+
+
+class CoinTransactionTotal(Base):
+    """Суммы по архивированным месяцам coin_transactions (строки уже в файлах архива)."""
+    __tablename__ = 'coin_transaction_totals'
+    
+    user_id = Column(Integer, ForeignKey('users.id'), primary_key=True)
+    transaction_type = Column(String(50), primary_key=True)
+    amount = Column(Float, default=0.0, nullable=False)
+    count = Column(Integer, default=0, nullable=False)
 
 
 class Withdrawal(Base):
@@ -113,8 +155,20 @@ class Withdrawal(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     completed_at = Column(DateTime, nullable=True)
     
+    # Конвейер выплат (services/withdrawals.py)
+    batch_id = Column(String(32), nullable=True, index=True)  # Одна пачка = один перевод, ключ идемпотентности отправителя
+    claimed_at = Column(DateTime, nullable=True)
+    check_attempts = Column(Integer, default=0, nullable=False)
+    next_check_at = Column(DateTime, nullable=True)
+    
     # Relationships
     user = relationship('User', back_populates='withdrawals')
+    
+    __table_args__ = (
+        # Очередь на отправку и очередь проверки подтверждений
+        Index('ix_withdrawals_pending', 'created_at', postgresql_where=text("status = 'pending'")),
+        Index('ix_withdrawals_processing', 'next_check_at', postgresql_where=text("status = 'processing'")),
+    )
 
 
 class Subscription(Base):
@@ -256,7 +310,7 @@ class CaseHistory(Base):
     reward_type = Column(String(50), nullable=False)  # 'coins', 'ton', 'bear', 'empty'
     reward_value = Column(Float, nullable=False)  # Сколько получено
     case_cost = Column(Float, nullable=False)  # Сколько потратил
-    bear_id = Column(Integer, ForeignKey('bears.id'), nullable=True)  # Если получил медведя
+    bear_id = Column(Integer, ForeignKey('bears.id', ondelete='SET NULL'), nullable=True)  # Если получил медведя (NULL после продажи/переплавки)
     opened_at = Column(DateTime, default=datetime.utcnow)
     
     # Relationships
@@ -268,7 +322,7 @@ class BearInsurance(Base):
     __tablename__ = 'bear_insurance'
     
     id = Column(Integer, primary_key=True)
-    bear_id = Column(Integer, ForeignKey('bears.id'), nullable=False, unique=True, index=True)
+    bear_id = Column(Integer, ForeignKey('bears.id', ondelete='CASCADE'), nullable=False, unique=True, index=True)
     user_id = Column(Integer, ForeignKey('users.id'), nullable=False, index=True)
     is_active = Column(Boolean, default=True)  # Активна ли страховка
     insurance_type = Column(String(50), default='24h')  # '24h', '48h', 'permanent'
@@ -280,17 +334,26 @@ class BearInsurance(Base):
     bear = relationship('Bear', back_populates='insurance')
     user = relationship('User', back_populates='bear_insurance')
 
+    __table_args__ = (
+        # Движок истечения: только действующие страховки
+        Index('ix_bear_insurance_expires_at', 'expires_at', postgresql_where=text('is_active')),
+    )
+
 
 class P2PListing(Base):
     """P2P торговля медведями между игроками."""
     __tablename__ = 'p2p_listings'
     
     id = Column(Integer, primary_key=True)
-    bear_id = Column(Integer, ForeignKey('bears.id'), nullable=False, index=True)
+    bear_id = Column(Integer, ForeignKey('bears.id', ondelete='SET NULL'), nullable=True, index=True)  # NULL после продажи/переплавки медведя
     seller_id = Column(Integer, ForeignKey('users.id'), nullable=False, index=True)
     buyer_id = Column(Integer, ForeignKey('users.id'), nullable=True, index=True)  # None = выставлено на продажу
     price_coins = Column(Float, nullable=False)  # Цена в коинах
     status = Column(String(20), default='active')  # 'active', 'sold', 'cancelled'
+    # Копия характеристик медведя на момент выставления (для фильтров стакана без JOIN)
+    bear_type = Column(String(50), nullable=True)
+    bear_variant = Column(Integer, nullable=True)
+    bear_level = Column(Integer, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     sold_at = Column(DateTime, nullable=True)
     
@@ -298,6 +361,18 @@ class P2PListing(Base):
     bear = relationship('Bear', back_populates='p2p_listings')
     seller = relationship('User', back_populates='p2p_listings_as_seller', foreign_keys=[seller_id])
     buyer = relationship('User', back_populates='p2p_listings_as_buyer', foreign_keys=[buyer_id])
+    
+    # Частичные индексы стакана: только активные лоты, по одному на форму фильтра
+    __table_args__ = (
+        Index('ix_p2p_active_newest', 'created_at', 'id', postgresql_where=text("status = 'active'")),
+        Index('ix_p2p_active_price', 'price_coins', 'id', postgresql_where=text("status = 'active'")),
+        Index('ix_p2p_active_type_newest', 'bear_type', 'created_at', 'id', postgresql_where=text("status = 'active'")),
+        Index('ix_p2p_active_type_price', 'bear_type', 'price_coins', 'id', postgresql_where=text("status = 'active'")),
+        Index('ix_p2p_active_type_variant_price', 'bear_type', 'bear_variant', 'price_coins', 'id', postgresql_where=text("status = 'active'")),
+        Index('ix_p2p_active_type_level_price', 'bear_type', 'bear_level', 'price_coins', 'id', postgresql_where=text("status = 'active'")),
+        # Прогрев индекса рыночных цен по недавним продажам
+        Index('ix_p2p_sold_at', 'sold_at', postgresql_where=text("status = 'sold'")),
+    )
 
 
 class CaseGuarantee(Base):
@@ -350,7 +425,7 @@ class BearFusion(Base):
     input_count = Column(Integer, nullable=False)  # Количество (10, 50, 500 и т.д.)
     input_type = Column(String(50), nullable=False)  # 'common', 'rare', 'epic'
     output_type = Column(String(50), nullable=False)  # Какой тип получим ('rare', 'epic', 'legendary')
-    output_bear_id = Column(Integer, ForeignKey('bears.id'), nullable=True)  # ID полученного медведя
+    output_bear_id = Column(Integer, ForeignKey('bears.id', ondelete='SET NULL'), nullable=True)  # ID полученного медведя (NULL после продажи/переплавки)
     status = Column(String(20), default='pending')  # 'pending', 'completed', 'failed'
     completed_at = Column(DateTime, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
@@ -370,3 +445,163 @@ class UserUpgrade(Base):
     
     # Relationships
     user = relationship('User', back_populates='upgrades')
+
+
+class PvPStats(Base):
+    """PvP статистика - рейтинг Эло, победы и поражения."""
+    __tablename__ = 'pvp_stats'
+    
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False, unique=True, index=True)
+    rating = Column(Integer, default=1000, nullable=False, index=True)  # Рейтинг Эло
+    wins = Column(Integer, default=0)
+    losses = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class Tournament(Base):
+    """Еженедельный PvP турнир (швейцарская система)."""
+    __tablename__ = 'tournaments'
+    
+    id = Column(Integer, primary_key=True)
+    week_start = Column(DateTime, nullable=False, unique=True)  # Понедельник 00:00 UTC
+    status = Column(String(20), default='registration', index=True)  # 'registration', 'running', 'finished', 'cancelled'
+    registration_ends_at = Column(DateTime, nullable=False)
+    entry_fee = Column(Float, nullable=False)
+    prize_pool = Column(Float, default=0)
+    players_count = Column(Integer, default=0)
+    rounds = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
+
+
+class TournamentEntry(Base):
+    """Участник турнира."""
+    __tablename__ = 'tournament_entries'
+    
+    id = Column(Integer, primary_key=True)
+    tournament_id = Column(Integer, ForeignKey('tournaments.id'), nullable=False, index=True)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False, index=True)
+    team_power = Column(Float, default=0)  # Сила команды (обновляется при старте)
+    score = Column(Integer, default=0)  # Побед
+    place = Column(Integer, nullable=True)
+    prize_coins = Column(Float, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        UniqueConstraint('tournament_id', 'user_id', name='uq_tournament_entry_user'),
+    )
+
+
+class TournamentMatch(Base):
+    """Матч турнира (player2_id пустой - свободный проход)."""
+    __tablename__ = 'tournament_matches'
+    
+    id = Column(Integer, primary_key=True)
+    tournament_id = Column(Integer, ForeignKey('tournaments.id'), nullable=False, index=True)
+    round = Column(Integer, nullable=False)
+    player1_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    player2_id = Column(Integer, ForeignKey('users.id'), nullable=True)
+    winner_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class UserQuota(Base):
+    """Дневные лимиты действий (реклама, колесо фортуны) - резерв, если Redis недоступен."""
+    __tablename__ = 'user_quotas'
+    
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    action = Column(String(50), nullable=False)  # 'ad_reward', 'fortune_wheel'
+    day = Column(Date, nullable=False)  # UTC день
+    used = Column(Integer, default=0, nullable=False)
+    
+    __table_args__ = (
+        UniqueConstraint('user_id', 'action', 'day', name='uq_user_quota_day'),
+    )
+
+
+class PaymentIntent(Base):
+    """Заявка на пополнение TON (перевод с кошелька с комментарием), см. services/payment_intents.py."""
+    __tablename__ = 'payment_intents'
+    
+    id = Column(String(32), primary_key=True)  # uuid4().hex - не угадывается и не повторяется
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False, index=True)
+    package_id = Column(String(50), nullable=False)
+    ton_amount = Column(Numeric(10, 4), nullable=False)
+    memo = Column(String(100), nullable=False)  # Комментарий к переводу: USER_{telegram_id}_{package_id}
+    status = Column(String(20), default='pending', nullable=False)  # 'pending', 'waiting_confirmation', 'approved', 'rejected', 'expired'
+    resolved_by = Column(Integer, nullable=True)  # Telegram ID админа
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    expires_at = Column(DateTime, nullable=False)
+    
+    __table_args__ = (
+        # Очередь админа: заявки в статусе по времени создания
+        Index('ix_payment_intents_status_created', 'status', 'created_at'),
+        # Движок истечения: только открытые заявки
+        Index(
+            'ix_payment_intents_expires_at', 'expires_at',
+            postgresql_where=text("status IN ('pending', 'waiting_confirmation')")
+        ),
+        # Сопоставление депозитов по memo: только заявки, которые ещё можно зачесть
+        Index(
+            'ix_payment_intents_memo_status', 'memo', 'status',
+            postgresql_where=text("status IN ('pending', 'waiting_confirmation', 'expired')")
+        ),
+    )
+
+
+class TonDeposit(Base):
+    """Входящий перевод на адрес пополнения (ключ - хеш транзакции, поэтому зачисляется один раз)."""
+    __tablename__ = 'ton_deposits'
+    
+    tx_hash = Column(String(64), primary_key=True)
+    lt = Column(BigInteger, nullable=False, index=True)  # Логическое время - курсор наблюдателя
+    source = Column(String(100), nullable=True)
+    amount = Column(Numeric(20, 9), nullable=False)  # TON
+    memo = Column(String(255), nullable=True)
+    status = Column(String(20), nullable=False)  # 'credited', 'unmatched'
+    intent_id = Column(String(32), ForeignKey('payment_intents.id'), nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+
+class StarsPayment(Base):
+    """Оплата Telegram Stars (ключ - telegram_payment_charge_id, поэтому повторная доставка не начисляет дважды)."""
+    __tablename__ = 'stars_payments'
+    
+    telegram_payment_charge_id = Column(String(255), primary_key=True)
+    provider_payment_charge_id = Column(String(255), nullable=True)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False, index=True)
+    product = Column(String(20), nullable=False)  # 'ton', 'coins'
+    package_id = Column(String(50), nullable=False)
+    stars = Column(Integer, nullable=False)
+    amount = Column(Float, nullable=False)  # Начислено (TON или коинов)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+
+class AnalyticsEvent(Base):
+    """Событие аналитики (только добавление; пишется пачками из services/events.py)."""
+    __tablename__ = 'analytics_events'
+    
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    name = Column(String(50), nullable=False)  # Имя из EVENT_SCHEMA
+    user_id = Column(Integer, nullable=True)  # Без внешнего ключа: журнал не должен мешать удалению пользователей
+    properties = Column(JSONB, nullable=False, default=dict)
+    created_at = Column(DateTime, nullable=False)  # Время события, а не записи
+    
+    __table_args__ = (
+        Index('ix_analytics_events_name_created', 'name', 'created_at'),
+        # Таблица растёт по времени - BRIN почти ничего не весит
+        Index('ix_analytics_events_created_brin', 'created_at', postgresql_using='brin'),
+    )
+
+
+class ActivityBitmap(Base):
+    """Битмап активности за день: бит N - пользователь с users.id = N (services/activity.py)."""
+    __tablename__ = 'activity_bitmaps'
+    
+    kind = Column(String(10), primary_key=True)  # 'active', 'new'
+    day = Column(Date, primary_key=True)
+    bitmap = Column(LargeBinary, nullable=False)  # little-endian
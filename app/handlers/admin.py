@@ -8,6 +8,10 @@ from sqlalchemy import select
 from app.database.db import get_session
 from app.database.models import User, Bear
 from app.services.bears import BearsService, BEAR_CLASSES, BEAR_NAMES
+from app.services.ledger import ledger
+from app.services.notifications import notification_queue
+from app.services.payment_intents import PaymentIntentService
+from app.services.analytics import analytics
 from config import settings
 from datetime import datetime, timedelta
 from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
@@ -41,7 +45,10 @@ async def admin_menu(message: Message):
         "/admin_boost_bear <user_id> <bear_id> <hours> - Буст медведя\n"
         "/admin_boost_all <user_id> <hours> - Буст всем медведям\n"
         "/admin_create_bear <user_id> <type> <variant> - Создать медведя\n"
-        "/admin_user_info <user_id> - Инфо о пользователе\n\n"
+        "/admin_user_info <user_id> - Инфо о пользователе\n"
+        "/admin_metrics - Метрики очередей\n"
+        "/admin_payments - Заявки на пополнение TON\n"
+        "/admin_activity - DAU / WAU / MAU и удержание\n\n"
         "🔗 **Напримеры**:\n"
         "/admin_give_vip 123456789 30\n"
         "/admin_give_coins 123456789 10000\n"
@@ -414,3 +421,86 @@ async def admin_user_info(message: Message):
     except Exception as e:
         logger.error(f"❌ Error: {e}", exc_info=True)
         await message.answer(f"❌ Ошибка: {str(e)}")
+
+
+@router.message(Command("admin_metrics"))
+async def admin_metrics(message: Message):
+    """
+    Show background queue metrics (ledger buffer, notifications).
+    """
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ Не имеете доступа")
+        return
+    
+    metrics = ledger.metrics()
+    await message.answer(
+        f"📊 Метрики\n\n"
+        f"🧾 Журнал транзакций:\n"
+        f"├ В буфере: {metrics['buffer_depth']}\n"
+        f"├ Записано: {metrics['flushed_total']} за {metrics['flush_count']} сбросов\n"
+        f"├ Отброшено: {metrics['dropped_total']}\n"
+        f"└ Сброс: последний {metrics['last_flush_ms']} мс, средний {metrics['avg_flush_ms']} мс, макс {metrics['max_flush_ms']} мс\n\n"
+        f"🔔 Уведомления в очереди: {notification_queue.pending()}"
+    )
+
+
+@router.message(Command("admin_payments"))
+async def admin_payments(message: Message):
+    """
+    Show TON top-up intents waiting for confirmation, oldest first.
+    """
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ Не имеете доступа")
+        return
+    
+    try:
+        async with get_session() as session:
+            queue = await PaymentIntentService.admin_queue(session)
+        
+        if not queue:
+            await message.answer("✅ Нет заявок на проверку")
+            return
+        
+        for intent, user in queue:
+            await message.answer(
+                f"💎 {float(intent.ton_amount)} TON ({intent.package_id})\n"
+                f"👤 {user.first_name or user.username or 'без имени'} (ID: {user.telegram_id})\n"
+                f"📝 {intent.memo}\n"
+                f"⏰ {intent.created_at.strftime('%d.%m.%Y %H:%M')}",
+                reply_markup=InlineKeyboardMarkup(inline_keyboard=[[
+                    InlineKeyboardButton(text="✅ Подтвердить", callback_data=f"admin_approve:{intent.id}"),
+                    InlineKeyboardButton(text="❌ Отклонить", callback_data=f"admin_reject:{intent.id}"),
+                ]])
+            )
+    except Exception as e:
+        logger.error(f"❌ Error: {e}", exc_info=True)
+        await message.answer(f"❌ Ошибка: {str(e)}")
+
+
+@router.message(Command("admin_activity"))
+async def admin_activity(message: Message):
+    """
+    Show DAU / WAU / MAU and D1 / D7 / D30 retention from the activity bitmaps.
+    """
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ Не имеете доступа")
+        return
+    
+    try:
+        async with get_session() as session:
+            dau = await analytics.get_active_users(session, 1)
+            wau = await analytics.get_active_users(session, 7)
+            mau = await analytics.get_active_users(session, 30)
+            retention = [(days, await analytics.get_retention_rate(session, days)) for days in (1, 7, 30)]
+        
+        await message.answer(
+            f"📈 Активность\n\n"
+            f"├ DAU: {dau:,}\n"
+            f"├ WAU: {wau:,}\n"
+            f"└ MAU: {mau:,}\n\n"
+            f"🔁 Удержание (когорта регистрации):\n"
+            + "\n".join(f"• D{days}: {rate:.1f}%" for days, rate in retention)
+        )
+    except Exception as e:
+        logger.error(f"❌ Error: {e}", exc_info=True)
+        await message.answer(f"❌ Ошибка: {str(e)}")
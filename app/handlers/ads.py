@@ -6,7 +6,9 @@ from aiogram.types import CallbackQuery, InlineKeyboardButton, InlineKeyboardMar
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 from app.database.db import get_session
-from app.database.models import User, CoinTransaction
+from app.database.models import User
+from app.services.ledger import ledger
+from app.services.quota import quota_service
 
 logger = logging.getLogger(__name__)
 router = Router()
@@ -25,17 +27,10 @@ async def watch_ad_menu(query: CallbackQuery):
             user_result = await session.execute(user_query)
             user = user_result.scalar_one()
             
-            # Count ads watched today
-            today_start = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
-            ads_query = select(CoinTransaction).where(
-                CoinTransaction.user_id == user.id,
-                CoinTransaction.transaction_type == 'ad_reward',
-                CoinTransaction.created_at >= today_start
-            )
-            ads_result = await session.execute(ads_query)
-            ads_watched = len(ads_result.scalars().all())
+            # Ads watched today (daily quota counter)
+            ads_watched = await quota_service.get_used(session, user.id, 'ad_reward')
             
-            remaining = AD_DAILY_LIMIT - ads_watched
+            remaining = max(AD_DAILY_LIMIT - ads_watched, 0)
             
             text = (
                 f"📺 **Реклама**\n\n"
@@ -80,17 +75,9 @@ async def do_watch_ad(query: CallbackQuery):
             user_result = await session.execute(user_query)
             user = user_result.scalar_one()
             
-            # Count ads watched today
-            today_start = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
-            ads_query = select(CoinTransaction).where(
-                CoinTransaction.user_id == user.id,
-                CoinTransaction.transaction_type == 'ad_reward',
-                CoinTransaction.created_at >= today_start
-            )
-            ads_result = await session.execute(ads_query)
-            ads_watched = len(ads_result.scalars().all())
-            
-            if ads_watched >= AD_DAILY_LIMIT:
+            # Check and consume daily quota atomically
+            ads_watched = await quota_service.consume(session, user.id, 'ad_reward', AD_DAILY_LIMIT)
+            if ads_watched is None:
                 await query.answer("⏰ Лимит просмотров исчерпан!", show_alert=True)
                 return
             
@@ -98,23 +85,22 @@ async def do_watch_ad(query: CallbackQuery):
             user.coins += AD_REWARD_COINS
             
             # Log transaction
-            transaction = CoinTransaction(
-                user_id=user.id,
-                amount=AD_REWARD_COINS,
-                transaction_type='ad_reward',
-                description='Просмотр рекламы'
-            )
-            session.add(transaction)
+            ledger.defer(session, [(
+                user.id,
+                AD_REWARD_COINS,
+                'ad_reward',
+                'Просмотр рекламы'
+            )])
             
             await session.commit()
             
-            remaining = AD_DAILY_LIMIT - ads_watched - 1
+            remaining = AD_DAILY_LIMIT - ads_watched
             
             text = (
                 f"✅ **Награда получена!**\n\n"
                 f"🎁 +{AD_REWARD_COINS} Coins\n"
                 f"💼 Новый баланс: {user.coins:,.0f} Coins\n\n"
-                f"📊 Просмотрено сегодня: {ads_watched + 1}/{AD_DAILY_LIMIT}\n"
+                f"📊 Просмотрено сегодня: {ads_watched}/{AD_DAILY_LIMIT}\n"
                 f"⏳ Осталось: {remaining} просмотров\n\n"
                 f"💡 {'Смотрите еще!' if remaining > 0 else 'Приходите завтра!'}"
             )
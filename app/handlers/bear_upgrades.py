@@ -47,7 +47,7 @@ async def upgrade_bear_menu(query: CallbackQuery):
                 return
             
             can_evolve = EVOLUTION_PATHS.get(bear.bear_type) is not None
-            has_boost = bear.boost_until and bear.boost_until > datetime.utcnow()
+            has_boost = bear.boost_until is not None
             
             text = (
                 f"🔧 **Улучшение медведя**\n\n"
@@ -59,7 +59,7 @@ async def upgrade_bear_menu(query: CallbackQuery):
             
             if has_boost:
                 boost_time_left = bear.boost_until - datetime.utcnow()
-                hours = boost_time_left.total_seconds() / 3600
+                hours = max(boost_time_left.total_seconds(), 0) / 3600
                 text += f"⚡ Активный буст: {bear.boost_multiplier:.1f}x ({hours:.1f}ч)\n\n"
             
             text += (
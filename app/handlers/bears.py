@@ -7,7 +7,8 @@ from aiogram.fsm.state import State, StatesGroup
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.database.db import get_session
 from app.services.bears import BearsService
-from app.services.features import FeaturesService
+from app.services.features import FeaturesService, FUSION_INPUT_COUNT, FUSION_OUTPUTS
+from app.services.p2p_market import P2PMarketService, p2p_price_index
 from app.database.models import User, Bear
 from sqlalchemy import select
 from app.keyboards.main_menu import get_main_menu
@@ -17,6 +18,10 @@ import logging
 logger = logging.getLogger(__name__)
 router = Router()
 
+# P2P маркет: размер страницы и фильтры по типу
+P2P_PAGE_SIZE = 10
+P2P_TYPE_FILTERS = ['common', 'rare', 'epic', 'legendary']
+
 
 class BearStates(StatesGroup):
     """States for bear management."""
@@ -422,17 +427,44 @@ async def p2p_sell_bear(query: CallbackQuery, state: FSMContext):
             class_info = BearsService.get_bear_class_info(bear.bear_type)
             stats = BearsService.get_bear_stats(bear.bear_type, bear.variant)  # ✅ FIX!
             
+            # Рыночная подсказка из индекса цен (O(1) после прогрева)
+            await p2p_price_index.ensure_loaded(session)
+            market = p2p_price_index.get_stats(bear.bear_type, bear.variant, bear.level)
+            suggested_price = p2p_price_index.suggest_price(
+                bear.bear_type, bear.variant, bear.level, floor=stats['sell']
+            )
+            
+            market_text = "📊 Рынок: сделок пока не было\n\n"
+            if market:
+                median_text = f"{market['median_price']:.0f} коинов" if market['median_price'] is not None else "—"
+                last_text = f"{market['last_price']:.0f} коинов" if market['last_price'] is not None else "—"
+                market_text = (
+                    f"📊 **Рынок** ({'этот вариант' if market['exact'] else 'этот класс'}):\n"
+                    f"├ Медиана: {median_text}\n"
+                    f"├ Последняя сделка: {last_text}\n"
+                    f"└ Объём 24ч: {market['trades_24h']} сделок / {market['volume_24h']:.0f} коинов\n\n"
+                )
+            
             text = (
                 f"📤 **Выставить на P2P**\n\n"
                 f"{class_info['color']} {bear.name} ({class_info['rarity']})\n"
                 f"Уровень: {bear.level}\n\n"
+                f"{market_text}"
                 f"💬 Введите цену в коинах:\n"
                 f"Мин. {stats['sell']} коинов"  # ✅ FIX!
             )
             
-            keyboard = InlineKeyboardMarkup(inline_keyboard=[
-                [InlineKeyboardButton(text="❌ Отмена", callback_data=f"bear_detail:{bear_id}")],
-            ])
+            keyboard = InlineKeyboardMarkup(inline_keyboard=[])
+            if suggested_price:
+                keyboard.inline_keyboard.append([
+                    InlineKeyboardButton(
+                        text=f"💡 Выставить за {suggested_price:.0f}",
+                        callback_data=f"p2p_sell_at:{bear_id}:{suggested_price:.0f}"
+                    )
+                ])
+            keyboard.inline_keyboard.append(
+                [InlineKeyboardButton(text="❌ Отмена", callback_data=f"bear_detail:{bear_id}")]
+            )
             
             await state.set_state(BearStates.waiting_for_p2p_price)
             await state.update_data(bear_id=bear_id)
@@ -448,6 +480,33 @@ async def p2p_sell_bear(query: CallbackQuery, state: FSMContext):
         await query.answer(f"❌ Ошибка: {str(e)}", show_alert=True)
 
 
+@router.callback_query(F.data.startswith("p2p_sell_at:"))
+async def p2p_sell_at_suggested(query: CallbackQuery, state: FSMContext):
+    """
+    List bear on P2P at the suggested market price.
+    """
+    try:
+        await state.clear()
+        parts = query.data.split(":")
+        bear_id = int(parts[1])
+        price = float(parts[2])
+        
+        async with get_session() as session:
+            user_query = select(User).where(User.telegram_id == query.from_user.id)
+            user_result = await session.execute(user_query)
+            user = user_result.scalar_one()
+            
+            try:
+                await FeaturesService.list_bear_for_sale(session, bear_id, user.id, price)
+                await query.answer(f"✅ Выставлен за {price:.0f} коинов!")
+                await bears_list(query, state)
+            except ValueError as e:
+                await query.answer(f"❌ {str(e)}", show_alert=True)
+    except Exception as e:
+        logger.error(f"❌ Error in p2p_sell_at_suggested: {e}", exc_info=True)
+        await query.answer(f"❌ Ошибка: {str(e)}", show_alert=True)
+
+
 @router.message(BearStates.waiting_for_p2p_price)
 async def process_p2p_price(message: Message, state: FSMContext):
     """
@@ -491,13 +550,44 @@ async def process_p2p_price(message: Message, state: FSMContext):
 # ============ P2P MARKET ============
 
 @router.callback_query(F.data == "p2p_market")
+@router.callback_query(F.data.startswith("p2p_mk:"))
 async def p2p_market(query: CallbackQuery):
     """
     Show P2P marketplace.
+    Callback: p2p_mk:{type|all}:{sort}:{cursor} - filter, sort and keyset page.
     """
     try:
+        bear_type, sort, cursor = None, 'newest', None
+        if query.data.startswith("p2p_mk:"):
+            _, type_part, sort, cursor = query.data.split(":", 3)
+            bear_type = None if type_part == "all" else type_part
+            cursor = cursor or None
+        type_part = bear_type or "all"
+        
         async with get_session() as session:
-            listings = await FeaturesService.get_available_listings(session, limit=10)
+            page = await P2PMarketService.get_listings(
+                session, limit=P2P_PAGE_SIZE, cursor=cursor, sort=sort, bear_type=bear_type
+            )
+            listings = page['listings']
+            
+            # Фильтр по типу и сортировка
+            filter_buttons = [
+                InlineKeyboardButton(
+                    text=f"{'• ' if bear_type is None else ''}Все",
+                    callback_data=f"p2p_mk:all:{sort}:"
+                )
+            ]
+            for filter_type in P2P_TYPE_FILTERS:
+                filter_info = BearsService.get_bear_class_info(filter_type)
+                filter_buttons.append(InlineKeyboardButton(
+                    text=f"{'• ' if bear_type == filter_type else ''}{filter_info['color']}",
+                    callback_data=f"p2p_mk:{filter_type}:{sort}:"
+                ))
+            other_sort = 'cheapest' if sort == 'newest' else 'newest'
+            sort_button = InlineKeyboardButton(
+                text="💰 Сначала дешёвые" if other_sort == 'cheapest' else "🆕 Сначала новые",
+                callback_data=f"p2p_mk:{type_part}:{other_sort}:"
+            )
             
             if not listings:
                 text = (
@@ -506,6 +596,7 @@ async def p2p_market(query: CallbackQuery):
                     "Будьте первым кто выставит медведя на продажу!"
                 )
                 keyboard = InlineKeyboardMarkup(inline_keyboard=[
+                    filter_buttons,
                     [InlineKeyboardButton(text="⬅️ Назад", callback_data="bears")],
                 ])
             else:
@@ -528,6 +619,15 @@ async def p2p_market(query: CallbackQuery):
                             callback_data=f"p2p_buy:{listing['listing_id']}"
                         )
                     ])
+                keyboard.inline_keyboard.append(filter_buttons)
+                keyboard.inline_keyboard.append([sort_button])
+                if page['next_cursor']:
+                    keyboard.inline_keyboard.append([
+                        InlineKeyboardButton(
+                            text="Далее ➡️",
+                            callback_data=f"p2p_mk:{type_part}:{sort}:{page['next_cursor']}"
+                        )
+                    ])
                 keyboard.inline_keyboard.append([InlineKeyboardButton(text="⬅️ Назад", callback_data="bears")])
             
             try:
@@ -676,48 +776,50 @@ async def fusion_start(query: CallbackQuery, state: FSMContext):
     try:
         bear_type = query.data.split(":")[1]
         
+        if bear_type not in FUSION_OUTPUTS:
+            await query.answer("❌ Неверный тип")
+            return
+        
         async with get_session() as session:
             user_query = select(User).where(User.telegram_id == query.from_user.id)
             user_result = await session.execute(user_query)
             user = user_result.scalar_one()
             
-            # Get bears of this type
-            bears_query = select(Bear).where(
-                Bear.owner_id == user.id,
-                Bear.bear_type == bear_type,
-                Bear.is_on_sale == False
-            )
-            bears_result = await session.execute(bears_query)
-            bears = bears_result.scalars().all()
+            # Only ids of fusable bears, cheapest first
+            candidate_ids = await FeaturesService.get_fusion_candidates(session, user.id, bear_type)
+            sets_count = len(candidate_ids) // FUSION_INPUT_COUNT
             
-            if len(bears) < 10:
+            if sets_count == 0:
                 await query.answer(
-                    f"❌ Недостаточно медведей!\nНужно: 10\nЕсть: {len(bears)}",
+                    f"❌ Недостаточно медведей!\nНужно: {FUSION_INPUT_COUNT}\nЕсть: {len(candidate_ids)}",
                     show_alert=True
                 )
                 return
             
-            # Take first 10
-            selected_bears = bears[:10]
-            bear_ids = [b.id for b in selected_bears]
-            
             class_info = BearsService.get_bear_class_info(bear_type)
-            output_type = 'rare' if bear_type == 'common' else 'epic' if bear_type == 'rare' else 'legendary'
-            output_info = BearsService.get_bear_class_info(output_type)
+            output_info = BearsService.get_bear_class_info(FUSION_OUTPUTS[bear_type])
             
             text = (
                 f"🔥 **Подтверждение переплавки**\n\n"
-                f"{class_info['color']} 10x {class_info['rarity']}\n"
+                f"{class_info['color']} {FUSION_INPUT_COUNT}x {class_info['rarity']}\n"
                 f"⬇️\n"
                 f"{output_info['color']} 1x {output_info['rarity']}\n\n"
-                f"⚠️ Все 10 медведей будут уничтожены!"
+                f"📦 Доступно наборов: {sets_count} (медведей: {len(candidate_ids)})\n"
+                f"💡 В переплавку идут самые дешёвые медведи\n\n"
+                f"⚠️ Выбранные медведи будут уничтожены!"
             )
             
+            confirm_buttons = [
+                InlineKeyboardButton(text="✅ Переплавить 1", callback_data=f"fusion_confirm:{bear_type}:1"),
+            ]
+            if sets_count > 1:
+                confirm_buttons.append(
+                    InlineKeyboardButton(text=f"🔥 Все ({sets_count})", callback_data=f"fusion_confirm:{bear_type}:all")
+                )
+            
             keyboard = InlineKeyboardMarkup(inline_keyboard=[
-                [
-                    InlineKeyboardButton(text="✅ Подтвердить", callback_data=f"fusion_confirm:{bear_type}:{','.join(map(str, bear_ids))}"),
-                    InlineKeyboardButton(text="❌ Отмена", callback_data="fusion_menu"),
-                ],
+                confirm_buttons,
+                [InlineKeyboardButton(text="❌ Отмена", callback_data="fusion_menu")],
             ])
             
             try:
@@ -735,11 +837,12 @@ async def fusion_start(query: CallbackQuery, state: FSMContext):
 async def fusion_confirm(query: CallbackQuery):
     """
     Confirm fusion.
+    Callback: fusion_confirm:{type}:{sets|all} - the server picks the input bears.
     """
     try:
         parts = query.data.split(":")
         bear_type = parts[1]
-        bear_ids = [int(x) for x in parts[2].split(",")]
+        max_sets = None if parts[2] == "all" else int(parts[2])
         
         async with get_session() as session:
             user_query = select(User).where(User.telegram_id == query.from_user.id)
@@ -747,16 +850,19 @@ async def fusion_confirm(query: CallbackQuery):
             user = user_result.scalar_one()
             
             try:
-                result = await FeaturesService.fuse_bears(session, user.id, bear_ids, bear_type)
-                new_bear = result['new_bear']
-                class_info = BearsService.get_bear_class_info(new_bear.bear_type)
+                result = await FeaturesService.fuse_all_bears(session, user.id, bear_type, max_sets)
+                new_bears = result['new_bears']
+                class_info = BearsService.get_bear_class_info(new_bears[0].bear_type)
                 
                 await query.answer(f"✅ Переплавка завершена!")
                 
-                text = (
-                    f"🎉 **Переплавка завершена!**\n\n"
-                    f"{class_info['color']} {class_info['emoji']} {new_bear.name}\n"
-                    f"{class_info['rarity']}\n\n"
+                text = f"🎉 **Переплавка завершена!**\n\n"
+                for new_bear in new_bears[:10]:
+                    text += f"{class_info['color']} {class_info['emoji']} {new_bear.name}\n"
+                if len(new_bears) > 10:
+                    text += f"... и ещё {len(new_bears) - 10}\n"
+                text += (
+                    f"{class_info['rarity']} x{len(new_bears)}\n\n"
                     f"✨ Поздравляем!"
                 )
                 
@@ -7,6 +7,7 @@ from sqlalchemy import select
 from app.database.db import get_session
 from app.database.models import User
 from app.services.cases import CasesService, CASE_TYPES
+from app.services.analytics import analytics
 from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
 
 logger = logging.getLogger(__name__)
@@ -166,6 +167,9 @@ async def open_case(query: CallbackQuery):
                     await query.message.answer(text, reply_markup=keyboard, parse_mode="markdown")
                 
                 await query.answer("😮 Открыто!")
+                await analytics.track_event(result['user_id'], 'case_opened', {
+                    'case_type': case_type, 'reward_type': result['reward_type'], 'rarity': result['rarity'],
+                })
                 
             except ValueError as e:
                 await query.answer(f"{str(e)}", show_alert=True)
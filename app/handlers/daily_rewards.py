@@ -7,47 +7,18 @@ from aiogram.types import CallbackQuery, InlineKeyboardButton, InlineKeyboardMar
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 from app.database.db import get_session
-from app.database.models import User, UserDailyLogin, CoinTransaction
+from app.database.models import User, UserDailyLogin
+from app.services.ledger import ledger
+from app.services.features import FeaturesService, daily_streak_state, DAILY_STREAK_REWARDS as DAILY_REWARDS
+from app.services.quota import quota_service
+from app.services.analytics import analytics
 from decimal import Decimal
 
 logger = logging.getLogger(__name__)
 router = Router()
 
-# Daily rewards by day (starting at 50, +50 each day)
-DAILY_REWARDS = {
-    1: 50,
-    2: 100,
-    3: 150,
-    4: 200,
-    5: 250,
-    6: 300,
-    7: 350,   # Week bonus
-    8: 400,
-    9: 450,
-    10: 500,
-    11: 550,
-    12: 600,
-    13: 650,
-    14: 700,  # 2 weeks bonus
-    15: 750,
-    16: 800,
-    17: 850,
-    18: 900,
-    19: 950,
-    20: 1000,
-    21: 1050,  # 3 weeks bonus
-    22: 1100,
-    23: 1150,
-    24: 1200,
-    25: 1250,
-    26: 1300,
-    27: 1350,
-    28: 1400,
-    29: 1450,
-    30: 1500,  # Month bonus!
-}
-
 # Fortune wheel prizes
+FORTUNE_WHEEL_DAILY_SPINS = 1
 FORTUNE_WHEEL_PRIZES = [
     {"type": "coins", "amount": 50, "emoji": "🪙", "weight": 30},
     {"type": "coins", "amount": 100, "emoji": "🪙", "weight": 25},
@@ -60,75 +31,15 @@ FORTUNE_WHEEL_PRIZES = [
 ]
 
 
-async def get_or_create_daily_login(user_id: int, session: AsyncSession) -> UserDailyLogin:
+async def get_daily_streak_state(user_id: int, session: AsyncSession) -> tuple[dict, int]:
     """
-    Get or create daily login record.
+    Read-only streak state for views: (state, total_logins).
     """
-    query = select(UserDailyLogin).where(UserDailyLogin.user_id == user_id)
-    result = await session.execute(query)
-    daily_login = result.scalar_one_or_none()
-    
+    daily_login = await FeaturesService.get_daily_login(session, user_id)
     if not daily_login:
-        daily_login = UserDailyLogin(
-            user_id=user_id,
-            streak_days=0,
-            total_logins=0,
-            last_login_date=None,
-            reward_claimed_today=False
-        )
-        session.add(daily_login)
-        await session.commit()
-        await session.refresh(daily_login)
-    
-    return daily_login
-
-
-async def check_and_update_streak(daily_login: UserDailyLogin, session: AsyncSession) -> bool:
-    """
-    Check if streak is valid and update it.
-    Returns True if user can claim today's reward.
-    """
-    now = datetime.utcnow()
-    today_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
-    
-    # First login ever
-    if not daily_login.last_login_date:
-        daily_login.streak_days = 1
-        daily_login.total_logins = 1
-        daily_login.last_login_date = now
-        daily_login.reward_claimed_today = False
-        await session.commit()
-        return True
-    
-    last_login = daily_login.last_login_date
-    last_login_start = last_login.replace(hour=0, minute=0, second=0, microsecond=0)
-    
-    # Already claimed today
-    if last_login_start == today_start and daily_login.reward_claimed_today:
-        return False
-    
-    # Same day but not claimed yet
-    if last_login_start == today_start:
-        return True
-    
-    # Next day - increase streak
-    if last_login_start == today_start - timedelta(days=1):
-        daily_login.streak_days += 1
-        if daily_login.streak_days > 30:
-            daily_login.streak_days = 1  # Reset after 30 days
-        daily_login.total_logins += 1
-        daily_login.last_login_date = now
-        daily_login.reward_claimed_today = False
-        await session.commit()
-        return True
-    
-    # Missed a day - reset streak
-    daily_login.streak_days = 1
-    daily_login.total_logins += 1
-    daily_login.last_login_date = now
-    daily_login.reward_claimed_today = False
-    await session.commit()
-    return True
+        return daily_streak_state(None, 0, datetime.utcnow()), 0
+    state = daily_streak_state(daily_login.last_login_date, daily_login.streak_days, datetime.utcnow())
+    return state, daily_login.total_logins or 0
 
 
 @router.callback_query(F.data == "daily_rewards")
@@ -143,17 +54,12 @@ async def daily_rewards_menu(query: CallbackQuery):
             user_result = await session.execute(user_query)
             user = user_result.scalar_one()
             
-            # Get or create daily login
-            daily_login = await get_or_create_daily_login(user.id, session)
-            
-            # Check streak
-            can_claim = await check_and_update_streak(daily_login, session)
-            
-            # Refresh to get updated data
-            await session.refresh(daily_login)
+            # Streak state (no writes on view)
+            state, total_logins = await get_daily_streak_state(user.id, session)
+            can_claim = state['can_claim']
             
             # Get reward for current day
-            current_day = daily_login.streak_days
+            current_day = state['streak_days']
             reward = DAILY_REWARDS.get(current_day, 50)
             
             # Calculate next milestone
@@ -165,11 +71,11 @@ async def daily_rewards_menu(query: CallbackQuery):
             text = (
                 f"🎉 **Ежедневные награды**\n\n"
                 f"🔥 **Текущая серия:** {current_day} дней\n"
-                f"🎯 **Всего входов:** {daily_login.total_logins}\n"
+                f"🎯 **Всего входов:** {total_logins}\n"
                 f"🎁 **Награда сегодня:** {reward:,} Coins\n\n"
             )
             
-            if not can_claim or daily_login.reward_claimed_today:
+            if not can_claim:
                 text += (
                     f"✅ **Награда получена!**\n"
                     f"⏰ Приходи завтра за новой наградой!\n\n"
@@ -189,11 +95,12 @@ async def daily_rewards_menu(query: CallbackQuery):
             keyboard = []
             
             # Add claim button if can claim
-            if can_claim and not daily_login.reward_claimed_today:
+            if can_claim:
                 keyboard.append([InlineKeyboardButton(text="🎁 Забрать награду", callback_data="claim_daily_reward")])
             
-            # Add fortune wheel button (available once per day)
-            if not daily_login.reward_claimed_today:
+            # Add fortune wheel button (own daily quota)
+            wheel_spins = await quota_service.get_used(session, user.id, 'fortune_wheel')
+            if wheel_spins < FORTUNE_WHEEL_DAILY_SPINS:
                 keyboard.append([InlineKeyboardButton(text="🎰 Крутить колесо фортуны", callback_data="fortune_wheel")])
             
             keyboard.append([InlineKeyboardButton(text="📅 Календарь наград", callback_data="rewards_calendar")])
@@ -225,35 +132,25 @@ async def claim_daily_reward(query: CallbackQuery):
             user_result = await session.execute(user_query)
             user = user_result.scalar_one()
             
-            # Get daily login
-            daily_login = await get_or_create_daily_login(user.id, session)
-            await check_and_update_streak(daily_login, session)
-            await session.refresh(daily_login)
-            
-            # Check if already claimed
-            if daily_login.reward_claimed_today:
+            # Claim atomically (double taps cannot claim twice)
+            current_day = await FeaturesService.claim_daily_streak(session, user.id)
+            if current_day is None:
                 await query.answer("✅ Вы уже получили награду сегодня!", show_alert=True)
                 return
             
             # Get reward
-            current_day = daily_login.streak_days
             reward = DAILY_REWARDS.get(current_day, 50)
             
             # Add coins
             user.coins += reward
             
-            # Mark as claimed
-            daily_login.reward_claimed_today = True
-            daily_login.last_reward_claimed_at = datetime.utcnow()
-            
             # Log transaction
-            transaction = CoinTransaction(
-                user_id=user.id,
-                amount=reward,
-                transaction_type='daily_reward',
-                description=f'Ежедневная награда (день {current_day})'
-            )
-            session.add(transaction)
+            ledger.defer(session, [(
+                user.id,
+                reward,
+                'daily_reward',
+                f'Ежедневная награда (день {current_day})'
+            )])
             
             await session.commit()
             
@@ -277,6 +174,7 @@ async def claim_daily_reward(query: CallbackQuery):
                 await query.message.answer(text, reply_markup=keyboard, parse_mode="markdown")
             
             await query.answer("🎉 Поздравляем!")
+            await analytics.track_event(user.id, 'daily_reward_claimed', {'day': current_day, 'reward': reward})
             
             logger.info(f"✅ User {user.telegram_id} claimed daily reward: {reward} coins (day {current_day})")
     
@@ -297,20 +195,10 @@ async def fortune_wheel(query: CallbackQuery):
             user_result = await session.execute(user_query)
             user = user_result.scalar_one()
             
-            # Get daily login
-            daily_login = await get_or_create_daily_login(user.id, session)
-            await session.refresh(daily_login)
-            
-            # Check if already spun today
-            now = datetime.utcnow()
-            today_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
-            last_spin_date = daily_login.last_reward_claimed_at
-            
-            if last_spin_date:
-                last_spin_start = last_spin_date.replace(hour=0, minute=0, second=0, microsecond=0)
-                if last_spin_start >= today_start:
-                    await query.answer("⏰ Колесо уже кручено сегодня! Приходи завтра.", show_alert=True)
-                    return
+            # Check and consume today's spin atomically
+            if await quota_service.consume(session, user.id, 'fortune_wheel', FORTUNE_WHEEL_DAILY_SPINS) is None:
+                await query.answer("⏰ Колесо уже кручено сегодня! Приходи завтра.", show_alert=True)
+                return
             
             # Weighted random selection
             weights = [p["weight"] for p in FORTUNE_WHEEL_PRIZES]
@@ -328,16 +216,12 @@ async def fortune_wheel(query: CallbackQuery):
                 prize_text = f"🎆 JACKPOT: {prize['amount']:,} Coins!"
             
             # Log transaction
-            transaction = CoinTransaction(
-                user_id=user.id,
-                amount=prize["amount"] if prize["type"] == "coins" else 0,
-                transaction_type='fortune_wheel',
-                description=f'Колесо фортуны: {prize_text}'
-            )
-            session.add(transaction)
-            
-            # Update last spin time
-            daily_login.last_reward_claimed_at = now
+            ledger.defer(session, [(
+                user.id,
+                prize["amount"] if prize["type"] == "coins" else 0,
+                'fortune_wheel',
+                f'Колесо фортуны: {prize_text}'
+            )])
             
             await session.commit()
             
@@ -383,11 +267,9 @@ async def rewards_calendar(query: CallbackQuery):
             user_result = await session.execute(user_query)
             user = user_result.scalar_one()
             
-            # Get daily login
-            daily_login = await get_or_create_daily_login(user.id, session)
-            await session.refresh(daily_login)
-            
-            current_day = daily_login.streak_days
+            # Streak state (no writes on view)
+            state, _ = await get_daily_streak_state(user.id, session)
+            current_day = state['streak_days']
             
             text = (
                 f"📅 **Календарь наград**\n\n"
@@ -8,7 +8,10 @@ from aiogram.fsm.state import State, StatesGroup
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 from app.database.db import get_session
-from app.database.models import User, CoinTransaction
+from app.database.models import User
+from app.services.upgrades import UpgradesService
+from app.services.ledger import ledger
+from app.services.ledger_archive import LedgerArchiveService
 from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
 from config import settings
 
@@ -32,10 +35,11 @@ async def exchange_menu(query: CallbackQuery):
             user_result = await session.execute(user_query)
             user = user_result.scalar_one()
             
-            # Exchange rate from config
-            rate = settings.COIN_TO_TON_RATE
+            # Личный курс и комиссия с учётом улучшений - как при расчёте обмена
+            modifiers = await UpgradesService.get_modifiers(session, user.id)
+            rate = settings.COIN_TO_TON_RATE / modifiers.exchange_rate_multiplier
             coins_per_ton = int(1 / rate)
-            commission_pct = settings.WITHDRAW_COMMISSION * 100  # Комиссия в %
+            commission_pct = settings.WITHDRAW_COMMISSION * modifiers.commission_multiplier * 100  # Комиссия в %
             
             text = (
                 f"💱 **Пополнение баланса**\n\n"
@@ -90,9 +94,10 @@ async def start_exchange_ton_to_coins(query: CallbackQuery, state: FSMContext):
                 await query.answer(f"❌ Минимальная сумма: {min_ton} TON", show_alert=True)
                 return
             
-            rate = settings.COIN_TO_TON_RATE
+            modifiers = await UpgradesService.get_modifiers(session, user.id)
+            rate = settings.COIN_TO_TON_RATE / modifiers.exchange_rate_multiplier
             coins_per_ton = int(1 / rate)
-            commission_pct = settings.WITHDRAW_COMMISSION * 100
+            commission_pct = settings.WITHDRAW_COMMISSION * modifiers.commission_multiplier * 100
             
             text = (
                 f"💎 → 🪙 **Пополнение баланса**\n\n"
@@ -151,13 +156,16 @@ async def process_ton_amount(message: Message, state: FSMContext):
                 return
             
             # Calculate coins amount WITH COMMISSION
-            rate = settings.COIN_TO_TON_RATE
+            # Улучшения "Курс обмена" и "Снижение комиссий" дают личный курс и комиссию
+            modifiers = await UpgradesService.get_modifiers(session, user.id)
+            rate = settings.COIN_TO_TON_RATE / modifiers.exchange_rate_multiplier
+            commission = settings.WITHDRAW_COMMISSION * modifiers.commission_multiplier
             coins_amount_before_commission = amount / rate
-            commission_coins = coins_amount_before_commission * settings.WITHDRAW_COMMISSION
+            commission_coins = coins_amount_before_commission * commission
             coins_amount = coins_amount_before_commission - commission_coins  # Финальная сумма после комиссии
             
             coins_per_ton = int(1 / rate)
-            commission_pct = settings.WITHDRAW_COMMISSION * 100
+            commission_pct = commission * 100
             
             text = (
                 f"✅ **Подтвердите пополнение**\n\n"
@@ -184,7 +192,7 @@ async def process_ton_amount(message: Message, state: FSMContext):
             ])
             
             await message.answer(text, reply_markup=keyboard, parse_mode="markdown")
-            
+    
     except Exception as e:
         logger.error(f"❌ Error in process_ton_amount: {e}", exc_info=True)
         await message.answer(f"❌ Ошибка: {str(e)}")
@@ -225,13 +233,12 @@ async def confirm_ton_to_coins(query: CallbackQuery, state: FSMContext):
             user.coins += coins_amount
             
             # Log transaction
-            transaction_earn = CoinTransaction(
-                user_id=user.id,
-                amount=coins_amount,
-                transaction_type='exchange_from_ton',
-                description=f'Пополнение {ton_amount:.4f} TON → {coins_amount:,.0f} Coins (ком. {commission_coins:,.0f})'
-            )
-            session.add(transaction_earn)
+            await ledger.write(session, [(
+                user.id,
+                coins_amount,
+                'exchange_from_ton',
+                f'Пополнение {ton_amount:.4f} TON → {coins_amount:,.0f} Coins (ком. {commission_coins:,.0f})'
+            )])
             
             await session.commit()
             
@@ -260,7 +267,7 @@ async def confirm_ton_to_coins(query: CallbackQuery, state: FSMContext):
             
             await query.answer("✅ Пополнение успешно!")
             await state.clear()
-            
+    
     except Exception as e:
         logger.error(f"❌ Error in confirm_ton_to_coins: {e}", exc_info=True)
         await query.answer(f"❌ Ошибка: {str(e)}", show_alert=True)
@@ -278,13 +285,10 @@ async def exchange_history(query: CallbackQuery):
             user_result = await session.execute(user_query)
             user = user_result.scalar_one()
             
-            # Get last 10 exchange transactions
-            transactions_query = select(CoinTransaction).where(
-                CoinTransaction.user_id == user.id,
-                CoinTransaction.transaction_type == 'exchange_from_ton'
-            ).order_by(CoinTransaction.created_at.desc()).limit(10)
-            transactions_result = await session.execute(transactions_query)
-            transactions = transactions_result.scalars().all()
+            # Get last 10 exchange transactions (archived months included)
+            transactions = await LedgerArchiveService.get_user_history(
+                session, user.id, transaction_types=['exchange_from_ton'], limit=10
+            )
             
             text = f"📊 **История пополнений**\n\n"
             
@@ -10,6 +10,10 @@ from aiogram.exceptions import TelegramForbiddenError, TelegramBadRequest
 from sqlalchemy import select
 from app.database.db import get_session
 from app.database.models import User, CoinTransaction
+from app.services.payment_intents import PaymentIntentService
+from app.services.ton_deposits import deposit_watcher, TON_DEPOSIT_ADDRESS
+from app.services.stars_payments import StarsPaymentService
+from app.services.analytics import analytics
 from config import settings
 import hashlib
 
@@ -131,9 +135,23 @@ COINS_TON_PACKAGES = {
     },
 }
 
-# Temporary storage for pending TON payments
-# В продакшене лучше использовать Redis или базу данных
-pending_ton_payments = {}
+# Каталог для счетов Stars: payload "{product}_stars_{package_id}_{telegram_id}"
+STARS_CATALOG = {
+    'ton': TON_PACKAGES,
+    'coins': COINS_PACKAGES,
+}
+
+
+def parse_stars_payload(payload: str) -> tuple[str, str, int] | None:
+    """
+    (product, package_id, telegram_id) from an invoice payload, or None if it
+    does not name a known package. Pure in-memory check (used in pre-checkout).
+    """
+    product, sep, rest = payload.partition('_stars_')
+    package_id, _, telegram_id = rest.rpartition('_')
+    if not sep or not telegram_id.isdigit() or package_id not in STARS_CATALOG.get(product, {}):
+        return None
+    return product, package_id, int(telegram_id)
 
 
 class PaymentStates(StatesGroup):
@@ -312,9 +330,27 @@ async def pay_with_stars(query: CallbackQuery):
 @router.pre_checkout_query()
 async def process_pre_checkout(pre_checkout_query: PreCheckoutQuery):
     """
-    Handle pre-checkout query (approve payment).
+    Handle pre-checkout query: validate the payload against the package catalog (no DB access).
     """
     try:
+        parsed = parse_stars_payload(pre_checkout_query.invoice_payload)
+        if parsed is not None:
+            product, package_id, telegram_id = parsed
+            package = STARS_CATALOG[product][package_id]
+            parsed = (
+                pre_checkout_query.currency == "XTR"
+                and pre_checkout_query.total_amount == package['stars']
+                and telegram_id == pre_checkout_query.from_user.id
+            )
+        
+        if not parsed:
+            logger.warning(f"⚠️ Rejected pre-checkout: {pre_checkout_query.invoice_payload}")
+            await pre_checkout_query.answer(
+                ok=False,
+                error_message="Этот счёт устарел. Создайте новый в разделе покупок."
+            )
+            return
+        
         await pre_checkout_query.answer(ok=True)
     except Exception as e:
         logger.error(f"❌ Error in process_pre_checkout: {e}", exc_info=True)
@@ -331,64 +367,47 @@ async def process_successful_payment(message: Message):
     """
     try:
         payload = message.successful_payment.invoice_payload
-        parts = payload.split("_")
+        parsed = parse_stars_payload(payload)
         
-        if len(parts) < 4:
-            logger.error(f"Invalid payload: {payload}")
+        if parsed is None:
+            logger.error(f"Invalid payload: {payload} (charge {message.successful_payment.telegram_payment_charge_id})")
             return
         
-        payment_type = parts[0]  # 'ton' or 'coins'
-        payment_method = parts[1]  # 'stars'
+        payment_type, package_id, user_id = parsed
         
         if payment_type == "ton":
-            await process_ton_stars_payment(message, payload)
-        elif payment_type == "coins":
-            await process_coins_stars_payment(message, payload)
+            await process_ton_stars_payment(message, package_id, user_id)
         else:
-            logger.error(f"Unknown payment type: {payment_type}")
+            await process_coins_stars_payment(message, package_id, user_id)
             
     except Exception as e:
         logger.error(f"❌ Error in process_successful_payment: {e}", exc_info=True)
 
 
-async def process_ton_stars_payment(message: Message, payload: str):
+async def process_ton_stars_payment(message: Message, package_id: str, user_id: int):
     """
-    Process TON purchase via Stars.
+    Process TON purchase via Stars (once per telegram_payment_charge_id).
     """
     try:
-        # Parse payload: ton_stars_package_0.5_123456789
-        parts = payload.split("_")
-        package_id = f"{parts[2]}_{parts[3]}"
-        user_id = int(parts[4])
-        
-        if package_id not in TON_PACKAGES:
-            logger.error(f"Unknown package: {package_id}")
-            return
-        
         package = TON_PACKAGES[package_id]
         ton_amount = package['ton_amount']
+        payment = message.successful_payment
         
         # Credit TON to user
         async with get_session() as session:
-            user_query = select(User).where(User.telegram_id == user_id)
-            user_result = await session.execute(user_query)
-            user = user_result.scalar_one_or_none()
-            
-            if not user:
-                logger.error(f"User not found: {user_id}")
-                return
-            
-            # Add TON
-            user.ton_balance += Decimal(str(ton_amount))
-            
-            # Log transaction
-            transaction = CoinTransaction(
-                user_id=user.id,
-                amount=ton_amount,
-                transaction_type='purchase_stars',
-                description=f'Покупка {package["name"]} за {package["stars"]:,} Stars (+{ton_amount} TON)'
+            credited = await StarsPaymentService.credit(
+                session,
+                payment.telegram_payment_charge_id,
+                payment.provider_payment_charge_id,
+                user_id,
+                'ton',
+                package_id,
+                package['stars'],
+                ton_amount,
+                f'Покупка {package["name"]} за {package["stars"]:,} Stars (+{ton_amount} TON)'
             )
-            session.add(transaction)
+            if credited is None:
+                return
             await session.commit()
             
             # Success message
@@ -396,7 +415,7 @@ async def process_ton_stars_payment(message: Message, payload: str):
                 f"✅ **Платёж успешен!**\n\n"
                 f"💎 **Начислено:** {ton_amount} TON\n"
                 f"⭐ **Оплачено:** {package['stars']:,} Stars\n\n"
-                f"💼 **Новый баланс:** {float(user.ton_balance):.4f} TON\n\n"
+                f"💼 **Новый баланс:** {credited.balance:.4f} TON\n\n"
                 f"🎉 Спасибо за покупку!"
             )
             
@@ -408,6 +427,9 @@ async def process_ton_stars_payment(message: Message, payload: str):
             
             await message.answer(text, reply_markup=keyboard, parse_mode="markdown")
             logger.info(f"✅ TON Payment: User {user_id} purchased {ton_amount} TON for {package['stars']:,} Stars")
+            await analytics.track_event(credited.user_id, 'payment_completed', {
+                'method': 'stars', 'product': 'ton', 'package_id': package_id, 'amount': package['stars'], 'currency': 'XTR',
+            })
             
     except Exception as e:
         logger.error(f"❌ Error in process_ton_stars_payment: {e}", exc_info=True)
@@ -428,18 +450,17 @@ async def pay_with_ton_wallet(query: CallbackQuery):
             return
         
         package = TON_PACKAGES[package_id]
-        deposit_address = "UQBLaN9mzDOTceNlEGqo5JCjjWi8deYPYddGFzG_CqF4zXXg"
-        payment_memo = f"USER_{query.from_user.id}_{package_id}"
-        
-        # Save to pending payments
-        payment_id = f"{query.from_user.id}_{int(datetime.now().timestamp())}"
-        pending_ton_payments[payment_id] = {
-            'user_id': query.from_user.id,
-            'package_id': package_id,
-            'ton_amount': package['ton_crypto'],
-            'status': 'pending',
-            'created_at': datetime.now()
-        }
+        deposit_address = TON_DEPOSIT_ADDRESS
+        
+        # Save payment intent (повторный выбор того же пакета вернёт открытую заявку)
+        async with get_session() as session:
+            user_query = select(User).where(User.telegram_id == query.from_user.id)
+            user_result = await session.execute(user_query)
+            user = user_result.scalar_one()
+            
+            intent = await PaymentIntentService.get_or_create(session, user, package_id, package['ton_crypto'])
+            payment_id = intent.id
+            payment_memo = intent.memo
         
         text = (
             f"💎 **Оплата TON**\n\n"
@@ -485,26 +506,41 @@ async def confirm_ton_payment(query: CallbackQuery):
     try:
         payment_id = query.data.split(":")[1]
         
-        if payment_id not in pending_ton_payments:
-            await query.answer("❌ Платёж не найден", show_alert=True)
-            return
-        
-        payment = pending_ton_payments[payment_id]
-        
-        if payment['status'] != 'pending':
-            await query.answer("⚠️ Этот платёж уже обработан", show_alert=True)
-            return
-        
-        # Update status
-        payment['status'] = 'waiting_confirmation'
-        
-        # Get user info
         async with get_session() as session:
-            user_query = select(User).where(User.telegram_id == payment['user_id'])
+            user_query = select(User).where(User.telegram_id == query.from_user.id)
             user_result = await session.execute(user_query)
             user = user_result.scalar_one()
             
-            package = TON_PACKAGES[payment['package_id']]
+            payment = await PaymentIntentService.get(session, payment_id)
+            if payment is None or payment.user_id != user.id:
+                await query.answer("❌ Платёж не найден", show_alert=True)
+                return
+        
+            # Update status
+            if await PaymentIntentService.confirm(session, payment_id) is None:
+                if payment.status == 'pending':
+                    await query.answer("⌛ Время заявки истекло. Создайте новую.", show_alert=True)
+                else:
+                    await query.answer("⚠️ Этот платёж уже обработан", show_alert=True)
+                return
+            await session.commit()
+        
+            package = TON_PACKAGES[payment.package_id]
+            
+            # Перевод проверяется автоматически - админ получит только несовпадения
+            if deposit_watcher.enabled:
+                deposit_watcher.wake()
+                await query.message.edit_text(
+                    f"🔍 **Проверяем платёж**\n\n"
+                    f"💎 Пакет: {package['name']}\n"
+                    f"💵 Сумма: {package['ton_crypto']} TON\n\n"
+                    f"⏳ Как только перевод с комментарием `{payment.memo}` появится в сети, "
+                    f"TON будет начислен автоматически.\n"
+                    f"🔔 Вы получите уведомление.",
+                    parse_mode="markdown"
+                )
+                await query.answer("✅ Проверяем перевод!")
+                return
             
             # Notify admin
             admin_text = (
@@ -514,7 +550,7 @@ async def confirm_ton_payment(query: CallbackQuery):
                 f"📦 **Пакет:** {package['name']}\n"
                 f"💎 **Сумма:** {package['ton_crypto']} TON\n\n"
                 f"📝 **Комментарий:**\n"
-                f"`USER_{user.telegram_id}_{payment['package_id']}`\n\n"
+                f"`{payment.memo}`\n\n"
                 f"⏰ **Время:** {datetime.now().strftime('%d.%m.%Y %H:%M')}\n\n"
                 f"💳 **Проверьте транзакцию и подтвердите:**"
             )
@@ -599,52 +635,37 @@ async def admin_approve_payment(query: CallbackQuery):
     Admin approves TON payment.
     """
     try:
-        payment_id = query.data.split(":")[1]
-        
-        if payment_id not in pending_ton_payments:
-            await query.answer("❌ Платёж не найден", show_alert=True)
+        if query.from_user.id not in (ADMIN_ID, settings.ADMIN_ID):
+            await query.answer("❌ Не имеете доступа", show_alert=True)
             return
         
-        payment = pending_ton_payments[payment_id]
-        
-        if payment['status'] == 'approved':
-            await query.answer("✅ Платёж уже одобрен", show_alert=True)
-            return
+        payment_id = query.data.split(":")[1]
         
-        # Credit TON to user
+        # Credit TON to user (одобрение и начисление - одна транзакция)
         async with get_session() as session:
-            user_query = select(User).where(User.telegram_id == payment['user_id'])
-            user_result = await session.execute(user_query)
-            user = user_result.scalar_one_or_none()
-            
-            if not user:
-                await query.answer("❌ Пользователь не найден", show_alert=True)
+            payment = await PaymentIntentService.get(session, payment_id)
+            if payment is None:
+                await query.answer("❌ Платёж не найден", show_alert=True)
                 return
-            
-            package = TON_PACKAGES[payment['package_id']]
-            ton_amount = payment['ton_amount']
-            
-            # Add TON
-            user.ton_balance += Decimal(str(ton_amount))
-            
-            # Log transaction
-            transaction = CoinTransaction(
-                user_id=user.id,
-                amount=ton_amount,
-                transaction_type='purchase_ton_wallet',
-                description=f'Покупка {package["name"]} через TON Wallet (+{ton_amount} TON)'
+        
+            package = TON_PACKAGES[payment.package_id]
+            ton_amount = float(payment.ton_amount)
+        
+            approved = await PaymentIntentService.approve(
+                session, payment_id, query.from_user.id,
+                f'Покупка {package["name"]} через TON Wallet (+{ton_amount} TON)'
             )
-            session.add(transaction)
+            if approved is None:
+                await query.answer(f"⚠️ Платёж уже обработан (статус: {payment.status})", show_alert=True)
+                return
             await session.commit()
-            
-            # Update status
-            payment['status'] = 'approved'
+            ton_balance, telegram_id = approved.ton_balance, approved.telegram_id
             
             # Notify user
             user_text = (
                 f"✅ **Платёж подтверждён!**\n\n"
                 f"💎 **Начислено:** {ton_amount} TON\n"
-                f"💼 **Новый баланс:** {float(user.ton_balance):.4f} TON\n\n"
+                f"💼 **Новый баланс:** {float(ton_balance):.4f} TON\n\n"
                 f"🎉 Спасибо за покупку!"
             )
             
@@ -655,7 +676,7 @@ async def admin_approve_payment(query: CallbackQuery):
             
             try:
                 await query.bot.send_message(
-                    chat_id=payment['user_id'],
+                    chat_id=telegram_id,
                     text=user_text,
                     reply_markup=user_keyboard,
                     parse_mode="markdown"
@@ -671,6 +692,9 @@ async def admin_approve_payment(query: CallbackQuery):
             
             await query.answer("✅ Платёж одобрен! TON начислен пользователю.")
             logger.info(f"✅ Admin approved TON payment: {payment_id}")
+            await analytics.track_event(approved.user_id, 'payment_completed', {
+                'method': 'ton_wallet', 'product': 'ton', 'package_id': payment.package_id, 'amount': ton_amount, 'currency': 'TON',
+            })
             
     except Exception as e:
         logger.error(f"❌ Error in admin_approve_payment: {e}", exc_info=True)
@@ -683,20 +707,24 @@ async def admin_reject_payment(query: CallbackQuery):
     Admin rejects TON payment.
     """
     try:
-        payment_id = query.data.split(":")[1]
-        
-        if payment_id not in pending_ton_payments:
-            await query.answer("❌ Платёж не найден", show_alert=True)
+        if query.from_user.id not in (ADMIN_ID, settings.ADMIN_ID):
+            await query.answer("❌ Не имеете доступа", show_alert=True)
             return
         
-        payment = pending_ton_payments[payment_id]
+        payment_id = query.data.split(":")[1]
         
-        if payment['status'] == 'rejected':
-            await query.answer("❌ Платёж уже отклонён", show_alert=True)
-            return
+        async with get_session() as session:
+            payment = await PaymentIntentService.get(session, payment_id)
+            if payment is None:
+                await query.answer("❌ Платёж не найден", show_alert=True)
+                return
         
-        # Update status
-        payment['status'] = 'rejected'
+            # Update status
+            if await PaymentIntentService.reject(session, payment_id, query.from_user.id) is None:
+                await query.answer(f"⚠️ Платёж уже обработан (статус: {payment.status})", show_alert=True)
+                return
+            user = await session.get(User, payment.user_id)
+            await session.commit()
         
         # Notify user
         user_text = (
@@ -711,7 +739,7 @@ async def admin_reject_payment(query: CallbackQuery):
         
         try:
             await query.bot.send_message(
-                chat_id=payment['user_id'],
+                chat_id=user.telegram_id,
                 text=user_text,
                 parse_mode="markdown"
             )
@@ -1079,44 +1107,30 @@ async def pay_coins_with_stars(query: CallbackQuery):
         await query.answer(f"❌ Ошибка: {str(e)}", show_alert=True)
 
 
-async def process_coins_stars_payment(message: Message, payload: str):
+async def process_coins_stars_payment(message: Message, package_id: str, user_id: int):
     """
-    Process Coins purchase via Stars.
+    Process Coins purchase via Stars (once per telegram_payment_charge_id).
     """
     try:
-        # Parse payload: coins_stars_coins_1k_123456789
-        parts = payload.split("_")
-        package_id = f"{parts[2]}_{parts[3]}"
-        user_id = int(parts[4])
-        
-        if package_id not in COINS_PACKAGES:
-            logger.error(f"Unknown package: {package_id}")
-            return
-        
         package = COINS_PACKAGES[package_id]
         coins_amount = package['coins_amount']
+        payment = message.successful_payment
         
         # Credit Coins to user
         async with get_session() as session:
-            user_query = select(User).where(User.telegram_id == user_id)
-            user_result = await session.execute(user_query)
-            user = user_result.scalar_one_or_none()
-            
-            if not user:
-                logger.error(f"User not found: {user_id}")
-                return
-            
-            # Add Coins
-            user.coins += coins_amount
-            
-            # Log transaction
-            transaction = CoinTransaction(
-                user_id=user.id,
-                amount=coins_amount,
-                transaction_type='purchase_stars',
-                description=f'Покупка {package["name"]} за {package["stars"]:,} Stars (+{coins_amount:,} Coins)'
+            credited = await StarsPaymentService.credit(
+                session,
+                payment.telegram_payment_charge_id,
+                payment.provider_payment_charge_id,
+                user_id,
+                'coins',
+                package_id,
+                package['stars'],
+                coins_amount,
+                f'Покупка {package["name"]} за {package["stars"]:,} Stars (+{coins_amount:,} Coins)'
             )
-            session.add(transaction)
+            if credited is None:
+                return
             await session.commit()
             
             # Success message
@@ -1124,7 +1138,7 @@ async def process_coins_stars_payment(message: Message, payload: str):
                 f"✅ **Платёж успешен!**\n\n"
                 f"🪙 **Начислено:** {coins_amount:,} Coins\n"
                 f"⭐ **Оплачено:** {package['stars']:,} Stars\n\n"
-                f"💼 **Новый баланс:** {user.coins:,.0f} Coins\n\n"
+                f"💼 **Новый баланс:** {credited.balance:,.0f} Coins\n\n"
                 f"🎉 Спасибо за покупку!"
             )
             
@@ -1136,6 +1150,9 @@ async def process_coins_stars_payment(message: Message, payload: str):
             
             await message.answer(text, reply_markup=keyboard, parse_mode="markdown")
             logger.info(f"✅ Coins Payment: User {user_id} purchased {coins_amount:,} Coins for {package['stars']:,} Stars")
+            await analytics.track_event(credited.user_id, 'payment_completed', {
+                'method': 'stars', 'product': 'coins', 'package_id': package_id, 'amount': package['stars'], 'currency': 'XTR',
+            })
             
     except Exception as e:
         logger.error(f"❌ Error in process_coins_stars_payment: {e}", exc_info=True)
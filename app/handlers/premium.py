@@ -62,13 +62,10 @@ PREMIUM_TIERS = {
 
 def get_user_tier(user: User) -> str:
     """Get user subscription tier."""
+    # is_premium сбрасывает движок истечения, дату не сравниваем
     if not user.is_premium:
         return "free"
     
-    # Check if premium is still valid
-    if user.premium_until and user.premium_until < datetime.utcnow():
-        return "free"
-    
     # Get subscription to check tier
     # Default to premium for now
     return "premium"
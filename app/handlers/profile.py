@@ -7,6 +7,8 @@ from sqlalchemy import select, func
 from app.database.db import get_session
 from app.database.models import User, Bear, CoinTransaction, P2PListing
 from app.services.bears import BEAR_CLASSES, MAX_BEAR_LEVEL
+from app.services.leaderboard import leaderboards, LEADERBOARDS
+from app.services.ledger_archive import LedgerArchiveService
 from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
 from datetime import datetime, timedelta
 
@@ -18,16 +20,16 @@ def format_premium_status(user: User) -> str:
     """
     Format premium status with expiration.
     """
+    # is_premium сбрасывает движок истечения, здесь только оставшееся время
     if user.is_premium:
         if user.premium_until:
-            time_left = user.premium_until - datetime.utcnow()
-            if time_left.total_seconds() > 0:
-                days = time_left.days
-                hours = (time_left.total_seconds() % 86400) // 3600
-                if days > 0:
-                    return f"\n👳 **Премиум активен** ({days}д {hours}ч)"
-                else:
-                    return f"\n👳 **Премиум активен** ({hours}ч)"
+            time_left = max(user.premium_until - datetime.utcnow(), timedelta(0))
+            days = time_left.days
+            hours = int(time_left.total_seconds() % 86400) // 3600
+            if days > 0:
+                return f"\n👳 **Премиум активен** ({days}д {hours}ч)"
+            else:
+                return f"\n👳 **Премиум активен** ({hours}ч)"
         return "\n👳 **Премиум активен** (бессрочно)"
     return "\n⭕ Обычный пользователь"
 
@@ -64,12 +66,7 @@ async def show_profile(query: CallbackQuery):
             max_level = max((bear.level for bear in bears), default=0)
             
             # Get total earned
-            transaction_query = select(func.sum(CoinTransaction.amount)).where(
-                CoinTransaction.user_id == user.id,
-                CoinTransaction.transaction_type == 'earn'
-            )
-            transaction_result = await session.execute(transaction_query)
-            total_earned = transaction_result.scalar() or 0
+            total_earned = await LedgerArchiveService.get_user_total(session, user.id, ['earn'])
             
             # Get referrals count
             referrals_query = select(func.count(User.id)).where(User.referred_by == user.telegram_id)
@@ -209,6 +206,7 @@ async def stats_menu(query: CallbackQuery):
                     InlineKeyboardButton(text="👥 Рефералы", callback_data="stats_referrals"),
                     InlineKeyboardButton(text="🏆 Достижения", callback_data="stats_achievements"),
                 ],
+                [InlineKeyboardButton(text="🏅 Рейтинги игроков", callback_data="lb:richest:all")],
                 [InlineKeyboardButton(text="⬅️ Назад", callback_data="main_menu")],
             ])
             
@@ -300,20 +298,12 @@ async def stats_finance(query: CallbackQuery):
             user = user_result.scalar_one()
             
             # Get income
-            earned_query = select(func.sum(CoinTransaction.amount)).where(
-                CoinTransaction.user_id == user.id,
-                CoinTransaction.transaction_type.in_(['earn', 'referral_tier1', 'referral_tier2', 'referral_tier3'])
+            total_earned = await LedgerArchiveService.get_user_total(
+                session, user.id, ['earn', 'referral_tier1', 'referral_tier2', 'referral_tier3']
             )
-            earned_result = await session.execute(earned_query)
-            total_earned = earned_result.scalar() or 0
             
             # Get expenses
-            spent_query = select(func.sum(CoinTransaction.amount)).where(
-                CoinTransaction.user_id == user.id,
-                CoinTransaction.transaction_type == 'spend'
-            )
-            spent_result = await session.execute(spent_query)
-            total_spent = abs(spent_result.scalar() or 0)
+            total_spent = abs(await LedgerArchiveService.get_user_total(session, user.id, ['spend']))
             
             # Weekly stats
             week_ago = datetime.utcnow() - timedelta(days=7)
@@ -545,6 +535,97 @@ async def stats_achievements(query: CallbackQuery):
     await query.answer()
 
 
+# ============ LEADERBOARDS ============
+
+LEADERBOARD_WINDOW_NAMES = {'day': 'День', 'week': 'Неделя', 'all': 'Всё время'}
+
+
+@router.callback_query(F.data.startswith("lb:"))
+async def leaderboard_view(query: CallbackQuery):
+    """
+    Show a leaderboard: top-10 plus the user's place and neighbours.
+    Callback: lb:{board}:{window}
+    """
+    try:
+        _, name, window = query.data.split(":")
+        
+        async with get_session() as session:
+            user_query = select(User).where(User.telegram_id == query.from_user.id)
+            user_result = await session.execute(user_query)
+            user = user_result.scalar_one()
+            
+            await leaderboards.ensure_loaded(session)
+            if window not in leaderboards.windows(name):
+                window = 'all'
+            
+            top = leaderboards.top(name, window)
+            around = leaderboards.around(name, window, user.id)
+            # Соседей показываем только если пользователь вне топа
+            around = [row for row in around if row[0] > len(top)]
+            
+            # Имена только для показанных игроков
+            shown_ids = [user_id for _, user_id, _ in top + around]
+            names = {}
+            if shown_ids:
+                names_query = select(User.id, User.username, User.first_name).where(User.id.in_(shown_ids))
+                names_result = await session.execute(names_query)
+                names = {
+                    user_id: username or first_name or f"Игрок {user_id}"
+                    for user_id, username, first_name in names_result.all()
+                }
+        
+        board = LEADERBOARDS[name]
+        text = f"{board['title']} — {LEADERBOARD_WINDOW_NAMES[window]}\n\n"
+        
+        def format_row(place, user_id, score):
+            marker = " ⬅️" if user_id == user.id else ""
+            return f"{place}. {names.get(user_id, f'Игрок {user_id}')[:16]} — {score:,.0f} {board['unit']}{marker}\n"
+        
+        if not top:
+            text += "Пока пусто 🤷\n"
+        for row in top:
+            text += format_row(*row)
+        if around:
+            text += "…\n"
+            for row in around:
+                text += format_row(*row)
+        
+        place = leaderboards.rank(name, window, user.id)
+        total = leaderboards.size(name, window)
+        text += f"\n📍 Ваше место: #{place} из {total}" if place else "\n📍 Вас пока нет в этом рейтинге"
+        
+        board_buttons = [
+            InlineKeyboardButton(
+                text=("✅ " if board_name == name else "") + board_info['title'],
+                callback_data=f"lb:{board_name}:{window}"
+            )
+            for board_name, board_info in LEADERBOARDS.items()
+        ]
+        window_buttons = [
+            InlineKeyboardButton(
+                text=("✅ " if board_window == window else "") + LEADERBOARD_WINDOW_NAMES[board_window],
+                callback_data=f"lb:{name}:{board_window}"
+            )
+            for board_window in leaderboards.windows(name)
+        ]
+        keyboard = InlineKeyboardMarkup(inline_keyboard=[
+            board_buttons[:2],
+            board_buttons[2:],
+            window_buttons,
+            [InlineKeyboardButton(text="⬅️ К статистике", callback_data="stats")],
+        ])
+        
+        try:
+            await query.message.edit_text(text, reply_markup=keyboard)
+        except Exception:
+            await query.message.answer(text, reply_markup=keyboard)
+        
+        await query.answer()
+    except Exception as e:
+        logger.error(f"❌ Error in leaderboard_view: {e}", exc_info=True)
+        await query.answer(f"❌ Ошибка: {str(e)}", show_alert=True)
+
+
 @router.callback_query(F.data == "finance_stats")
 async def finance_stats(query: CallbackQuery):
     """
@@ -575,20 +656,10 @@ async def finance_stats(query: CallbackQuery):
             earned_week = week_result.scalar() or 0
             
             # Get total spent
-            spent_query = select(func.sum(CoinTransaction.amount)).where(
-                CoinTransaction.user_id == user.id,
-                CoinTransaction.transaction_type == 'spend'
-            )
-            spent_result = await session.execute(spent_query)
-            total_spent = spent_result.scalar() or 0
+            total_spent = await LedgerArchiveService.get_user_total(session, user.id, ['spend'])
             
             # Get total earned
-            earned_query = select(func.sum(CoinTransaction.amount)).where(
-                CoinTransaction.user_id == user.id,
-                CoinTransaction.transaction_type == 'earn'
-            )
-            earned_result = await session.execute(earned_query)
-            total_earned = earned_result.scalar() or 0
+            total_earned = await LedgerArchiveService.get_user_total(session, user.id, ['earn'])
             
             # Calculate profit
             total_profit = total_earned - total_spent
@@ -5,9 +5,15 @@ from datetime import datetime
 from aiogram import Router, F
 from aiogram.types import CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, func
+from sqlalchemy import select
 from app.database.db import get_session
-from app.database.models import User, Bear, CoinTransaction
+from app.database.models import User, Bear
+from app.services.ledger import ledger
+from app.services.pvp import (
+    calculate_bear_power, calculate_team_power, pvp_matchmaker,
+    pvp_leaderboard, PvPRatingService, ELO_DEFAULT_RATING, LEADERBOARD_SIZE,
+)
+from app.services.tournament import TournamentService, TOURNAMENT_HOUSE_CUT
 
 logger = logging.getLogger(__name__)
 router = Router()
@@ -22,21 +28,6 @@ PVP_RANKS = [
     {"name": "🏆 Legend", "min_rating": 5000, "max_rating": 999999},
 ]
 
-# Bear power calculation
-BEAR_TYPE_POWER = {
-    "common": 1.0,
-    "rare": 1.5,
-    "epic": 2.0,
-    "legendary": 3.0,
-}
-
-
-def calculate_bear_power(bear: Bear) -> float:
-    """Calculate bear battle power."""
-    base_power = BEAR_TYPE_POWER.get(bear.bear_type, 1.0)
-    level_bonus = bear.level * 0.1
-    return (base_power + level_bonus) * 100
-
 
 def get_user_rank(rating: int) -> str:
     """Get rank by rating."""
@@ -64,20 +55,27 @@ async def pvp_menu(query: CallbackQuery):
                 await query.answer("❌ У вас нет медведей для батлов!", show_alert=True)
                 return
             
-            # Get PvP stats (mock for now)
-            pvp_rating = 1000  # TODO: Add PvPStats model
-            pvp_wins = 0
-            pvp_losses = 0
+            # Get PvP stats
+            stats = await PvPRatingService.get_stats(session, user.id)
+            pvp_rating = stats.rating if stats else ELO_DEFAULT_RATING
+            pvp_wins = stats.wins if stats else 0
+            pvp_losses = stats.losses if stats else 0
             
             rank = get_user_rank(pvp_rating)
             
-            # Calculate total power
-            total_power = sum(calculate_bear_power(bear) for bear in bears)
+            await pvp_leaderboard.ensure_loaded(session)
+            place = pvp_leaderboard.rank(user.id)
+            place_text = f"#{place} из {len(pvp_leaderboard)}" if place else "—"
+            
+            # Calculate total power and refresh own matchmaking entry
+            total_power = calculate_team_power(bears)
+            pvp_matchmaker.update_power(user.id, total_power)
             
             text = (
                 f"⚔️ **PvP Арена**\n\n"
                 f"🏅 **Ваш ранг:** {rank}\n"
                 f"⭐ Рейтинг: {pvp_rating}\n"
+                f"📍 Место в топе: {place_text}\n"
                 f"💪 Сила медведей: {total_power:.0f}\n\n"
                 f"📊 **Статистика:**\n"
                 f"├ ✅ Побед: {pvp_wins}\n"
@@ -94,6 +92,7 @@ async def pvp_menu(query: CallbackQuery):
                 [InlineKeyboardButton(text="⚡ Быстрый бой", callback_data="pvp_quick")],
                 [InlineKeyboardButton(text="🏆 Рейтинговый бой", callback_data="pvp_ranked")],
                 [InlineKeyboardButton(text="🎯 Найти противника", callback_data="pvp_matchmaking")],
+                [InlineKeyboardButton(text="🏆 Турнир недели", callback_data="pvp_tournament")],
                 [InlineKeyboardButton(text="📊 Топ-100", callback_data="pvp_leaderboard")],
                 [InlineKeyboardButton(text="⬅️ Назад", callback_data="main_menu")],
             ])
@@ -137,10 +136,30 @@ async def pvp_quick_battle(query: CallbackQuery):
             user_bear = user_bears[0]
             user_power = calculate_bear_power(user_bear)
             
-            # Find opponent (random bear from other users)
-            opponent_query = select(Bear).where(Bear.owner_id != user.id).order_by(func.random()).limit(1)
-            opponent_result = await session.execute(opponent_query)
-            opponent_bear = opponent_result.scalar_one_or_none()
+            # Find opponent with similar team power (matchmaking ladder, O(log n))
+            await pvp_matchmaker.ensure_fresh(session)
+            team_power = calculate_team_power(user_bears)
+            pvp_matchmaker.update_power(user.id, team_power)
+            
+            opponent_bear = None
+            tried = set()
+            for _ in range(3):
+                opponent_id = pvp_matchmaker.find_opponent(user.id, team_power, exclude=tried)
+                if opponent_id is None:
+                    break
+                opponent_query = (
+                    select(Bear)
+                    .where(Bear.owner_id == opponent_id)
+                    .order_by(Bear.level.desc())
+                    .limit(1)
+                )
+                opponent_result = await session.execute(opponent_query)
+                opponent_bear = opponent_result.scalar_one_or_none()
+                if opponent_bear:
+                    break
+                # Stale ladder entry - the player has no bears anymore
+                pvp_matchmaker.remove(opponent_id)
+                tried.add(opponent_id)
             
             if not opponent_bear:
                 await query.answer("❌ Не найден противник!", show_alert=True)
@@ -168,13 +187,21 @@ async def pvp_quick_battle(query: CallbackQuery):
                 result_emoji = "❌"
             
             # Log transaction
-            transaction = CoinTransaction(
-                user_id=user.id,
-                amount=reward - bet_amount,
-                transaction_type='pvp_battle',
-                description=f'PvP бой: {"Победа" if user_wins else "Поражение"}'
-            )
-            session.add(transaction)
+            ledger.defer(session, [(
+                user.id,
+                reward - bet_amount,
+                'pvp_battle',
+                f'PvP бой: {"Победа" if user_wins else "Поражение"}'
+            )])
+            
+            # Update Elo ratings
+            await pvp_leaderboard.ensure_loaded(session)
+            opponent_id = opponent_bear.owner_id
+            if user_wins:
+                rating_changes = await PvPRatingService.record_battle(session, user.id, opponent_id)
+            else:
+                rating_changes = await PvPRatingService.record_battle(session, opponent_id, user.id)
+            old_rating, new_rating = rating_changes[user.id]
             
             await session.commit()
             
@@ -196,6 +223,7 @@ async def pvp_quick_battle(query: CallbackQuery):
             else:
                 text += f"💸 Потеря: -{bet_amount} коинов\n"
             
+            text += f"⭐ Рейтинг: {old_rating} → {new_rating} ({new_rating - old_rating:+d})\n"
             text += f"\n💼 Новый баланс: {user.coins:,.0f} Coins"
             
             keyboard = InlineKeyboardMarkup(inline_keyboard=[
@@ -213,3 +241,147 @@ async def pvp_quick_battle(query: CallbackQuery):
     except Exception as e:
         logger.error(f"❌ Error in pvp_quick_battle: {e}", exc_info=True)
         await query.answer(f"❌ Ошибка: {str(e)}", show_alert=True)
+
+
+@router.callback_query(F.data == "pvp_leaderboard")
+async def pvp_leaderboard_menu(query: CallbackQuery):
+    """Show PvP Top-100 by rating."""
+    try:
+        async with get_session() as session:
+            user_query = select(User).where(User.telegram_id == query.from_user.id)
+            user_result = await session.execute(user_query)
+            user = user_result.scalar_one()
+            
+            await pvp_leaderboard.ensure_loaded(session)
+            top = pvp_leaderboard.top(LEADERBOARD_SIZE)
+            
+            # Names only for the players shown
+            names = {}
+            if top:
+                names_query = select(User.id, User.username, User.first_name).where(
+                    User.id.in_([user_id for user_id, _ in top])
+                )
+                names_result = await session.execute(names_query)
+                names = {
+                    user_id: username or first_name or f"Игрок {user_id}"
+                    for user_id, username, first_name in names_result.all()
+                }
+            
+            text = f"📊 PvP Топ-{LEADERBOARD_SIZE}\n\n"
+            if not top:
+                text += "Пока никто не сражался. Будьте первым! ⚔️\n"
+            
+            medals = {1: "🥇", 2: "🥈", 3: "🥉"}
+            for place, (user_id, rating) in enumerate(top, start=1):
+                name = names.get(user_id, f"Игрок {user_id}")[:16]
+                marker = " ⬅️" if user_id == user.id else ""
+                text += f"{medals.get(place, f'{place}.')} {name} — {rating}{marker}\n"
+            
+            place = pvp_leaderboard.rank(user.id)
+            if place:
+                text += f"\n📍 Ваше место: #{place} из {len(pvp_leaderboard)}"
+            else:
+                text += "\n📍 Вы ещё не участвовали в боях"
+            
+            keyboard = InlineKeyboardMarkup(inline_keyboard=[
+                [InlineKeyboardButton(text="⬅️ К PvP", callback_data="pvp")],
+            ])
+            
+            try:
+                await query.message.edit_text(text, reply_markup=keyboard)
+            except Exception:
+                await query.message.answer(text, reply_markup=keyboard)
+            
+            await query.answer()
+    
+    except Exception as e:
+        logger.error(f"❌ Error in pvp_leaderboard: {e}", exc_info=True)
+        await query.answer(f"❌ Ошибка: {str(e)}", show_alert=True)
+
+
+@router.callback_query(F.data == "pvp_tournament")
+async def pvp_tournament(query: CallbackQuery):
+    """Show weekly tournament: registration state and last results."""
+    try:
+        async with get_session() as session:
+            user_query = select(User).where(User.telegram_id == query.from_user.id)
+            user_result = await session.execute(user_query)
+            user = user_result.scalar_one()
+            
+            tournament = await TournamentService.get_current(session)
+            entry = await TournamentService.get_entry(session, tournament.id, user.id)
+            last = await TournamentService.get_last_finished(session)
+            last_entry = await TournamentService.get_entry(session, last.id, user.id) if last else None
+            
+            registration_open = (
+                tournament.status == 'registration' and datetime.utcnow() < tournament.registration_ends_at
+            )
+            
+            text = (
+                f"🏆 **Турнир недели**\n\n"
+                f"📅 Старт: {tournament.registration_ends_at:%d.%m %H:%M} UTC\n"
+                f"👥 Участников: {tournament.players_count}\n"
+                f"💰 Призовой фонд: {tournament.prize_pool:,.0f} коинов\n"
+                f"🎟 Взнос: {tournament.entry_fee:,.0f} коинов ({(1 - TOURNAMENT_HOUSE_CUT) * 100:.0f}% идёт в фонд)\n\n"
+                f"⚔️ Швейцарская система: в каждом раунде соперник с тем же счётом, "
+                f"шанс победы зависит от силы всей команды. Призы - топ-10.\n\n"
+            )
+            
+            if entry:
+                text += "✅ Вы зарегистрированы!\n"
+            elif registration_open:
+                text += "📝 Регистрация открыта\n"
+            else:
+                text += "⏳ Регистрация закрыта - ждите следующей недели\n"
+            
+            if last_entry and last_entry.place:
+                text += (
+                    f"\n📊 **Прошлый турнир:** место {last_entry.place} из {last.players_count}, "
+                    f"побед {last_entry.score}/{last.rounds}"
+                )
+                if last_entry.prize_coins:
+                    text += f", приз {last_entry.prize_coins:,.0f} коинов"
+                text += "\n"
+            
+            buttons = []
+            if registration_open and not entry:
+                buttons.append([InlineKeyboardButton(
+                    text=f"✅ Участвовать ({tournament.entry_fee:,.0f} коинов)",
+                    callback_data="pvp_tournament_join"
+                )])
+            buttons.append([InlineKeyboardButton(text="⬅️ К PvP", callback_data="pvp")])
+            keyboard = InlineKeyboardMarkup(inline_keyboard=buttons)
+            
+            try:
+                await query.message.edit_text(text, reply_markup=keyboard, parse_mode="markdown")
+            except Exception:
+                await query.message.answer(text, reply_markup=keyboard, parse_mode="markdown")
+            
+            await query.answer()
+    
+    except Exception as e:
+        logger.error(f"❌ Error in pvp_tournament: {e}", exc_info=True)
+        await query.answer(f"❌ Ошибка: {str(e)}", show_alert=True)
+
+
+@router.callback_query(F.data == "pvp_tournament_join")
+async def pvp_tournament_join(query: CallbackQuery):
+    """Register for the weekly tournament."""
+    try:
+        async with get_session() as session:
+            user_query = select(User).where(User.telegram_id == query.from_user.id)
+            user_result = await session.execute(user_query)
+            user = user_result.scalar_one()
+            
+            try:
+                await TournamentService.register(session, user.id)
+            except ValueError as e:
+                await query.answer(f"❌ {str(e)}", show_alert=True)
+                return
+        
+        # Обновлённый экран турнира (там же отметка о регистрации)
+        await pvp_tournament(query)
+    
+    except Exception as e:
+        logger.error(f"❌ Error in pvp_tournament_join: {e}", exc_info=True)
+        await query.answer(f"❌ Ошибка: {str(e)}", show_alert=True)
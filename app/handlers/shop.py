@@ -5,13 +5,17 @@ from aiogram.types import CallbackQuery
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.database.db import get_session
 from app.database.models import User
-from app.services.bears import BearsService, BEAR_CLASSES, BEAR_NAMES
+from app.services.bears import BearsService, BEAR_CLASSES, BEAR_NAMES, MAX_BEARS_PER_RARITY_LEVEL_1
+from app.services.analytics import analytics
 from sqlalchemy import select
 from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
 
 logger = logging.getLogger(__name__)
 router = Router()
 
+# Варианты количества для оптовой покупки
+BUY_QUANTITIES = [1, 5, 10]
+
 
 @router.callback_query(F.data == "shop")
 async def shop_menu(query: CallbackQuery):
@@ -205,13 +209,15 @@ async def bear_page(query: CallbackQuery):
 async def bear_confirm(query: CallbackQuery):
     """
     Show confirmation for buying a specific bear.
+    Callback: bear_confirm:{type}:{variant}[:{qty}]
     """
     try:
         parts = query.data.split(":")
         bear_type = parts[1]
         variant = int(parts[2])
+        quantity = int(parts[3]) if len(parts) > 3 else 1
         
-        if bear_type not in BEAR_CLASSES:
+        if bear_type not in BEAR_CLASSES or quantity < 1:
             await query.answer("❌ Неизвестный тип")
             return
         
@@ -224,7 +230,9 @@ async def bear_confirm(query: CallbackQuery):
             class_info = BEAR_CLASSES[bear_type]
             bear_names = BEAR_NAMES[bear_type]
             stats = BearsService.get_bear_stats(bear_type, variant)
-            cost = stats['cost']
+            # Цена со скидкой из улучшений (модификаторы кешируются - без лишних запросов)
+            cost = await BearsService.get_shop_price(session, user.id, bear_type, variant, quantity)
+            unit_cost = await BearsService.get_shop_price(session, user.id, bear_type, variant)
             
             # Check premium for legendary
             if class_info['require_premium'] and not user.is_premium:
@@ -234,6 +242,9 @@ async def bear_confirm(query: CallbackQuery):
                 )
                 return
             
+            counts = await BearsService.count_level_1_bears(session, user.id, [bear_type])
+            free_slots = max(MAX_BEARS_PER_RARITY_LEVEL_1 - counts[bear_type], 0)
+            
             if user.coins < cost:
                 text = (
                     f"😢 **Недостаточно коинов**\n\n"
@@ -248,16 +259,33 @@ async def bear_confirm(query: CallbackQuery):
                 text = (
                     f"{class_info['color']} **Купить этого медведя?**\n\n"
                     f"{class_info['emoji']} **{bear_names[variant-1]}** (Вариант {variant}/15)\n"
-                    f"💰 Цена: {cost} коинов\n"
+                    f"💰 Цена: {unit_cost} коинов\n"
                     f"💵 Обмен: {stats['sell']} коинов\n"
                     f"💰 Доход: +{stats['income']:.2f} коин/ч (Lv1)\n"
-                    f"\n💰 Останется: {user.coins - cost:.0f} коинов"
+                    f"\n🛒 Количество: {quantity} шт. (свободно мест: {free_slots})\n"
+                    f"💰 Итого: {cost} коинов\n"
+                    f"💰 Останется: {user.coins - cost:.0f} коинов"
                 )
-                keyboard = InlineKeyboardMarkup(inline_keyboard=[
-                    [
-                        InlineKeyboardButton(text="✅ Купить", callback_data=f"buy_confirm:{bear_type}:{variant}"),
-                        InlineKeyboardButton(text="⬅️ Назад", callback_data=f"select_class:{bear_type}"),
-                    ],
+                
+                # Только те количества, на которые хватает коинов и мест
+                quantity_buttons = [
+                    InlineKeyboardButton(
+                        text=f"{'• ' if qty == quantity else ''}x{qty}",
+                        callback_data=f"bear_confirm:{bear_type}:{variant}:{qty}"
+                    )
+                    for qty in BUY_QUANTITIES
+                    if qty <= free_slots and unit_cost * qty <= user.coins
+                ]
+                
+                keyboard = InlineKeyboardMarkup(inline_keyboard=[])
+                if len(quantity_buttons) > 1:
+                    keyboard.inline_keyboard.append(quantity_buttons)
+                keyboard.inline_keyboard.append([
+                    InlineKeyboardButton(
+                        text=f"✅ Купить x{quantity}",
+                        callback_data=f"buy_confirm:{bear_type}:{variant}:{quantity}"
+                    ),
+                    InlineKeyboardButton(text="⬅️ Назад", callback_data=f"select_class:{bear_type}"),
                 ])
             
             try:
@@ -275,14 +303,16 @@ async def bear_confirm(query: CallbackQuery):
 @router.callback_query(F.data.startswith("buy_confirm:"))
 async def buy_confirm(query: CallbackQuery):
     """
-    Purchase a specific bear variant.
+    Purchase one or more bears of a specific variant.
+    Callback: buy_confirm:{type}:{variant}[:{qty}]
     """
     try:
         parts = query.data.split(":")
         bear_type = parts[1]
         variant = int(parts[2])
+        quantity = int(parts[3]) if len(parts) > 3 else 1
         
-        if bear_type not in BEAR_CLASSES:
+        if bear_type not in BEAR_CLASSES or quantity < 1:
             await query.answer("❌ Неизвестный тип")
             return
         
@@ -293,31 +323,29 @@ async def buy_confirm(query: CallbackQuery):
             user = user_result.scalar_one()
             
             class_info = BEAR_CLASSES[bear_type]
-            bear_names = BEAR_NAMES[bear_type]
-            stats = BearsService.get_bear_stats(bear_type, variant)
-            cost = stats['cost']
             
             # Check premium for legendary
             if class_info['require_premium'] and not user.is_premium:
                 await query.answer("💳 Недостаточно прав для покупки", show_alert=True)
                 return
             
-            if user.coins < cost:
-                await query.answer("❌ Недостаточно коинов", show_alert=True)
-                return
-            
             try:
-                # Create bear with specific variant
-                bear = await BearsService.create_bear(session, user.id, bear_type, variant=variant)
-                user.coins -= cost
+                # Whole order: one price, one limit check, atomic debit, bulk insert
+                bears = await BearsService.buy_bears(session, user.id, bear_type, variant, quantity)
+                portfolio = await BearsService.get_portfolio_summary(session, user.id)
                 await session.commit()
                 
+                bear = bears[0]
+                bought_text = bear.name if quantity == 1 else f"{BEAR_NAMES[bear_type][variant-1]} x{quantity}"
+                
                 text = (
-                    f"✅ **Медведь куплен!**\n\n"
-                    f"{class_info['color']} {class_info['emoji']} {bear.name}\n"
+                    f"✅ **{'Медведь куплен' if quantity == 1 else 'Медведи куплены'}!**\n\n"
+                    f"{class_info['color']} {class_info['emoji']} {bought_text}\n"
                     f"Класс: {class_info['rarity']}\n"
                     f"Вариант: {bear.variant}/15\n"
-                    f"💰 Осталось: {user.coins:.0f} коинов"
+                    f"💰 Осталось: {user.coins:.0f} коинов\n\n"
+                    f"🐻 Всего медведей: {portfolio['total_bears']}\n"
+                    f"📈 Доход: {portfolio['coins_per_hour']:.2f} коин/ч"
                 )
                 keyboard = InlineKeyboardMarkup(inline_keyboard=[
                     [InlineKeyboardButton(text="✅ Купить ещё", callback_data=f"select_class:{bear_type}")],
@@ -331,7 +359,10 @@ async def buy_confirm(query: CallbackQuery):
                     logger.warning(f"Could not edit message: {e}, sending new message instead")
                     await query.message.answer(text, reply_markup=keyboard, parse_mode="markdown")
                 
-                await query.answer(f"✅ {bear.name} куплен!")
+                await query.answer(f"✅ {bought_text} куплен!")
+                await analytics.track_event(user.id, 'bear_purchased', {
+                    'bear_type': bear_type, 'variant': variant, 'quantity': quantity,
+                })
             except ValueError as e:
                 await query.answer(f"❌ {str(e)}", show_alert=True)
     except Exception as e:
@@ -6,14 +6,16 @@ from aiogram.filters import CommandStart
 from sqlalchemy import select
 from app.database.db import get_session
 from app.database.models import User, CoinTransaction
+from app.services.leaderboard import leaderboards
+from app.services.analytics import analytics
+from app.services.activity import activity
+from app.services.referrals import REFERRAL_BONUS
 from datetime import datetime
 from app.bot import bot
 
 logger = logging.getLogger(__name__)
 router = Router()
 
-REFERRAL_BONUS = 100  # Bonus for both referrer and referred user
-
 
 @router.message(CommandStart())
 async def cmd_start(message: Message):
@@ -98,6 +100,7 @@ async def cmd_start(message: Message):
                         await session.refresh(user)
                         await session.refresh(referrer)
                         
+                        leaderboards.increment('referrers', referrer.id)
                         logger.info(f"✅ Referral: {referrer_telegram_id} invited {user_id}")
                         
                         # Send notification to referrer
@@ -131,6 +134,8 @@ async def cmd_start(message: Message):
                 
                 is_new_user = True
                 logger.info(f"✅ New user registered: {user_id} (@{username})")
+                await analytics.track_event(user.id, 'user_registered', {'referred': bool(user.referred_by)})
+                activity.touch(user_id, 'new')
             
             # Welcome message
             if is_new_user:
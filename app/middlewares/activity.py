@@ -0,0 +1,23 @@
+"""Activity middleware: marks the user active for today (DAU / retention bitmaps)."""
+from typing import Any, Awaitable, Callable, Dict
+from aiogram import BaseMiddleware
+from aiogram.types import Message, CallbackQuery
+from app.services.activity import activity
+
+
+class ActivityMiddleware(BaseMiddleware):
+    """Middleware for activity tracking (in-memory mark, flushed in the background)."""
+    
+    async def __call__(
+        self,
+        handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]],
+        event: Any,
+        data: Dict[str, Any]
+    ) -> Any:
+        """
+        Mark the sender active before processing.
+        """
+        if isinstance(event, (Message, CallbackQuery)) and event.from_user:
+            activity.touch(event.from_user.id)
+        
+        return await handler(event, data)
@@ -1,14 +1,23 @@
 """Logging middleware for tracking user actions."""
 import logging
+import time
 from typing import Any, Awaitable, Callable, Dict
 from aiogram import BaseMiddleware
 from aiogram.types import Message, CallbackQuery
+from app.utils.logs import log_context
 
 logger = logging.getLogger(__name__)
 
 
 class LoggingMiddleware(BaseMiddleware):
-    """Middleware for logging user actions."""
+    """
+    Middleware for logging user actions.
+    
+    Puts update_id, user_id and the handler name into log_context for the
+    whole handler call, so every log line written while handling the update
+    carries them, and writes one trace line per update (category 'message'
+    or 'callback', sampled by LOG_SAMPLING) with the handler duration.
+    """
     
     async def __call__(
         self,
@@ -17,16 +26,29 @@ class LoggingMiddleware(BaseMiddleware):
         data: Dict[str, Any]
     ) -> Any:
         """
-        Log user action before processing.
+        Set the log context, process the update, log the trace line.
         """
-        if isinstance(event, Message):
-            logger.info(
-                f"💬 Message from @{event.from_user.username} ({event.from_user.id}): {event.text[:50] if event.text else 'N/A'}"
-            )
-        elif isinstance(event, CallbackQuery):
-            logger.info(
-                f"👉 Callback from @{event.from_user.username} ({event.from_user.id}): {event.data}"
-            )
-        
-        # Process request
-        return await handler(event, data)
+        update = data.get('event_update')
+        handler_object = data.get('handler')
+        callback = getattr(handler_object, 'callback', None)
+        token = log_context.set({
+            'update_id': update.update_id if update else None,
+            'user_id': event.from_user.id if getattr(event, 'from_user', None) else None,
+            'handler': f"{callback.__module__.rsplit('.', 1)[-1]}.{callback.__qualname__}" if callback else None,
+        })
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            duration_ms = round((time.perf_counter() - started) * 1000, 2)
+            if isinstance(event, Message):
+                logger.info(
+                    "💬 Message",
+                    extra={'category': 'message', 'text': event.text[:50] if event.text else None, 'duration_ms': duration_ms}
+                )
+            elif isinstance(event, CallbackQuery):
+                logger.info(
+                    "👉 Callback",
+                    extra={'category': 'callback', 'data': event.data, 'duration_ms': duration_ms}
+                )
+            log_context.reset(token)
@@ -0,0 +1,222 @@
+"""User activity as one bitmap per day (bit N = users.id N): DAU / WAU / MAU and cohort retention."""
+import asyncio
+import logging
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+from sqlalchemy import select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database.db import get_session
+from app.database.models import User, ActivityBitmap
+from config import settings
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:  # Redis не обязателен - битмапы хранятся в БД
+    aioredis = None
+
+logger = logging.getLogger(__name__)
+
+ACTIVITY_FLUSH_INTERVAL = 10  # Секунд между сбросами отметок
+ACTIVITY_KINDS = ('active', 'new')  # 'active' - было действие за день, 'new' - регистрация в этот день
+ACTIVITY_REDIS_TTL = timedelta(days=400)
+ACTIVITY_CACHE_DAYS = 120  # Битмапов прошлых дней в памяти процесса
+ACTIVITY_LOOKUP_CHUNK = 10000  # telegram_id в одном IN (...) - у asyncpg лимит 32767 параметров
+
+# Redis нумерует биты от старшего бита байта, int.from_bytes(..., 'little') - от младшего
+_BIT_REVERSE = bytes(int(f'{i:08b}'[::-1], 2) for i in range(256))
+
+
+def _to_bitmap(user_ids: set[int]) -> int:
+    """Bitmap with bit N set for every N in user_ids (built in a bytearray, not by shifting a big int)."""
+    buf = bytearray((max(user_ids) >> 3) + 1)
+    for user_id in user_ids:
+        buf[user_id >> 3] |= 1 << (user_id & 7)
+    return int.from_bytes(buf, 'little')
+
+
+class DatabaseActivityStore:
+    """Bitmaps in activity_bitmaps (bytea, little-endian: bit N = user N), merged with OR under a row lock."""
+    
+    async def add(self, session: AsyncSession, kind: str, day: date, user_ids: set[int]):
+        await session.execute(
+            pg_insert(ActivityBitmap)
+            .values(kind=kind, day=day, bitmap=b'')
+            .on_conflict_do_nothing(index_elements=['kind', 'day'])
+        )
+        result = await session.execute(
+            select(ActivityBitmap.bitmap)
+            .where(ActivityBitmap.kind == kind, ActivityBitmap.day == day)
+            .with_for_update()
+        )
+        merged = int.from_bytes(result.scalar_one(), 'little') | _to_bitmap(user_ids)
+        await session.execute(
+            update(ActivityBitmap)
+            .where(ActivityBitmap.kind == kind, ActivityBitmap.day == day)
+            .values(bitmap=merged.to_bytes((merged.bit_length() + 7) // 8, 'little'))
+            .execution_options(synchronize_session=False)
+        )
+    
+    async def get(self, session: AsyncSession, kind: str, days: list[date]) -> dict[date, int]:
+        result = await session.execute(
+            select(ActivityBitmap.day, ActivityBitmap.bitmap)
+            .where(ActivityBitmap.kind == kind, ActivityBitmap.day.in_(days))
+        )
+        return {day: int.from_bytes(bitmap, 'little') for day, bitmap in result.all()}
+
+
+class RedisActivityStore:
+    """Bitmaps as Redis strings activity:{kind}:{YYYYMMDD}, written with SETBIT."""
+    
+    def __init__(self, url: str):
+        self._redis = aioredis.from_url(url)
+    
+    @staticmethod
+    def _key(kind: str, day: date) -> str:
+        return f"activity:{kind}:{day:%Y%m%d}"
+    
+    async def add(self, session: AsyncSession, kind: str, day: date, user_ids: set[int]):
+        key = self._key(kind, day)
+        async with self._redis.pipeline(transaction=False) as pipe:
+            for user_id in user_ids:
+                pipe.setbit(key, user_id, 1)
+            pipe.expire(key, ACTIVITY_REDIS_TTL)
+            await pipe.execute()
+    
+    async def get(self, session: AsyncSession, kind: str, days: list[date]) -> dict[date, int]:
+        values = await self._redis.mget([self._key(kind, day) for day in days])
+        return {
+            day: int.from_bytes(value.translate(_BIT_REVERSE), 'little')
+            for day, value in zip(days, values)
+            if value is not None
+        }
+
+
+class ActivityTracker:
+    """
+    Records who did something each day and answers DAU / WAU / MAU and
+    retention from per-day bitmaps.
+    
+    touch() only adds the Telegram id to an in-memory set, so handlers pay
+    nothing for it. Every ACTIVITY_FLUSH_INTERVAL the sets are resolved to
+    users.id with one query (ids are dense, which keeps the bitmaps compact:
+    1M users = 125 KB a day) and OR-ed into the day's bitmap in the store.
+    Counts are popcounts of AND / OR of Python ints. Bitmaps of finished
+    days are cached, so a 30-day MAU or a retention curve is computed
+    without reading the store again. `users` is only read to map new
+    Telegram ids.
+    """
+    
+    def __init__(self, store):
+        self.store = store
+        self._pending: dict[tuple[str, date], set[int]] = {}
+        self._cache: OrderedDict = OrderedDict()
+        self._task: asyncio.Task | None = None
+        self._flush_lock = asyncio.Lock()
+    
+    def touch(self, telegram_id: int, kind: str = 'active', now: datetime = None):
+        """Mark the user for today (cheap; written on the next flush)."""
+        day = (now or datetime.utcnow()).date()
+        self._pending.setdefault((kind, day), set()).add(telegram_id)
+    
+    async def flush(self) -> int:
+        """Write pending marks; returns the number of (user, kind, day) marks flushed."""
+        async with self._flush_lock:
+            if not self._pending:
+                return 0
+            pending, self._pending = self._pending, {}
+            try:
+                async with get_session() as session:
+                    telegram_ids = list(set().union(*pending.values()))
+                    user_ids = {}
+                    for start in range(0, len(telegram_ids), ACTIVITY_LOOKUP_CHUNK):
+                        result = await session.execute(
+                            select(User.telegram_id, User.id)
+                            .where(User.telegram_id.in_(telegram_ids[start:start + ACTIVITY_LOOKUP_CHUNK]))
+                        )
+                        user_ids.update(result.all())
+                    for (kind, day), marked in sorted(pending.items()):
+                        ids = {user_ids[telegram_id] for telegram_id in marked if telegram_id in user_ids}
+                        if ids:
+                            await self.store.add(session, kind, day, ids)
+                            self._cache.pop((kind, day), None)
+            except Exception:
+                # Вернём отметки - запишем при следующем сбросе
+                for key, marked in pending.items():
+                    self._pending.setdefault(key, set()).update(marked)
+                raise
+            return sum(len(marked) for marked in pending.values())
+    
+    # ============ ЧТЕНИЕ ============
+    
+    async def bitmaps(self, session: AsyncSession, kind: str, days: list[date]) -> dict[date, int]:
+        """Bitmaps for the given days (0 for days without activity)."""
+        # Вчерашний день ещё может дописаться сбросом после полуночи - кешируем только более старые
+        settled = datetime.utcnow().date() - timedelta(days=1)
+        found = {day: self._cache[(kind, day)] for day in days if (kind, day) in self._cache}
+        missing = [day for day in days if day not in found]
+        if missing:
+            loaded = await self.store.get(session, kind, missing)
+            for day in missing:
+                found[day] = loaded.get(day, 0)
+                if day < settled:
+                    self._cache[(kind, day)] = found[day]
+                    self._cache.move_to_end((kind, day))
+            while len(self._cache) > ACTIVITY_CACHE_DAYS * len(ACTIVITY_KINDS):
+                self._cache.popitem(last=False)
+        return found
+    
+    async def active_users(self, session: AsyncSession, days: int = 1, until: date = None) -> int:
+        """Distinct users active in the `days` days ending with `until` (1 = DAU, 7 = WAU, 30 = MAU)."""
+        until = until or datetime.utcnow().date()
+        bitmaps = await self.bitmaps(session, 'active', [until - timedelta(days=i) for i in range(days)])
+        union = 0
+        for bits in bitmaps.values():
+            union |= bits
+        return union.bit_count()
+    
+    async def retention(self, session: AsyncSession, cohort_day: date, days: int) -> tuple[int, int]:
+        """(cohort size, retained): users registered on cohort_day and active `days` days later."""
+        cohort = (await self.bitmaps(session, 'new', [cohort_day]))[cohort_day]
+        target = cohort_day + timedelta(days=days)
+        active = (await self.bitmaps(session, 'active', [target]))[target]
+        return cohort.bit_count(), (cohort & active).bit_count()
+    
+    # ============ ФОНОВЫЙ СБРОС ============
+    
+    def start(self):
+        """Start the background flusher."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        """Stop the flusher and write what is left."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error(f"❌ Final activity flush failed: {e}")
+    
+    async def _run(self):
+        while True:
+            await asyncio.sleep(ACTIVITY_FLUSH_INTERVAL)
+            try:
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ Activity flush failed: {e}", exc_info=True)
+
+
+def _configured_store():
+    if settings.ACTIVITY_STORE == 'redis':
+        if aioredis is not None and settings.REDIS_URL:
+            return RedisActivityStore(settings.REDIS_URL)
+        logger.error("❌ ACTIVITY_STORE=redis but Redis is not available, using the database")
+    return DatabaseActivityStore()
+
+
+activity = ActivityTracker(_configured_store())
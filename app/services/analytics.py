@@ -1,10 +1,13 @@
 """Analytics and tracking system."""
 import logging
-from datetime import datetime
+from datetime import date, datetime, timedelta
 from typing import Optional
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, func
-from app.database.models import User, Bear, CoinTransaction
+from app.database.models import User, Bear
+from app.services.activity import activity
+from app.services.events import event_pipeline
+from app.services.ledger_archive import LedgerArchiveService
 
 logger = logging.getLogger(__name__)
 
@@ -13,19 +16,17 @@ class Analytics:
     """Analytics service for tracking events and metrics."""
     
     @staticmethod
-    async def track_event(session: AsyncSession, user_id: int, event_name: str, properties: dict = None):
+    async def track_event(user_id: int, event_name: str, properties: dict = None):
         """
-        Track user event.
+        Track user event (queued in memory, written in batches by the event pipeline).
         
         Args:
-            session: Database session
-            user_id: User ID
-            event_name: Event name (e.g., 'bear_purchased', 'case_opened')
-            properties: Additional event properties
+            user_id: User ID (users.id)
+            event_name: Event name from EVENT_SCHEMA (e.g., 'bear_purchased', 'case_opened')
+            properties: Event properties, as declared in EVENT_SCHEMA
         """
         try:
-            # TODO: Save to analytics table or send to external service
-            logger.info(f"📊 Event tracked: {event_name} for user {user_id}, props: {properties}")
+            await event_pipeline.emit(event_name, user_id, properties)
         except Exception as e:
             logger.error(f"❌ Error tracking event: {e}")
     
@@ -36,12 +37,7 @@ class Analytics:
         """
         try:
             # Get total TON spent
-            ton_spent_query = select(func.sum(CoinTransaction.amount)).where(
-                CoinTransaction.user_id == user_id,
-                CoinTransaction.transaction_type.in_(['premium_purchase', 'nft_mint'])
-            )
-            result = await session.execute(ton_spent_query)
-            ton_spent = result.scalar() or 0
+            ton_spent = await LedgerArchiveService.get_user_total(session, user_id, ['premium_purchase', 'nft_mint'])
             
             return float(ton_spent)
         except Exception as e:
@@ -49,33 +45,39 @@ class Analytics:
             return 0.0
     
     @staticmethod
-    async def get_retention_rate(session: AsyncSession, days: int = 7) -> float:
+    async def get_retention_rate(session: AsyncSession, days: int = 7, cohort_day: date = None) -> float:
         """
-        Calculate retention rate.
+        Calculate N-day retention: % of users registered on cohort_day
+        (default: `days` days ago) who were active `days` days later.
         """
         try:
-            # TODO: Implement retention calculation
-            return 0.0
+            cohort_day = cohort_day or datetime.utcnow().date() - timedelta(days=days)
+            cohort, retained = await activity.retention(session, cohort_day, days)
+            if cohort == 0:
+                return 0.0
+            return (retained / cohort) * 100
         except Exception as e:
             logger.error(f"❌ Error calculating retention: {e}")
             return 0.0
     
     @staticmethod
-    async def get_daily_active_users(session: AsyncSession) -> int:
+    async def get_active_users(session: AsyncSession, days: int = 1, until: date = None) -> int:
         """
-        Get daily active users count.
+        Get distinct users active in the last `days` days (1 = DAU, 7 = WAU, 30 = MAU).
         """
         try:
-            today_start = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
-            query = select(func.count(User.id.distinct())).where(
-                User.updated_at >= today_start
-            )
-            result = await session.execute(query)
-            return result.scalar() or 0
+            return await activity.active_users(session, days, until)
         except Exception as e:
-            logger.error(f"❌ Error getting DAU: {e}")
+            logger.error(f"❌ Error getting active users: {e}")
             return 0
     
+    @staticmethod
+    async def get_daily_active_users(session: AsyncSession) -> int:
+        """
+        Get daily active users count.
+        """
+        return await Analytics.get_active_users(session, 1)
+    
     @staticmethod
     async def get_conversion_rate(session: AsyncSession) -> float:
         """
@@ -0,0 +1,248 @@
+"""Auto-collect and auto-reinvest upgrades, processed by a background worker in SQL batches."""
+import asyncio
+import logging
+from datetime import datetime
+from sqlalchemy import select, update, func, case, Integer, Float, Numeric
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database.db import get_session
+from app.database.models import User, Bear, UserUpgrade
+from app.services.bears import BearsService, MAX_BEARS_PER_RARITY_LEVEL_1
+from app.services.leaderboard import leaderboards
+from app.services.ledger import ledger
+from app.services.upgrades import UPGRADES_CONFIG, MAX_SHOP_DISCOUNT, UpgradesService
+
+logger = logging.getLogger(__name__)
+
+AUTO_COLLECT_CHECK_INTERVAL = 60  # Секунд между проходами воркера
+AUTO_COLLECT_BATCH_SIZE = 2000  # Пользователей на один UPDATE
+AUTO_COLLECT_MAX_HOURS = 24  # Не начисляем больше суток за один сбор
+AUTO_REINVEST_CHUNK_SIZE = 100
+AUTO_REINVEST_CONCURRENCY = 8
+AUTO_WORKER_TIME_BUDGET = 30  # Секунд на один проход (сбор + реинвест)
+
+# Самый дешёвый медведь при максимальной скидке магазина
+AUTO_REINVEST_MIN_BUDGET = int(BearsService.get_bear_stats('common', 1)['cost'] * (1 - MAX_SHOP_DISCOUNT))
+
+# Уровень авто-реинвеста -> классы медведей, которые можно покупать (лучшие первыми)
+AUTO_REINVEST_CLASSES = {
+    1: ('common',),
+    2: ('rare', 'common'),
+    3: ('epic', 'rare', 'common'),
+}
+
+
+def _level_column(upgrade_type: str):
+    """Aggregate: level of one upgrade type per user (0 if missing)."""
+    return func.coalesce(
+        func.max(case((UserUpgrade.upgrade_type == upgrade_type, UserUpgrade.current_level), else_=0)),
+        0
+    ).label(upgrade_type)
+
+
+def _percent_factor(levels, upgrade_type: str):
+    """SQL form of 1 + effect% for a 'percent' upgrade (see UpgradeModifiers)."""
+    per_level = UPGRADES_CONFIG[upgrade_type]['effect_per_level'] / 100
+    return 1 + func.coalesce(levels.c[upgrade_type], 0) * per_level
+
+
+def _pick_reinvest_order(tier: int, budget: float, counts: dict, price_multiplier: float) -> tuple | None:
+    """(bear_type, variant, quantity): the best affordable variant of the best allowed class with free slots."""
+    for bear_type in AUTO_REINVEST_CLASSES.get(tier, ()):
+        free_slots = MAX_BEARS_PER_RARITY_LEVEL_1 - counts.get(bear_type, 0)
+        if free_slots <= 0:
+            continue
+        for variant in range(15, 0, -1):
+            unit_price = int(BearsService.get_bear_stats(bear_type, variant)['cost'] * price_multiplier)
+            if unit_price <= budget:
+                return bear_type, variant, min(int(budget // unit_price), free_slots)
+    return None
+
+
+class AutoCollectService:
+    """
+    Auto-collect credits bear income to users who own the auto_collect upgrade.
+    
+    Due users are picked by the indexed users.next_auto_collect_at. Each batch
+    is one UPDATE users ... FROM (due users x aggregated income x upgrade
+    levels) ... RETURNING, followed by one same-transaction ledger write. Rows are
+    taken with FOR UPDATE SKIP LOCKED, so several bot processes can share the
+    work. Auto-reinvest then spends the collected amount on bears, per user
+    in its own transaction with bounded concurrency.
+    """
+    
+    @staticmethod
+    async def collect_batch(session: AsyncSession, now: datetime = None, limit: int = AUTO_COLLECT_BATCH_SIZE) -> list[tuple]:
+        """
+        Credit accrued income to up to `limit` due users.
+        Returns (user_id, amount, reinvest_tier) for every processed user.
+        Only executes - the caller commits.
+        """
+        now = now or datetime.utcnow()
+        
+        due = (
+            select(User.id, User.last_auto_collect_at)
+            .where(User.next_auto_collect_at <= now)
+            .order_by(User.next_auto_collect_at)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+            .cte('due')
+        )
+        levels = (
+            select(
+                UserUpgrade.user_id,
+                *(_level_column(t) for t in ('auto_collect', 'auto_reinvest', 'income_multiplier', 'production_speed', 'coin_quality'))
+            )
+            .where(UserUpgrade.user_id.in_(select(due.c.id)))
+            .group_by(UserUpgrade.user_id)
+            .subquery('levels')
+        )
+        # Бусты учитываем только пока они действуют
+        boosted_income = Bear.coins_per_hour * case((Bear.boost_until > now, Bear.boost_multiplier), else_=1.0)
+        income = (
+            select(Bear.owner_id, func.sum(boosted_income).label('per_hour'))
+            .where(Bear.owner_id.in_(select(due.c.id)), Bear.is_on_sale == False)
+            .group_by(Bear.owner_id)
+            .subquery('income')
+        )
+        
+        hours = func.least(
+            func.extract('epoch', now - func.coalesce(due.c.last_auto_collect_at, now)) / 3600,
+            AUTO_COLLECT_MAX_HOURS
+        )
+        multiplier = (
+            _percent_factor(levels, 'income_multiplier')
+            * _percent_factor(levels, 'production_speed')
+            * _percent_factor(levels, 'coin_quality')
+        )
+        auto_collect = UPGRADES_CONFIG['auto_collect']
+        interval_hours = func.greatest(
+            2,
+            auto_collect['base_value'] + auto_collect['effect_per_level'] * func.coalesce(levels.c.auto_collect, 0)
+        )
+        source = (
+            select(
+                due.c.id,
+                func.coalesce(func.round((func.coalesce(income.c.per_hour, 0) * multiplier * hours).cast(Numeric), 2), 0)
+                .cast(Float).label('amount'),
+                interval_hours.cast(Integer).label('interval_hours'),
+                func.coalesce(levels.c.auto_collect, 0).label('auto_collect'),
+                func.coalesce(levels.c.auto_reinvest, 0).label('auto_reinvest'),
+            )
+            .select_from(
+                due.outerjoin(levels, levels.c.user_id == due.c.id)
+                .outerjoin(income, income.c.owner_id == due.c.id)
+            )
+            .subquery('source')
+        )
+        
+        result = await session.execute(
+            update(User)
+            .where(User.id == source.c.id)
+            .values(
+                coins=User.coins + source.c.amount,
+                last_auto_collect_at=now,
+                # Улучшение пропало - снимаем с расписания
+                next_auto_collect_at=case(
+                    (source.c.auto_collect > 0, now + func.make_interval(0, 0, 0, 0, source.c.interval_hours)),
+                    else_=None
+                ),
+            )
+            .returning(User.id, source.c.amount, source.c.auto_reinvest)
+            .execution_options(synchronize_session=False)
+        )
+        collected = result.all()
+        
+        entries = [
+            (user_id, amount, 'auto_collect', f'Автосбор: +{amount:,.2f} коинов')
+            for user_id, amount, _ in collected
+            if amount > 0
+        ]
+        await ledger.write(session, entries)
+        leaderboards.mark_dirty(*(entry[0] for entry in entries))
+        return collected
+    
+    @staticmethod
+    async def reinvest(session: AsyncSession, user_id: int, tier: int, budget: float) -> int:
+        """
+        Spend up to `budget` coins on bears allowed by the reinvest tier.
+        Returns the number of bears bought. Only flushes - the caller commits.
+        """
+        bear_types = list(AUTO_REINVEST_CLASSES.get(tier, ()))
+        if not bear_types:
+            return 0
+        
+        counts = await BearsService.count_level_1_bears(session, user_id, bear_types)
+        modifiers = await UpgradesService.get_modifiers(session, user_id)
+        order = _pick_reinvest_order(tier, budget, counts, modifiers.shop_price_multiplier)
+        if order is None:
+            return 0
+        
+        bear_type, variant, quantity = order
+        bears = await BearsService.buy_bears(session, user_id, bear_type, variant, quantity)
+        return len(bears)
+    
+    @staticmethod
+    async def run_once(now: datetime = None, time_budget: float = AUTO_WORKER_TIME_BUDGET) -> dict:
+        """
+        One worker pass: collect for all due users in batches, then reinvest.
+        Stops starting new work once the time budget is spent; whatever is
+        left stays due and is picked up by the next pass.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + time_budget
+        stats = {'collected_users': 0, 'collected_coins': 0.0, 'reinvested_users': 0, 'bears_bought': 0}
+        reinvest_queue = []
+        
+        while loop.time() < deadline:
+            async with get_session() as session:
+                collected = await AutoCollectService.collect_batch(session, now)
+            stats['collected_users'] += len(collected)
+            stats['collected_coins'] += sum(amount for _, amount, _ in collected)
+            # Кому не хватит даже на самого дешёвого медведя - без отдельной транзакции
+            reinvest_queue.extend(
+                (user_id, tier, amount) for user_id, amount, tier in collected
+                if tier > 0 and amount >= AUTO_REINVEST_MIN_BUDGET
+            )
+            if len(collected) < AUTO_COLLECT_BATCH_SIZE:
+                break
+        
+        semaphore = asyncio.Semaphore(AUTO_REINVEST_CONCURRENCY)
+        
+        async def reinvest_one(user_id: int, tier: int, budget: float) -> int:
+            async with semaphore:
+                if loop.time() >= deadline:
+                    return 0
+                try:
+                    async with get_session() as session:
+                        return await AutoCollectService.reinvest(session, user_id, tier, budget)
+                except ValueError as e:
+                    logger.debug(f"Auto-reinvest skipped for user {user_id}: {e}")
+                    return 0
+        
+        for start in range(0, len(reinvest_queue), AUTO_REINVEST_CHUNK_SIZE):
+            if loop.time() >= deadline:
+                logger.warning(f"⚠️ Auto-reinvest time budget spent, {len(reinvest_queue) - start} users skipped")
+                break
+            chunk = reinvest_queue[start:start + AUTO_REINVEST_CHUNK_SIZE]
+            bought = await asyncio.gather(*(reinvest_one(*item) for item in chunk))
+            stats['reinvested_users'] += sum(1 for count in bought if count)
+            stats['bears_bought'] += sum(bought)
+        
+        return stats
+
+
+async def auto_collect_worker():
+    """Background loop: run auto-collect and auto-reinvest for due users."""
+    while True:
+        try:
+            stats = await AutoCollectService.run_once()
+            if stats['collected_users']:
+                logger.info(
+                    f"⚡ Auto-collect: {stats['collected_users']} users, {stats['collected_coins']:,.0f} coins, "
+                    f"reinvest: {stats['bears_bought']} bears for {stats['reinvested_users']} users"
+                )
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"❌ Error in auto-collect worker: {e}", exc_info=True)
+        await asyncio.sleep(AUTO_COLLECT_CHECK_INTERVAL)
@@ -1,7 +1,9 @@
 """Service for managing bears."""
-from sqlalchemy import select
+from sqlalchemy import select, insert, update, func
 from sqlalchemy.ext.asyncio import AsyncSession
-from app.database.models import Bear, User
+from app.database.models import Bear, User, CoinTransaction
+from app.services.leaderboard import leaderboards
+from app.services.upgrades import UpgradesService
 from datetime import datetime, timedelta
 import random
 
@@ -170,6 +172,80 @@ class BearsService:
                 return idx
         return -1
     
+    @staticmethod
+    async def count_level_1_bears(session: AsyncSession, user_id: int, bear_types: list[str]) -> dict[str, int]:
+        """
+        Count level-1 bears (not on sale) per type with one COUNT(*) query.
+        Served from the ix_bears_owner_type_level covering index.
+        """
+        query = (
+            select(Bear.bear_type, func.count())
+            .where(
+                Bear.owner_id == user_id,
+                Bear.bear_type.in_(bear_types),
+                Bear.level == 1,
+                Bear.is_on_sale == False
+            )
+            .group_by(Bear.bear_type)
+        )
+        result = await session.execute(query)
+        counts = {bear_type: 0 for bear_type in bear_types}
+        counts.update({bear_type: count for bear_type, count in result.all()})
+        return counts
+    
+    @staticmethod
+    def _check_level_1_limit(bear_type: str, current: int, adding: int = 1):
+        """
+        Raise ValueError if adding bears would exceed the level-1 limit for this type.
+        """
+        if current + adding <= MAX_BEARS_PER_RARITY_LEVEL_1:
+            return
+        
+        bear_class = BEAR_CLASSES[bear_type]
+        free_slots = max(MAX_BEARS_PER_RARITY_LEVEL_1 - current, 0)
+        message = (
+            f"⚠️ Лимит {bear_class['rarity']} медведей 1-го уровня: {MAX_BEARS_PER_RARITY_LEVEL_1}\n"
+            f"У вас уже: {current}\n"
+        )
+        if adding > 1:
+            message += f"Можно добавить ещё: {free_slots}, запрошено: {adding}\n"
+        message += (
+            f"\n👉 Улучшите {bear_class['rarity']} медведей чтобы покупать новых!\n"
+            f"✨ Или покупайте медведей другой редкости!"
+        )
+        raise ValueError(message)
+    
+    @staticmethod
+    def _build_bear_row(user_id: int, bear_type: str, variant: int = None, name: str = None) -> dict:
+        """
+        Build column values for a new level-1 bear.
+        Variant: 1-15, random if not specified.
+        """
+        if bear_type not in BEAR_CLASSES:
+            raise ValueError(f"Invalid bear type: {bear_type}")
+        
+        # Если вариант не указан, выбираем случайный
+        if variant is None:
+            variant = random.randint(1, 15)
+        else:
+            if not 1 <= variant <= 15:
+                raise ValueError(f"Invalid variant: {variant}")
+        
+        bear_names = BEAR_NAMES[bear_type]
+        bear_name = bear_names[variant - 1]
+        
+        stats = BearsService.get_bear_stats(bear_type, variant)
+        income_per_hour = BearsService.get_bear_income_for_level(stats['income'], 1)
+        
+        return {
+            'owner_id': user_id,
+            'bear_type': bear_type,
+            'variant': variant,
+            'name': name or f"{bear_name} #{random.randint(1000, 9999)}",
+            'coins_per_hour': income_per_hour,
+            'coins_per_day': income_per_hour * 24,
+        }
+    
     @staticmethod
     async def create_bear(
         session: AsyncSession,
@@ -183,53 +259,134 @@ class BearsService:
         Variant: 1-15 для каждого класса.
         
         LIMIT: Максимум 15 медведей 1-го уровня КАЖДОЙ редкости.
+        Only flushes - the caller owns the transaction and commits it.
         """
         if bear_type not in BEAR_CLASSES:
             raise ValueError(f"Invalid bear type: {bear_type}")
         
         # Проверяем лимит медведей 1-го уровня ЭТОЙ редкости
-        level_1_query = select(Bear).where(
-            Bear.owner_id == user_id,
-            Bear.bear_type == bear_type,  # ПРОВЕРЯЕМ ТОЛЬКО ЭТОТ ТИП
-            Bear.level == 1,
-            Bear.is_on_sale == False
-        )
-        level_1_result = await session.execute(level_1_query)
-        level_1_bears = level_1_result.scalars().all()
-        
-        if len(level_1_bears) >= MAX_BEARS_PER_RARITY_LEVEL_1:
-            bear_class = BEAR_CLASSES[bear_type]
-            raise ValueError(
-                f"⚠️ Лимит {bear_class['rarity']} медведей 1-го уровня: {MAX_BEARS_PER_RARITY_LEVEL_1}\n"
-                f"У вас уже: {len(level_1_bears)}\n\n"
-                f"👉 Улучшите {bear_class['rarity']} медведей чтобы покупать новых!\n"
-                f"✨ Или покупайте медведей другой редкости!"
-            )
+        counts = await BearsService.count_level_1_bears(session, user_id, [bear_type])
+        BearsService._check_level_1_limit(bear_type, counts[bear_type])
         
-        # Если вариант не указан, выбираем случайный
-        if variant is None:
-            variant = random.randint(1, 15)
-        else:
-            if not 1 <= variant <= 15:
-                raise ValueError(f"Invalid variant: {variant}")
+        bear = Bear(**BearsService._build_bear_row(user_id, bear_type, variant, name))
+        session.add(bear)
+        await session.flush()
+        return bear
+    
+    @staticmethod
+    async def create_bears(
+        session: AsyncSession,
+        user_id: int,
+        specs: list[tuple[str, int | None]]
+    ) -> list[Bear]:
+        """
+        Create many bears for user in one INSERT statement.
+        specs: list of (bear_type, variant) pairs, variant may be None (random).
         
-        bear_names = BEAR_NAMES[bear_type]
-        bear_name = bear_names[variant - 1]
+        Level-1 limits are validated once per bear type before anything is inserted.
+        Only flushes - the caller owns the transaction and commits it.
+        """
+        if not specs:
+            return []
         
-        stats = BearsService.get_bear_stats(bear_type, variant)
-        income_per_hour = BearsService.get_bear_income_for_level(stats['income'], 1)
+        rows = [BearsService._build_bear_row(user_id, bear_type, variant) for bear_type, variant in specs]
+        
+        adding = {}
+        for row in rows:
+            adding[row['bear_type']] = adding.get(row['bear_type'], 0) + 1
+        
+        counts = await BearsService.count_level_1_bears(session, user_id, list(adding))
+        for bear_type, count in adding.items():
+            BearsService._check_level_1_limit(bear_type, counts[bear_type], count)
         
-        bear = Bear(
-            owner_id=user_id,
-            bear_type=bear_type,
-            variant=variant,
-            name=name or f"{bear_name} #{random.randint(1000, 9999)}",
-            coins_per_hour=income_per_hour,
-            coins_per_day=income_per_hour * 24,
+        return await BearsService._insert_bear_rows(session, rows)
+    
+    @staticmethod
+    async def _insert_bear_rows(session: AsyncSession, rows: list[dict]) -> list[Bear]:
+        """
+        Insert prepared bear rows with a single INSERT ... RETURNING.
+        """
+        result = await session.scalars(insert(Bear).returning(Bear, sort_by_parameter_order=True), rows)
+        leaderboards.mark_dirty(*{row['owner_id'] for row in rows})
+        return list(result.all())
+    
+    @staticmethod
+    async def get_shop_price(
+        session: AsyncSession,
+        user_id: int,
+        bear_type: str,
+        variant: int,
+        quantity: int = 1
+    ) -> int:
+        """Shop price of `quantity` bears with the user's shop discount applied."""
+        modifiers = await UpgradesService.get_modifiers(session, user_id)
+        base_cost = BearsService.get_bear_stats(bear_type, variant)['cost'] * quantity
+        return int(base_cost * modifiers.shop_price_multiplier)
+    
+    @staticmethod
+    async def buy_bears(
+        session: AsyncSession,
+        user_id: int,
+        bear_type: str,
+        variant: int,
+        quantity: int = 1
+    ) -> list[Bear]:
+        """
+        Buy `quantity` bears of one variant in a single order.
+        
+        The order is priced once, the level-1 limit is checked once, coins are
+        debited with a guarded UPDATE (no read-modify-write) and all bears are
+        inserted with one statement. Only flushes - the caller commits.
+        """
+        if quantity < 1:
+            raise ValueError("Количество должно быть больше 0")
+        
+        rows = [BearsService._build_bear_row(user_id, bear_type, variant) for _ in range(quantity)]
+        total_cost = await BearsService.get_shop_price(session, user_id, bear_type, variant, quantity)
+        
+        # Лимит проверяем до списания, чтобы ничего не записать при отказе
+        counts = await BearsService.count_level_1_bears(session, user_id, [bear_type])
+        BearsService._check_level_1_limit(bear_type, counts[bear_type], quantity)
+        
+        # Атомарное списание: строка обновится только если коинов хватает
+        debit = await session.execute(
+            update(User)
+            .where(User.id == user_id, User.coins >= total_cost)
+            .values(coins=User.coins - total_cost)
+            .returning(User.coins)
         )
-        session.add(bear)
-        await session.commit()
-        return bear
+        if debit.scalar_one_or_none() is None:
+            raise ValueError(f"Недостаточно коинов! Нужно {total_cost}")
+        
+        bears = await BearsService._insert_bear_rows(session, rows)
+        
+        session.add(CoinTransaction(
+            user_id=user_id,
+            amount=-total_cost,
+            transaction_type='spend',
+            description=f'Покупка {quantity}x {bear_type} #{variant}'
+        ))
+        await session.flush()
+        return bears
+    
+    @staticmethod
+    async def get_portfolio_summary(session: AsyncSession, user_id: int) -> dict:
+        """
+        Aggregate user's active portfolio (bears not on sale) in one query.
+        """
+        query = select(
+            func.count(Bear.id),
+            func.coalesce(func.sum(Bear.coins_per_hour), 0),
+            func.coalesce(func.sum(Bear.coins_per_day), 0),
+        ).where(Bear.owner_id == user_id, Bear.is_on_sale == False)
+        result = await session.execute(query)
+        total_bears, coins_per_hour, coins_per_day = result.one()
+        
+        return {
+            'total_bears': total_bears,
+            'coins_per_hour': float(coins_per_hour),
+            'coins_per_day': float(coins_per_day),
+        }
     
     @staticmethod
     async def upgrade_bear(session: AsyncSession, bear_id: int, user_id: int) -> Bear:
@@ -238,14 +395,19 @@ class BearsService:
         Cost grows exponentially AND depends on bear class.
         Income grows with diminishing returns.
         Max level: 50
+        A bear on sale can't be upgraded: its listing keeps the level it was listed at.
         """
-        query = select(Bear).where(Bear.id == bear_id, Bear.owner_id == user_id)
+        # Блокировка строки: параллельное выставление на продажу ждёт улучшения
+        query = select(Bear).where(Bear.id == bear_id, Bear.owner_id == user_id).with_for_update()
         result = await session.execute(query)
         bear = result.scalar_one_or_none()
         
         if not bear:
             raise ValueError("Медведь не найден")
         
+        if bear.is_on_sale:
+            raise ValueError("Медведь выставлен на продажу - снимите лот, чтобы улучшить")
+        
         if bear.level >= MAX_BEAR_LEVEL:
             raise ValueError(f"Медведь уже на максимальном уровне ({MAX_BEAR_LEVEL})")
         
@@ -294,13 +456,8 @@ class BearsService:
         """
         Calculate current income for a bear (with boosts).
         """
-        income = bear.coins_per_hour
-        
-        # Apply boost if active
-        if bear.boost_until and bear.boost_until > datetime.utcnow():
-            income *= bear.boost_multiplier
-        
-        return income
+        # Истёкшие бусты сбрасывает движок истечения (boost_multiplier = 1.0)
+        return bear.coins_per_hour * bear.boost_multiplier
     
     @staticmethod
     async def format_bear_info(bear: Bear, user: User) -> str:
@@ -311,8 +468,8 @@ class BearsService:
         stats = BearsService.get_bear_stats(bear.bear_type, bear.variant)
         boost_info = ""
         
-        if bear.boost_until and bear.boost_until > datetime.utcnow():
-            time_left = bear.boost_until - datetime.utcnow()
+        if bear.boost_until:
+            time_left = max(bear.boost_until - datetime.utcnow(), timedelta(0))
             hours = time_left.total_seconds() // 3600
             minutes = (time_left.total_seconds() % 3600) // 60
             boost_info = f"\n🔥 Буст активен: {int(hours)}ч {int(minutes)}м (x{bear.boost_multiplier})"
@@ -370,6 +527,9 @@ class BearsService:
         if not bear:
             raise ValueError("Медведь не найден")
         
+        if bear.is_on_sale:
+            raise ValueError("Медведь выставлен на продажу - снимите лот, чтобы продать")
+        
         stats = BearsService.get_bear_stats(bear.bear_type, bear.variant)
         refund = stats['sell']
         
@@ -2,8 +2,12 @@
 import random
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
-from app.database.models import User, UserCase, CaseReward, Bear, CoinTransaction
+from app.database.models import User, UserCase, CaseReward, Bear, CaseHistory
 from app.services.bears import BearsService
+from app.services.leaderboard import leaderboards
+from app.services.upgrades import UpgradesService
+from app.services.ledger import ledger
+from config import settings
 from datetime import datetime
 
 # Case types and their costs
@@ -187,6 +191,7 @@ class CasesService:
             raise ValueError("Пользователь не найден")
         
         case_info = CASE_TYPES[case_type]
+        ledger_entries = []  # Пишутся одним INSERT в этой же транзакции
         
         # ✅ CRITICAL FIX: Check if user has enough coins/TON
         if case_info['cost_coins'] > 0:
@@ -195,13 +200,12 @@ class CasesService:
             user.coins -= case_info['cost_coins']
             
             # Log transaction
-            transaction = CoinTransaction(
-                user_id=user.id,
-                amount=-case_info['cost_coins'],
-                transaction_type='case_open',
-                description=f'Открытие {case_info["name"]} (-{case_info["cost_coins"]:,.0f} коинов)'
-            )
-            session.add(transaction)
+            ledger_entries.append((
+                user.id,
+                -case_info['cost_coins'],
+                'case_open',
+                f'Открытие {case_info["name"]} (-{case_info["cost_coins"]:,.0f} коинов)'
+            ))
         
         # ✅ CRITICAL FIX: Check TON balance if case costs TON
         if case_info['cost_ton'] > 0:
@@ -219,18 +223,32 @@ class CasesService:
             user.ton_balance -= case_info['cost_ton']
             
             # Log transaction
-            transaction = CoinTransaction(
-                user_id=user.id,
-                amount=-case_info['cost_ton'],
-                transaction_type='case_open_ton',
-                description=f'Открытие {case_info["name"]} (-{case_info["cost_ton"]:.2f} TON)'
-            )
-            session.add(transaction)
+            ledger_entries.append((
+                user.id,
+                -case_info['cost_ton'],
+                'case_open_ton',
+                f'Открытие {case_info["name"]} (-{case_info["cost_ton"]:.2f} TON)'
+            ))
         
         # Roll reward
         reward_type, reward_value, rarity = CasesService._roll_reward(case_type)
         
+        # Улучшение "Бонус к кейсам" увеличивает денежные награды
+        if reward_type in ('coins', 'ton'):
+            modifiers = await UpgradesService.get_modifiers(session, user.id)
+            if reward_type == 'coins':
+                reward_value = round(reward_value * modifiers.case_reward_multiplier)
+            else:
+                reward_value = round(reward_value * modifiers.case_reward_multiplier, 4)
+        
+        # Стоимость и награда в коиновом эквиваленте - для истории и рейтинга удачи
+        case_cost = case_info['cost_coins'] + case_info['cost_ton'] / settings.COIN_TO_TON_RATE
+        returned = 0
+        history_value = 0
+        bear_id = None
+        
         result = {
+            'user_id': user.id,
             'case_type': case_type,
             'reward_type': reward_type,
             'reward_value': reward_value,
@@ -242,29 +260,30 @@ class CasesService:
         if reward_type == 'coins':
             user.coins += reward_value
             result['reward_message'] = f"💰 Коины: +{reward_value:,.0f}"
+            returned = history_value = reward_value
             
             # Log transaction
-            transaction = CoinTransaction(
-                user_id=user.id,
-                amount=reward_value,
-                transaction_type='case_reward',
-                description=f'Награда из {case_info["name"]} (+{reward_value:,.0f} коинов)'
-            )
-            session.add(transaction)
+            ledger_entries.append((
+                user.id,
+                reward_value,
+                'case_reward',
+                f'Награда из {case_info["name"]} (+{reward_value:,.0f} коинов)'
+            ))
             
         elif reward_type == 'ton':
             # ✅ Add TON to user balance
             user.ton_balance += reward_value
             result['reward_message'] = f"💵 ТОН: +{reward_value:.4f}"
+            history_value = reward_value
+            returned = reward_value / settings.COIN_TO_TON_RATE
             
             # Log transaction
-            transaction = CoinTransaction(
-                user_id=user.id,
-                amount=reward_value,
-                transaction_type='case_reward_ton',
-                description=f'Награда из {case_info["name"]} (+{reward_value:.4f} TON)'
-            )
-            session.add(transaction)
+            ledger_entries.append((
+                user.id,
+                reward_value,
+                'case_reward_ton',
+                f'Награда из {case_info["name"]} (+{reward_value:.4f} TON)'
+            ))
             
         elif reward_type == 'bear':
             # Parse bear info (e.g., 'rare:5' or 'legendary:10')
@@ -274,11 +293,25 @@ class CasesService:
             result['bear_created'] = bear
             bear_class = BearsService.get_bear_class_info(bear_type)
             result['reward_message'] = f"{bear_class['emoji']} Медведь: {bear.name} (Вариант {variant}/15)"
+            returned = history_value = BearsService.get_bear_stats(bear_type, variant)['cost']
+            bear_id = bear.id
             
         elif reward_type == 'empty':
             result['reward_message'] = "😭 Пусто..."
         
+        session.add(CaseHistory(
+            user_id=user.id,
+            case_type=case_type,
+            reward_type=reward_type,
+            reward_value=history_value,
+            case_cost=case_cost,
+            bear_id=bear_id,
+        ))
+        await ledger.write(session, ledger_entries)
+        
         await session.commit()
+        
+        leaderboards.add_ratio('case_luck', user.id, returned, case_cost)
         return result
     
     @staticmethod
@@ -2,8 +2,9 @@
 import logging
 from datetime import datetime, timedelta
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, update
-from app.database.models import User, Bear, CoinTransaction
+from sqlalchemy import select, update, func
+from app.database.models import User, Bear, CoinTransaction, Subscription
+from app.services.upgrades import UpgradesService
 from config import settings
 
 logger = logging.getLogger(__name__)
@@ -29,26 +30,15 @@ class EconomyService:
     @staticmethod
     async def calculate_coins_earned(session: AsyncSession, user_id: int) -> float:
         """Calculate total coins earned since last claim."""
-        # Get all user's bears
-        query = select(Bear).where(Bear.owner_id == user_id)
+        # Истёкшие бусты сбрасывает движок истечения - множитель всегда актуален
+        query = select(func.coalesce(func.sum(Bear.coins_per_hour * Bear.boost_multiplier), 0)).where(
+            Bear.owner_id == user_id
+        )
         result = await session.execute(query)
-        bears = result.scalars().all()
-        
-        total_coins = 0.0
-        now = datetime.utcnow()
-        
-        for bear in bears:
-            # Calculate coins based on time passed and boost
-            coins_per_hour = bear.coins_per_hour * bear.boost_multiplier
-            
-            # If boost expired, reset multiplier
-            if bear.boost_until and bear.boost_until < now:
-                bear.boost_multiplier = 1.0
-                bear.boost_until = None
-            
-            total_coins += coins_per_hour  # Simplified: coins per hour
-        
-        return total_coins
+        total_coins = float(result.scalar_one())  # Simplified: coins per hour
+        
+        modifiers = await UpgradesService.get_modifiers(session, user_id)
+        return total_coins * modifiers.income_multiplier
     
     @staticmethod
     async def buy_bear(
@@ -108,7 +98,7 @@ class EconomyService:
         result = await session.execute(query)
         bear = result.scalar_one_or_none()
         
-        if not bear:
+        if not bear or bear.is_on_sale:
             return False
         
         if upgrade_type == 'level':
@@ -171,28 +161,29 @@ class EconomyService:
         coin_amount: float
     ) -> float:
         """Calculate TON amount after commission."""
-        # Get user to check for subscription discounts
-        query = select(User).where(User.id == user_id)
+        # User and the best active subscription discount (premium only) in one query
+        query = (
+            select(User.id, func.max(Subscription.commission_reduction))
+            .outerjoin(
+                Subscription,
+                (Subscription.user_id == User.id) & (Subscription.status == 'active') & (User.is_premium == True)
+            )
+            .where(User.id == user_id)
+            .group_by(User.id)
+        )
         result = await session.execute(query)
-        user = result.scalar_one_or_none()
+        row = result.one_or_none()
         
-        if not user:
+        if not row:
             return 0
         
         # Base commission
         commission = coin_amount * settings.WITHDRAW_COMMISSION
         
         # Apply subscription discount if user has premium
-        if user.is_premium:
-            from app.database.models import Subscription
-            query = select(Subscription).where(
-                (Subscription.user_id == user_id) &
-                (Subscription.status == 'active')
-            )
-            result = await session.execute(query)
-            sub = result.scalar_one_or_none()
-            if sub:
-                commission *= (1 - sub.commission_reduction)
+        commission_reduction = row[1]
+        if commission_reduction:
+            commission *= (1 - commission_reduction)
         
         # Calculate TON amount
         ton_amount = (coin_amount - commission) * settings.COIN_TO_TON_RATE
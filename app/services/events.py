@@ -0,0 +1,229 @@
+"""Analytics event pipeline: event schema, bounded in-process queue, batched sinks."""
+import asyncio
+import gzip
+import json
+import logging
+import time
+from datetime import datetime
+from pathlib import Path
+from sqlalchemy import insert
+from app.database.db import get_session
+from app.database.models import AnalyticsEvent
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+EVENTS_QUEUE_MAX = 50000  # Событий в очереди; дальше - ожидание места (backpressure)
+EVENTS_PUT_TIMEOUT = 0.05  # Секунд ждать места в полной очереди, затем событие отбрасывается
+EVENTS_FLUSH_INTERVAL = 2.0  # Секунд между сбросами
+EVENTS_BATCH_SIZE = 2000  # Событий в одной записи в хранилище
+
+NUMBER = (int, float)
+
+# Имя события -> {свойство: тип}. Все свойства обязательны, лишние не принимаются.
+EVENT_SCHEMA: dict[str, dict[str, type | tuple]] = {
+    'user_registered': {'referred': bool},
+    'bear_purchased': {'bear_type': str, 'variant': int, 'quantity': int},
+    'case_opened': {'case_type': str, 'reward_type': str, 'rarity': str},
+    'daily_reward_claimed': {'day': int, 'reward': NUMBER},
+    # amount - сколько заплатил пользователь, в currency: 'XTR' (Telegram Stars) или 'TON'
+    'payment_completed': {'method': str, 'product': str, 'package_id': str, 'amount': NUMBER, 'currency': str},
+}
+
+
+def validate_event(name: str, properties: dict) -> dict:
+    """Check an event against EVENT_SCHEMA; raises ValueError."""
+    schema = EVENT_SCHEMA.get(name)
+    if schema is None:
+        raise ValueError(f"Unknown analytics event '{name}'")
+    if properties.keys() != schema.keys():
+        raise ValueError(f"Event '{name}' expects properties {sorted(schema)}, got {sorted(properties)}")
+    for key, expected in schema.items():
+        value = properties[key]
+        # bool - подкласс int, но как число его не принимаем
+        if not isinstance(value, expected) or (isinstance(value, bool) and expected is not bool):
+            expected_name = ' or '.join(t.__name__ for t in expected) if isinstance(expected, tuple) else expected.__name__
+            raise ValueError(f"Event '{name}': '{key}' must be {expected_name}, got {type(value).__name__}")
+    return properties
+
+
+# ============ ХРАНИЛИЩА ============
+
+class DatabaseEventSink:
+    """Appends events to analytics_events with one multi-row INSERT per batch."""
+    
+    async def write(self, records: list[tuple]):
+        async with get_session() as session:
+            await session.execute(insert(AnalyticsEvent), [
+                {'name': name, 'user_id': user_id, 'properties': properties, 'created_at': created_at}
+                for name, user_id, properties, created_at in records
+            ])
+
+
+class JsonlEventSink:
+    """
+    Appends events to hourly files events-YYYYMMDD-HH.jsonl.gz in `directory`.
+    Every batch is one gzip member appended to the current file, so files stay
+    readable with gzip.open while they are written.
+    """
+    
+    def __init__(self, directory: Path):
+        self.directory = Path(directory)
+    
+    def _write(self, records: list[tuple]):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        by_file: dict[Path, list[str]] = {}
+        for name, user_id, properties, created_at in records:
+            path = self.directory / f"events-{created_at:%Y%m%d-%H}.jsonl.gz"
+            by_file.setdefault(path, []).append(json.dumps(
+                {'name': name, 'user_id': user_id, 'properties': properties, 'created_at': created_at.isoformat()},
+                ensure_ascii=False,
+            ))
+        for path, lines in by_file.items():
+            with gzip.open(path, 'at', encoding='utf-8') as f:
+                f.write('\n'.join(lines) + '\n')
+    
+    async def write(self, records: list[tuple]):
+        await asyncio.to_thread(self._write, records)
+
+
+EVENT_SINKS = {
+    'db': DatabaseEventSink,
+    'jsonl': lambda: JsonlEventSink(settings.ANALYTICS_EVENTS_DIR),
+}
+
+
+# ============ ОЧЕРЕДЬ ============
+
+class EventPipeline:
+    """
+    Handlers emit events into a bounded asyncio.Queue: validation plus
+    put_nowait, no I/O. A background task drains the queue and writes
+    batches of up to EVENTS_BATCH_SIZE to the sink.
+    
+    Backpressure: when the queue is full, emit() wakes the flusher and waits
+    up to EVENTS_PUT_TIMEOUT for space, then drops the event (counted in
+    metrics). A batch the sink failed to write is kept and retried first, so
+    a sink outage fills the queue instead of growing memory without bound.
+    """
+    
+    def __init__(self, sink, maxsize: int = EVENTS_QUEUE_MAX):
+        self.sink = sink
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self._retry: list[tuple] = []
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._flush_lock = asyncio.Lock()
+        self.emitted_total = 0
+        self.written_total = 0
+        self.dropped_total = 0
+        self.invalid_total = 0
+        self.flush_count = 0
+        self.last_flush_ms = 0.0
+    
+    async def emit(self, name: str, user_id: int | None, properties: dict = None):
+        """Validate and enqueue one event; raises ValueError if it does not fit the schema."""
+        try:
+            record = (name, user_id, validate_event(name, properties or {}), datetime.utcnow())
+        except ValueError:
+            self.invalid_total += 1
+            raise
+        
+        try:
+            self._queue.put_nowait(record)
+        except asyncio.QueueFull:
+            self._wakeup.set()
+            try:
+                await asyncio.wait_for(self._queue.put(record), timeout=EVENTS_PUT_TIMEOUT)
+            except asyncio.TimeoutError:
+                self.dropped_total += 1
+                if self.dropped_total % 1000 == 1:
+                    logger.warning(f"⚠️ Analytics queue full, {self.dropped_total} events dropped so far")
+                return
+        self.emitted_total += 1
+        if self._queue.qsize() >= EVENTS_BATCH_SIZE:
+            self._wakeup.set()
+    
+    async def flush(self) -> int:
+        """Write everything queued so far in batches; returns the number of events written."""
+        written = 0
+        async with self._flush_lock:
+            while True:
+                batch = self._retry
+                self._retry = []
+                while len(batch) < EVENTS_BATCH_SIZE and not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+                if not batch:
+                    return written
+                
+                started = time.perf_counter()
+                try:
+                    await self.sink.write(batch)
+                except Exception:
+                    self._retry = batch
+                    raise
+                self.last_flush_ms = (time.perf_counter() - started) * 1000
+                self.flush_count += 1
+                self.written_total += len(batch)
+                written += len(batch)
+    
+    # ============ ФОНОВЫЙ СБРОС ============
+    
+    def start(self):
+        """Start the background flusher."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        """Stop the flusher and write what is left."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error(f"❌ Final analytics flush failed, {self.pending} events lost: {e}")
+    
+    async def _run(self):
+        while True:
+            try:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=EVENTS_FLUSH_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ Analytics flush failed ({self.pending} pending): {e}", exc_info=True)
+                await asyncio.sleep(EVENTS_FLUSH_INTERVAL)
+    
+    # ============ МЕТРИКИ ============
+    
+    @property
+    def pending(self) -> int:
+        return self._queue.qsize() + len(self._retry)
+    
+    def metrics(self) -> dict:
+        """Queue depth, drop counters and last flush latency."""
+        return {
+            'queue_depth': self.pending,
+            'emitted_total': self.emitted_total,
+            'written_total': self.written_total,
+            'dropped_total': self.dropped_total,
+            'invalid_total': self.invalid_total,
+            'flush_count': self.flush_count,
+            'last_flush_ms': round(self.last_flush_ms, 2),
+        }
+
+
+def _configured_sink():
+    if settings.ANALYTICS_EVENTS_SINK not in EVENT_SINKS:
+        logger.error(f"❌ Unknown ANALYTICS_EVENTS_SINK '{settings.ANALYTICS_EVENTS_SINK}', using 'db'")
+        return DatabaseEventSink()
+    return EVENT_SINKS[settings.ANALYTICS_EVENTS_SINK]()
+
+
+event_pipeline = EventPipeline(_configured_sink())
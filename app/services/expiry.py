@@ -0,0 +1,252 @@
+"""Expiry engine: boosts, premium, insurance, stale P2P listings and payment intents expire in set-based batches."""
+import asyncio
+import heapq
+import logging
+from datetime import datetime, timedelta
+from sqlalchemy import select, update, func, event, inspect
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from app.database.db import get_session
+from app.database.models import User, Bear, BearInsurance, P2PListing, PaymentIntent
+from app.services.leaderboard import leaderboards
+from app.services.notifications import notification_queue
+from app.services.payment_intents import PAYMENT_OPEN_STATUSES
+
+logger = logging.getLogger(__name__)
+
+P2P_LISTING_TTL = timedelta(days=14)  # Лот без покупателя снимается с продажи
+EXPIRY_RELOAD_INTERVAL = timedelta(minutes=5)  # Сверка с БД (записи из других процессов)
+EXPIRY_KINDS = ('boost', 'premium', 'insurance', 'listing', 'payment')
+
+
+class ExpiryEngine:
+    """
+    One scheduler for everything that expires.
+    
+    A min-heap holds the next due time of each kind, read from indexed
+    columns (MIN(...) over a partial index). The worker sleeps until the
+    earliest due time, expires every due row of that kind with one UPDATE
+    ... RETURNING and passes the returned rows to subscribers as events.
+    Writers that create something expiring sooner (detected in ORM flushes)
+    push it into the heap and wake the worker. Read paths can trust the
+    flags: is_premium, boost_multiplier, is_active and status are kept
+    current instead of being compared with the clock on every render.
+    """
+    
+    def __init__(self):
+        self._heap: list[tuple[datetime, str]] = []
+        self._next: dict[str, datetime] = {}
+        self._wakeup = asyncio.Event()
+        self._handlers: dict[str, list] = {kind: [] for kind in EXPIRY_KINDS}
+    
+    # ============ РАСПИСАНИЕ ============
+    
+    def schedule(self, kind: str, due_at: datetime):
+        """Make sure the worker wakes up for `kind` no later than due_at."""
+        current = self._next.get(kind)
+        if current is not None and current <= due_at:
+            return
+        self._next[kind] = due_at
+        heapq.heappush(self._heap, (due_at, kind))
+        self._wakeup.set()
+    
+    def subscribe(self, kind: str, handler):
+        """Call handler(rows) after rows of this kind have expired."""
+        self._handlers[kind].append(handler)
+    
+    @staticmethod
+    async def next_due(session: AsyncSession, kind: str) -> datetime | None:
+        """Earliest due time of a kind, from its indexed column."""
+        if kind == 'boost':
+            query = select(func.min(Bear.boost_until)).where(Bear.boost_until.is_not(None))
+        elif kind == 'premium':
+            query = select(func.min(User.premium_until)).where(User.is_premium == True, User.premium_until.is_not(None))
+        elif kind == 'insurance':
+            query = select(func.min(BearInsurance.expires_at)).where(
+                BearInsurance.is_active == True, BearInsurance.expires_at.is_not(None)
+            )
+        elif kind == 'payment':
+            query = select(func.min(PaymentIntent.expires_at)).where(PaymentIntent.status.in_(PAYMENT_OPEN_STATUSES))
+        else:
+            query = select(func.min(P2PListing.created_at)).where(P2PListing.status == 'active')
+        due_at = (await session.execute(query)).scalar_one_or_none()
+        if due_at is not None and kind == 'listing':
+            due_at += P2P_LISTING_TTL
+        return due_at
+    
+    # ============ ИСТЕЧЕНИЕ ============
+    
+    @staticmethod
+    async def expire(session: AsyncSession, kind: str, now: datetime) -> list:
+        """Expire every due row of a kind with one statement. Returns the expired rows. Only executes."""
+        if kind == 'boost':
+            stmt = (
+                update(Bear)
+                .where(Bear.boost_until <= now)
+                .values(boost_multiplier=1.0, boost_until=None)
+                .returning(Bear.id, Bear.owner_id)
+            )
+        elif kind == 'premium':
+            stmt = (
+                update(User)
+                .where(User.is_premium == True, User.premium_until <= now)
+                .values(is_premium=False)
+                .returning(User.id, User.telegram_id)
+            )
+        elif kind == 'insurance':
+            stmt = (
+                update(BearInsurance)
+                .where(BearInsurance.is_active == True, BearInsurance.expires_at <= now)
+                .values(is_active=False)
+                .returning(BearInsurance.id, BearInsurance.user_id, BearInsurance.bear_id)
+            )
+        elif kind == 'payment':
+            expired = (
+                update(PaymentIntent)
+                .where(PaymentIntent.status.in_(PAYMENT_OPEN_STATUSES), PaymentIntent.expires_at <= now)
+                .values(status='expired', updated_at=now)
+                .returning(PaymentIntent.id, PaymentIntent.user_id, PaymentIntent.ton_amount)
+                .cte('expired')
+            )
+            stmt = (
+                select(expired.c.id, User.telegram_id, expired.c.ton_amount)
+                .join(User, User.id == expired.c.user_id)
+            )
+        else:
+            # Снимаем лоты и возвращаем медведей владельцам одним запросом
+            expired = (
+                update(P2PListing)
+                .where(P2PListing.status == 'active', P2PListing.created_at <= now - P2P_LISTING_TTL)
+                .values(status='cancelled')
+                .returning(P2PListing.id, P2PListing.bear_id, P2PListing.seller_id)
+                .cte('expired')
+            )
+            stmt = (
+                update(Bear)
+                .where(Bear.id == expired.c.bear_id)
+                .values(is_on_sale=False)
+                .returning(expired.c.id, expired.c.seller_id, Bear.id, Bear.name)
+            )
+        result = await session.execute(stmt.execution_options(synchronize_session=False))
+        return result.all()
+    
+    async def run_due(self, now: datetime = None) -> dict[str, int]:
+        """Expire all kinds whose due time has come; returns expired counts per kind."""
+        now = now or datetime.utcnow()
+        kinds = set()
+        while self._heap and self._heap[0][0] <= now:
+            kinds.add(heapq.heappop(self._heap)[1])
+        
+        counts = {}
+        for kind in EXPIRY_KINDS:
+            if kind not in kinds:
+                continue
+            async with get_session() as session:
+                rows = await self.expire(session, kind, now)
+                await session.commit()
+                self._next.pop(kind, None)
+                next_due = await self.next_due(session, kind)
+            if next_due is not None:
+                self.schedule(kind, next_due)
+            counts[kind] = len(rows)
+            if rows:
+                self._emit(kind, rows)
+        return counts
+    
+    def _emit(self, kind: str, rows: list):
+        for handler in self._handlers[kind]:
+            try:
+                handler(rows)
+            except Exception as e:
+                logger.error(f"❌ Expiry handler for {kind} failed: {e}", exc_info=True)
+    
+    async def reload(self):
+        """Re-read the next due time of every kind from the DB."""
+        self._heap = []
+        self._next = {}
+        async with get_session() as session:
+            for kind in EXPIRY_KINDS:
+                due_at = await self.next_due(session, kind)
+                if due_at is not None:
+                    self.schedule(kind, due_at)
+    
+    async def run(self):
+        """Background loop: sleep until the next due time (or a wake-up), expire, repeat."""
+        reload_at = datetime.utcnow()
+        while True:
+            try:
+                now = datetime.utcnow()
+                if now >= reload_at:
+                    await self.reload()
+                    reload_at = now + EXPIRY_RELOAD_INTERVAL
+                
+                counts = await self.run_due(now)
+                if any(counts.values()):
+                    logger.info(f"⏳ Expired: {', '.join(f'{kind}={n}' for kind, n in counts.items() if n)}")
+                
+                wake_at = min(self._heap[0][0], reload_at) if self._heap else reload_at
+                self._wakeup.clear()
+                timeout = max((wake_at - datetime.utcnow()).total_seconds(), 0)
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ Error in expiry engine: {e}", exc_info=True)
+                await asyncio.sleep(10)
+
+
+expiry_engine = ExpiryEngine()
+
+
+# ============ СОБЫТИЯ ============
+
+def _on_boosts_expired(rows):
+    # Бусты не влияют на рейтинги (coins_per_hour без множителя) - только лог
+    logger.debug(f"Boosts expired on {len(rows)} bears")
+
+
+def _on_premium_expired(rows):
+    for _, telegram_id in rows:
+        notification_queue.enqueue(
+            telegram_id,
+            "⭐ Ваша Premium подписка закончилась.\n\nПродлите её в разделе «Premium», чтобы вернуть бонусы!"
+        )
+
+
+def _on_listings_expired(rows):
+    leaderboards.mark_dirty(*{seller_id for _, seller_id, _, _ in rows})
+
+
+def _on_payments_expired(rows):
+    for _, telegram_id, ton_amount in rows:
+        notification_queue.enqueue(
+            telegram_id,
+            f"⌛ Заявка на пополнение {float(ton_amount)} TON истекла.\n\n"
+            f"Если вы уже отправили перевод - обратитесь в поддержку, платёж зачтут вручную."
+        )
+
+
+expiry_engine.subscribe('boost', _on_boosts_expired)
+expiry_engine.subscribe('premium', _on_premium_expired)
+expiry_engine.subscribe('listing', _on_listings_expired)
+expiry_engine.subscribe('payment', _on_payments_expired)
+
+
+@event.listens_for(Session, 'after_flush')
+def _schedule_on_flush(session, flush_context):
+    """Wake the engine early for anything written with a due time (loaded values only)."""
+    for obj in (*session.new, *session.dirty):
+        values = inspect(obj).dict
+        if isinstance(obj, Bear) and values.get('boost_until'):
+            expiry_engine.schedule('boost', values['boost_until'])
+        elif isinstance(obj, User) and values.get('is_premium') and values.get('premium_until'):
+            expiry_engine.schedule('premium', values['premium_until'])
+        elif isinstance(obj, BearInsurance) and values.get('is_active') is not False and values.get('expires_at'):
+            expiry_engine.schedule('insurance', values['expires_at'])
+        elif isinstance(obj, P2PListing) and values.get('status') == 'active' and values.get('created_at'):
+            expiry_engine.schedule('listing', values['created_at'] + P2P_LISTING_TTL)
+        elif isinstance(obj, PaymentIntent) and values.get('status') in PAYMENT_OPEN_STATUSES and values.get('expires_at'):
+            expiry_engine.schedule('payment', values['expires_at'])
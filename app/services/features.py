@@ -1,13 +1,15 @@
 """Service for new game features."""
 import logging
 from datetime import datetime, timedelta
-from sqlalchemy import select, desc, func
+from sqlalchemy import select, desc, func, delete, insert, update, or_
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.database.models import (
     User, Bear, UserAchievement, UserDailyLogin, CaseHistory, 
     BearInsurance, P2PListing, CaseGuarantee, CaseTheme, BearFusion
 )
 from app.services.bears import BearsService
+from app.services.p2p_market import p2p_price_index
+from app.services.leaderboard import leaderboards
 
 logger = logging.getLogger(__name__)
 
@@ -57,6 +59,70 @@ DAILY_REWARDS = {
     20: {'coins': 0, 'bear': 'rare', 'emoji': '🐻'},
     30: {'coins': 0, 'bear': 'epic', 'emoji': '🐻‍❄️'},  # 30-й день = эпический
 }
+DAILY_STREAK_CYCLE = 30  # После 30-го дня серия начинается заново
+
+# Награды бота за день серии (handlers/daily_rewards.py): с 50, +50 каждый день
+DAILY_STREAK_REWARDS = {
+    1: 50,
+    2: 100,
+    3: 150,
+    4: 200,
+    5: 250,
+    6: 300,
+    7: 350,   # Week bonus
+    8: 400,
+    9: 450,
+    10: 500,
+    11: 550,
+    12: 600,
+    13: 650,
+    14: 700,  # 2 weeks bonus
+    15: 750,
+    16: 800,
+    17: 850,
+    18: 900,
+    19: 950,
+    20: 1000,
+    21: 1050,  # 3 weeks bonus
+    22: 1100,
+    23: 1150,
+    24: 1200,
+    25: 1250,
+    26: 1300,
+    27: 1350,
+    28: 1400,
+    29: 1450,
+    30: 1500,  # Month bonus!
+}
+
+# ПЕРЕПЛАВКА: 10 медведей одного типа = 1 медведь следующего
+FUSION_INPUT_COUNT = 10
+FUSION_OUTPUTS = {
+    'common': 'rare',
+    'rare': 'epic',
+    'epic': 'legendary',
+}
+
+
+def daily_streak_state(last_login_date: datetime | None, streak_days: int, now: datetime) -> dict:
+    """
+    Streak and eligibility for today, derived without touching the DB.
+    
+    last_login_date is the time of the last claimed reward (only claims write it),
+    so viewing the rewards screen never needs a write transaction.
+    Returns {'streak_days', 'can_claim', 'claimed_today'}; while the reward is
+    claimable, streak_days is the streak the user will have after claiming.
+    """
+    if last_login_date is None:
+        return {'streak_days': 1, 'can_claim': True, 'claimed_today': False}
+    
+    days_since = (now.date() - last_login_date.date()).days
+    if days_since <= 0:
+        return {'streak_days': max(streak_days or 0, 1), 'can_claim': False, 'claimed_today': True}
+    if days_since == 1:
+        next_streak = streak_days + 1 if (streak_days or 0) < DAILY_STREAK_CYCLE else 1
+        return {'streak_days': max(next_streak, 1), 'can_claim': True, 'claimed_today': False}
+    return {'streak_days': 1, 'can_claim': True, 'claimed_today': False}
 
 
 class FeaturesService:
@@ -142,43 +208,74 @@ class FeaturesService:
     # ============ ЕЖЕДНЕВНЫЕ ЛОГИНЫ ============
     
     @staticmethod
-    async def get_or_create_daily_login(session: AsyncSession, user_id: int) -> UserDailyLogin:
-        """Получить или создать запись ежедневных логинов."""
-        login = await session.execute(
-            select(UserDailyLogin).where(UserDailyLogin.user_id == user_id)
+    async def get_daily_login(session: AsyncSession, user_id: int) -> UserDailyLogin | None:
+        """Получить запись ежедневных логинов (без создания)."""
+        result = await session.execute(
+            select(UserDailyLogin).where(UserDailyLogin.user_id == user_id).order_by(UserDailyLogin.id).limit(1)
         )
-        user_login = login.scalar()
-        
-        if not user_login:
-            user_login = UserDailyLogin(user_id=user_id)
-            session.add(user_login)
-            await session.commit()
-        
-        return user_login
+        return result.scalar_one_or_none()
+    
+    @staticmethod
+    async def claim_daily_streak(session: AsyncSession, user_id: int, now: datetime = None) -> int | None:
+        """
+        Зафиксировать получение сегодняшней награды.
+        
+        Единственная запись - условный UPDATE ... WHERE last_reward_claimed_at < начало дня,
+        поэтому повторное нажатие не даст награду дважды. Возвращает новую серию
+        или None, если награда сегодня уже получена. Не коммитит.
+        """
+        now = now or datetime.utcnow()
+        today_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        
+        user_login = await FeaturesService.get_daily_login(session, user_id)
+        if user_login is None:
+            # Первая награда: блокируем пользователя, чтобы не создать две записи
+            await session.execute(select(User.id).where(User.id == user_id).with_for_update())
+            user_login = await FeaturesService.get_daily_login(session, user_id)
+            if user_login is None:
+                user_login = UserDailyLogin(user_id=user_id, streak_days=0, total_logins=0, reward_claimed_today=False)
+                session.add(user_login)
+                await session.flush()
+        
+        state = daily_streak_state(user_login.last_login_date, user_login.streak_days, now)
+        if not state['can_claim']:
+            return None
+        
+        result = await session.execute(
+            update(UserDailyLogin)
+            .where(
+                UserDailyLogin.id == user_login.id,
+                or_(
+                    UserDailyLogin.last_reward_claimed_at.is_(None),
+                    UserDailyLogin.last_reward_claimed_at < today_start,
+                ),
+            )
+            .values(
+                streak_days=state['streak_days'],
+                last_login_date=now,
+                last_reward_claimed_at=now,
+                reward_claimed_today=True,
+                total_logins=UserDailyLogin.total_logins + 1,
+            )
+            .returning(UserDailyLogin.streak_days)
+            .execution_options(synchronize_session=False)
+        )
+        return result.scalar_one_or_none()
     
     @staticmethod
     async def claim_daily_reward(session: AsyncSession, user_id: int) -> dict:
         """Получить ежедневную награду."""
-        user_login = await FeaturesService.get_or_create_daily_login(session, user_id)
-        user = await session.get(User, user_id)
-        
-        today = datetime.utcnow().date()
-        last_login = user_login.last_login_date.date() if user_login.last_login_date else None
-        
-        if user_login.reward_claimed_today and last_login == today:
+        streak_days = await FeaturesService.claim_daily_streak(session, user_id)
+        if streak_days is None:
             raise ValueError("Награда уже получена сегодня!")
         
-        # Проверяются полосы (streak)
-        if last_login and (datetime.utcnow().date() - last_login).days > 1:
-            user_login.streak_days = 1  # Полоса резетилась
-        else:
-            user_login.streak_days += 1
+        user = await session.get(User, user_id)
         
         # Получают награду
-        reward = DAILY_REWARDS.get(user_login.streak_days, {'coins': 10000, 'emoji': '💰'})
+        reward = DAILY_REWARDS.get(streak_days, {'coins': 10000, 'emoji': '💰'})
         
         result = {
-            'streak_day': user_login.streak_days,
+            'streak_day': streak_days,
             'reward_type': 'bear' if 'bear' in reward else 'coins',
             'reward_value': reward.get('coins', 0),
             'bear_type': reward.get('bear'),
@@ -192,11 +289,6 @@ class FeaturesService:
             bear = await BearsService.create_bear(session, user_id, reward['bear'])
             result['bear_created'] = bear
         
-        user_login.reward_claimed_today = True
-        user_login.last_login_date = datetime.utcnow()
-        user_login.total_logins += 1
-        user_login.last_reward_claimed_at = datetime.utcnow()
-        
         await session.commit()
         return result
     
@@ -280,19 +372,35 @@ class FeaturesService:
     
     @staticmethod
     async def list_bear_for_sale(session: AsyncSession, bear_id: int, user_id: int, price_coins: float) -> P2PListing:
-        """Выставить медведя на продажу (медведь становится невидим в профиле)."""
-        bear = await session.get(Bear, bear_id)
-        if not bear or bear.owner_id != user_id:
-            raise ValueError("Медведь не найден")
+        """
+        Выставить медведя на продажу (медведь становится невидим в профиле).
         
+        Медведь отмечается условным UPDATE ... WHERE is_on_sale = false, поэтому
+        два параллельных запроса не создадут двух лотов на одного медведя.
+        """
         # Отмечаем медведя как выставленного на продажу
-        bear.is_on_sale = True
+        marked = await session.execute(
+            update(Bear)
+            .where(Bear.id == bear_id, Bear.owner_id == user_id, Bear.is_on_sale == False)
+            .values(is_on_sale=True)
+            .returning(Bear.bear_type, Bear.variant, Bear.level)
+            .execution_options(synchronize_session=False)
+        )
+        bear = marked.one_or_none()
+        if bear is None:
+            owned = await session.get(Bear, bear_id)
+            if not owned or owned.owner_id != user_id:
+                raise ValueError("Медведь не найден")
+            raise ValueError("Медведь уже выставлен на продажу")
         
         listing = P2PListing(
             bear_id=bear_id,
             seller_id=user_id,
             price_coins=price_coins,
             status='active',
+            bear_type=bear.bear_type,
+            bear_variant=bear.variant,
+            bear_level=bear.level,
         )
         session.add(listing)
         await session.commit()
@@ -300,131 +408,219 @@ class FeaturesService:
     
     @staticmethod
     async def cancel_listing(session: AsyncSession, listing_id: int, user_id: int) -> dict:
-        """Снять медведя с продажи (медведь снова появляется в профиле)."""
-        listing = await session.get(P2PListing, listing_id)
-        if not listing or listing.seller_id != user_id:
-            raise ValueError("Лот не найден")
-        
-        if listing.status != 'active':
-            raise ValueError("Лот больше не активен")
-        
-        # Отмечаем как отменено
-        listing.status = 'cancelled'
-        
-        # Медведь становится видим снова
-        bear = await session.get(Bear, listing.bear_id)
-        bear.is_on_sale = False
+        """
+        Снять медведя с продажи (медведь снова появляется в профиле).
+        
+        Лот отменяется условным UPDATE ... WHERE status = 'active', поэтому
+        отмена не может перезаписать параллельную покупку.
+        """
+        # SAVEPOINT: если медведь уже не у продавца, лот остаётся активным
+        async with session.begin_nested():
+            cancelled = await session.execute(
+                update(P2PListing)
+                .where(
+                    P2PListing.id == listing_id,
+                    P2PListing.seller_id == user_id,
+                    P2PListing.status == 'active',
+                )
+                .values(status='cancelled')
+                .returning(P2PListing.bear_id)
+                .execution_options(synchronize_session=False)
+            )
+            bear_id = cancelled.scalar_one_or_none()
+            if bear_id is None:
+                raise ValueError("Лот не найден или больше не активен")
+        
+            # Медведь становится видим снова
+            released = await session.execute(
+                update(Bear)
+                .where(Bear.id == bear_id, Bear.owner_id == user_id)
+                .values(is_on_sale=False)
+                .returning(Bear.id)
+                .execution_options(synchronize_session=False)
+            )
+            if released.scalar_one_or_none() is None:
+                raise ValueError("Медведь не найден")
         
         await session.commit()
         return {'success': True, 'message': 'Медведь снят с продажи!'}
     
     @staticmethod
     async def buy_bear_from_player(session: AsyncSession, listing_id: int, buyer_id: int) -> dict:
-        """Купить медведя у другого игрока."""
-        listing = await session.get(P2PListing, listing_id)
-        if not listing or listing.status != 'active':
-            raise ValueError("Лот не найден или уже куплен")
-        
-        buyer = await session.get(User, buyer_id)
-        if buyer.coins < listing.price_coins:
-            raise ValueError("Недостаточно коинов")
-        
-        seller = await session.get(User, listing.seller_id)
-        bear = await session.get(Bear, listing.bear_id)
-        
-        # Перевод средств
-        buyer.coins -= listing.price_coins
-        seller.coins += listing.price_coins
-        
-        # Перевод медведя и отметка, что он больше не на продаже
-        bear.owner_id = buyer_id
-        bear.is_on_sale = False
-        
-        # Обновление лота
-        listing.status = 'sold'
-        listing.buyer_id = buyer_id
-        listing.sold_at = datetime.utcnow()
+        """
+        Купить медведя у другого игрока.
+        
+        Лот захватывается условным UPDATE ... WHERE status = 'active' RETURNING,
+        поэтому из параллельных покупателей лот получает ровно один. Перевод
+        коинов - атомарные UPDATE без чтения строк (в порядке id, без дедлоков).
+        Загруженные в сессию объекты лота/пользователей не синхронизируются.
+        """
+        now = datetime.utcnow()
+        
+        # SAVEPOINT: при отказе откатываем захват лота, а не всю сессию
+        async with session.begin_nested():
+            claimed = await session.execute(
+                update(P2PListing)
+                .where(P2PListing.id == listing_id, P2PListing.status == 'active')
+                .values(status='sold', buyer_id=buyer_id, sold_at=now)
+                .returning(
+                    P2PListing.bear_id, P2PListing.seller_id, P2PListing.price_coins,
+                    P2PListing.bear_type, P2PListing.bear_variant, P2PListing.bear_level,
+                )
+                .execution_options(synchronize_session=False)
+            )
+            listing = claimed.one_or_none()
+            if listing is None:
+                raise ValueError("Лот не найден или уже куплен")
+            
+            bear_id, seller_id, price, bear_type, variant, level = listing
+            if seller_id == buyer_id:
+                raise ValueError("Нельзя купить свой собственный лот")
+            
+            # Перевод средств: списание с проверкой баланса и зачисление продавцу
+            for user_id in sorted((buyer_id, seller_id)):
+                if user_id == buyer_id:
+                    debit = await session.execute(
+                        update(User)
+                        .where(User.id == buyer_id, User.coins >= price)
+                        .values(coins=User.coins - price)
+                        .returning(User.id)
+                        .execution_options(synchronize_session=False)
+                    )
+                    if debit.scalar_one_or_none() is None:
+                        raise ValueError("Недостаточно коинов")
+                else:
+                    await session.execute(
+                        update(User)
+                        .where(User.id == seller_id)
+                        .values(coins=User.coins + price)
+                        .execution_options(synchronize_session=False)
+                    )
+            
+            # Перевод медведя и отметка, что он больше не на продаже
+            transferred = await session.execute(
+                update(Bear)
+                .where(Bear.id == bear_id, Bear.owner_id == seller_id, Bear.is_on_sale == True)
+                .values(owner_id=buyer_id, is_on_sale=False)
+                .returning(Bear.id)
+                .execution_options(synchronize_session=False)
+            )
+            if transferred.scalar_one_or_none() is None:
+                raise ValueError("Медведь больше не продаётся")
         
         await session.commit()
-        return {'success': True, 'message': 'Медведь куплен!'}
+        
+        # Инкрементальное обновление индекса рыночных цен и рейтингов
+        p2p_price_index.record_sale(bear_type, variant, level, price, now)
+        leaderboards.mark_dirty(buyer_id, seller_id)
+        return {'success': True, 'message': 'Медведь куплен!', 'bear_id': bear_id, 'price_coins': price}
+    
+    # ============ ПЕРЕПЛАВКА МЕДВЕДЕЙ ============
     
     @staticmethod
-    async def get_available_listings(session: AsyncSession, limit: int = 50, offset: int = 0) -> list[dict]:
-        """Получить все доступные лоты на P2P маркетплейсе."""
-        listings = await session.execute(
-            select(P2PListing)
-            .where(P2PListing.status == 'active')
-            .order_by(desc(P2PListing.created_at))
-            .limit(limit)
-            .offset(offset)
+    async def get_fusion_candidates(session: AsyncSession, user_id: int, input_type: str, limit: int = None) -> list[int]:
+        """Получить ID медведей для переплавки - самые дешёвые первыми (один упорядоченный запрос)."""
+        query = (
+            select(Bear.id)
+            .where(
+                Bear.owner_id == user_id,
+                Bear.bear_type == input_type,
+                Bear.is_on_sale == False,
+                Bear.is_locked == False,
+            )
+            .order_by(Bear.level, Bear.variant, Bear.id)
         )
-        
-        result = []
-        for listing in listings.scalars():
-            bear = await session.get(Bear, listing.bear_id)
-            seller = await session.get(User, listing.seller_id)
-            result.append({
-                'listing_id': listing.id,
-                'bear_id': bear.id,
-                'bear_type': bear.bear_type,
-                'bear_level': bear.level,
-                'bear_name': bear.name,
-                'price_coins': listing.price_coins,
-                'seller_name': seller.username or seller.first_name,
-                'created_at': listing.created_at,
-            })
-        
-        return result
+        if limit is not None:
+            query = query.limit(limit)
+        result = await session.execute(query)
+        return list(result.scalars().all())
     
-    # ============ ПЕРЕПЛАВКА МЕДВЕДЕЙ ============
+    @staticmethod
+    async def _fuse_sets(session: AsyncSession, user_id: int, input_type: str, id_sets: list[list[int]]) -> list[Bear]:
+        """Переплавить наборы медведей: один DELETE, одна вставка медведей и одна вставка BearFusion."""
+        output_type = FUSION_OUTPUTS[input_type]
+        all_ids = [bear_id for id_set in id_sets for bear_id in id_set]
+        
+        # SAVEPOINT: при ошибке откатываем только переплавку, а не всю сессию
+        async with session.begin_nested():
+            # Удаляем всех входных медведей одним запросом (и проверяем, что все на месте)
+            deleted = await session.execute(
+                delete(Bear)
+                .where(
+                    Bear.id.in_(all_ids),
+                    Bear.owner_id == user_id,
+                    Bear.bear_type == input_type,
+                    Bear.is_on_sale == False,
+                )
+                .returning(Bear.id)
+            )
+            if len(deleted.all()) != len(all_ids):
+                raise ValueError("Невсе медведи найдены или имеют правильные типы")
+            
+            # Создаём всех выходных медведей одним INSERT
+            new_bears = await BearsService.create_bears(session, user_id, [(output_type, None)] * len(id_sets))
+            
+            # Минт fusion событий одним INSERT
+            now = datetime.utcnow()
+            await session.execute(insert(BearFusion), [
+                {
+                    'user_id': user_id,
+                    'input_bears': str(id_set),
+                    'input_count': len(id_set),
+                    'input_type': input_type,
+                    'output_type': output_type,
+                    'output_bear_id': new_bear.id,
+                    'status': 'completed',
+                    'completed_at': now,
+                }
+                for id_set, new_bear in zip(id_sets, new_bears)
+            ])
+        return new_bears
     
     @staticmethod
     async def fuse_bears(session: AsyncSession, user_id: int, bear_ids: list[int], input_type: str) -> dict:
         """Переплавить медведей (10 джентс = 1 редкий)"""
-        # Определяем выходной тип
-        if input_type == 'common':
-            if len(bear_ids) != 10:
-                raise ValueError("Нужно 10 обычных медведей")
-            output_type = 'rare'
-        elif input_type == 'rare':
-            if len(bear_ids) != 10:
-                raise ValueError("Нужно 10 редких медведей")
-            output_type = 'epic'
-        elif input_type == 'epic':
-            if len(bear_ids) != 10:
-                raise ValueError("Нужно 10 эпических медведей")
-            output_type = 'legendary'
-        else:
+        if input_type not in FUSION_OUTPUTS:
             raise ValueError("Неверный тип")
         
-        # Проверяют эвентство медведей
-        bears = await session.execute(
-            select(Bear).where(Bear.id.in_(bear_ids), Bear.owner_id == user_id, Bear.bear_type == input_type)
-        )
-        found_bears = bears.scalars().all()
+        if len(set(bear_ids)) != FUSION_INPUT_COUNT:
+            class_info = BearsService.get_bear_class_info(input_type)
+            raise ValueError(f"Нужно {FUSION_INPUT_COUNT} медведей ({class_info['rarity']})")
         
-        if len(found_bears) != len(bear_ids):
-            raise ValueError("Невсе медведи найдены или имеют правильные типы")
+        new_bears = await FeaturesService._fuse_sets(session, user_id, input_type, [list(set(bear_ids))])
+        await session.commit()
         
-        # Удаляем старых медведей
-        for bear in found_bears:
-            await session.delete(bear)
+        output_type = FUSION_OUTPUTS[input_type]
+        return {'new_bear': new_bears[0], 'message': f'🐻 {input_type} x{len(bear_ids)} = {output_type}!'}
+    
+    @staticmethod
+    async def fuse_all_bears(session: AsyncSession, user_id: int, input_type: str, max_sets: int = None) -> dict:
+        """
+        Переплавить все возможные наборы медведей типа input_type.
+        Сервер сам выбирает самых дешёвых медведей; все наборы - в одной транзакции.
+        """
+        if input_type not in FUSION_OUTPUTS:
+            raise ValueError("Неверный тип")
         
-        # Создают нового
-        new_bear = await BearsService.create_bear(session, user_id, output_type)
+        limit = max_sets * FUSION_INPUT_COUNT if max_sets else None
+        candidate_ids = await FeaturesService.get_fusion_candidates(session, user_id, input_type, limit)
+        sets_count = len(candidate_ids) // FUSION_INPUT_COUNT
         
-        # Минт fusion события
-        fusion = BearFusion(
-            user_id=user_id,
-            input_bears=str(bear_ids),
-            input_count=len(bear_ids),
-            input_type=input_type,
-            output_type=output_type,
-            output_bear_id=new_bear.id,
-            status='completed',
-            completed_at=datetime.utcnow(),
-        )
-        session.add(fusion)
+        if sets_count == 0:
+            raise ValueError(
+                f"Недостаточно медведей!\nНужно: {FUSION_INPUT_COUNT}\nЕсть: {len(candidate_ids)}"
+            )
+        
+        id_sets = [
+            candidate_ids[i * FUSION_INPUT_COUNT:(i + 1) * FUSION_INPUT_COUNT]
+            for i in range(sets_count)
+        ]
+        new_bears = await FeaturesService._fuse_sets(session, user_id, input_type, id_sets)
         await session.commit()
         
-        return {'new_bear': new_bear, 'message': f'🐻 {input_type} x{len(bear_ids)} = {output_type}!'}
+        output_type = FUSION_OUTPUTS[input_type]
+        return {
+            'new_bears': new_bears,
+            'sets': sets_count,
+            'message': f'🐻 {input_type} x{sets_count * FUSION_INPUT_COUNT} = {output_type} x{sets_count}!',
+        }
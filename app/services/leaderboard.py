@@ -0,0 +1,304 @@
+"""Leaderboards: named boards with day/week/all-time windows, served from memory."""
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from sqlalchemy import select, func, case, event, inspect
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from app.database.models import User, Bear, CaseHistory
+from app.utils.skiplist import IndexableSkipList
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+LEADERBOARD_WINDOWS = ('day', 'week', 'all')
+LEADERBOARD_TOP_DEFAULT = 10
+LEADERBOARD_REFRESH_INTERVAL = timedelta(minutes=30)  # Полная сверка с БД
+CASE_LUCK_MIN_SPENT = 2000  # Минимум потраченных коинов на кейсы для попадания в рейтинг удачи
+
+# kind: 'gauge' - текущее значение (только за всё время),
+#       'counter' - сумма событий за окно,
+#       'ratio' - отношение двух сумм за окно
+LEADERBOARDS = {
+    'richest': {'title': '💰 Богачи', 'kind': 'gauge', 'unit': 'коинов'},
+    'income': {'title': '📈 Доход', 'kind': 'gauge', 'unit': 'к/час'},
+    'referrers': {'title': '👥 Рефоводы', 'kind': 'counter', 'unit': 'рефералов'},
+    'case_luck': {'title': '🍀 Удача в кейсах', 'kind': 'ratio', 'unit': '% RTP'},
+}
+
+
+class RankedBoard:
+    """
+    Member -> score map with an indexable skiplist keyed by (-score, member).
+    
+    Higher scores rank first, ties are broken by member id. Updates, rank and
+    position lookups are O(log n).
+    """
+    
+    def __init__(self):
+        self._scores: dict = {}
+        self._board = IndexableSkipList()
+    
+    def __len__(self) -> int:
+        return len(self._board)
+    
+    def __contains__(self, member) -> bool:
+        return member in self._scores
+    
+    def score(self, member):
+        """Current score of a member, or None."""
+        return self._scores.get(member)
+    
+    def set(self, member, score):
+        """Insert or move a member."""
+        old_score = self._scores.get(member)
+        if old_score == score:
+            return
+        if old_score is not None:
+            self._board.remove((-old_score, member))
+        self._scores[member] = score
+        self._board.insert((-score, member))
+    
+    def add(self, member, amount):
+        """Increase a member's score."""
+        self.set(member, self._scores.get(member, 0) + amount)
+    
+    def remove(self, member):
+        """Remove a member if present."""
+        score = self._scores.pop(member, None)
+        if score is not None:
+            self._board.remove((-score, member))
+    
+    def rank(self, member) -> int | None:
+        """1-based place of a member, or None."""
+        score = self._scores.get(member)
+        if score is None:
+            return None
+        return self._board.rank((-score, member)) + 1
+    
+    def range(self, start: int, stop: int) -> list[tuple]:
+        """(place, member, score) for 0-based positions [start, stop)."""
+        return [
+            (start + offset + 1, member, -neg_score)
+            for offset, (neg_score, member) in enumerate(self._board.slice(start, stop))
+        ]
+    
+    def top(self, limit: int) -> list[tuple]:
+        """(place, member, score) of the best members."""
+        return self.range(0, limit)
+    
+    def around(self, member, radius: int) -> list[tuple]:
+        """(place, member, score) of a member and up to radius neighbours on each side."""
+        place = self.rank(member)
+        if place is None:
+            return []
+        return self.range(place - 1 - radius, place + radius)
+
+
+class _RatioBoard:
+    """Board ranked by numerator / denominator, for members above a minimum denominator."""
+    
+    def __init__(self, min_denominator: float):
+        self.min_denominator = min_denominator
+        self.totals: dict[int, list[float]] = {}
+        self.board = RankedBoard()
+    
+    def add(self, member, numerator: float, denominator: float):
+        totals = self.totals.setdefault(member, [0.0, 0.0])
+        totals[0] += numerator
+        totals[1] += denominator
+        if totals[1] >= self.min_denominator:
+            self.board.set(member, round(totals[0] / totals[1] * 100, 2))
+
+
+def _window_start(window: str, now: datetime) -> datetime | None:
+    """Start of the current day/week window (UTC), None for all-time."""
+    if window == 'all':
+        return None
+    day_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    if window == 'day':
+        return day_start
+    return day_start - timedelta(days=day_start.weekday())
+
+
+class LeaderboardService:
+    """
+    In-process named leaderboards.
+    
+    Counters and ratios are updated by the code that produces the event
+    (a referral, a case opening); day/week windows roll over by swapping in an
+    empty board when the window start changes. Gauges (balance, income) are
+    refreshed lazily: writers only mark users dirty - automatically for ORM
+    flushes of User/Bear rows, explicitly for set-based UPDATE/INSERT paths -
+    and the next read reloads just those users with one query. Everything is
+    rebuilt from the DB every LEADERBOARD_REFRESH_INTERVAL.
+    """
+    
+    def __init__(self):
+        self._boards: dict[tuple[str, str], tuple[datetime | None, object]] = {}
+        self._dirty: set[int] = set()
+        self._loaded_at = None
+        self._lock = asyncio.Lock()
+    
+    @staticmethod
+    def windows(name: str) -> tuple:
+        """Windows supported by a board."""
+        if LEADERBOARDS[name]['kind'] == 'gauge':
+            return ('all',)
+        return LEADERBOARD_WINDOWS
+    
+    @staticmethod
+    def _new_board(name: str):
+        if LEADERBOARDS[name]['kind'] == 'ratio':
+            return _RatioBoard(CASE_LUCK_MIN_SPENT)
+        return RankedBoard()
+    
+    def _board(self, name: str, window: str, now: datetime = None):
+        """Board for the current window, rolling it over if the window has changed."""
+        if name not in LEADERBOARDS or window not in self.windows(name):
+            raise ValueError("Неизвестный рейтинг")
+        start = _window_start(window, now or datetime.utcnow())
+        entry = self._boards.get((name, window))
+        if entry is None or entry[0] != start:
+            entry = (start, self._new_board(name))
+            self._boards[(name, window)] = entry
+        return entry[1]
+    
+    def _ranked(self, name: str, window: str) -> RankedBoard:
+        board = self._board(name, window)
+        return board.board if isinstance(board, _RatioBoard) else board
+    
+    # ============ ЗАПИСЬ ============
+    
+    def mark_dirty(self, *user_ids: int):
+        """Balance or portfolio of these users changed outside ORM flushes."""
+        self._dirty.update(user_ids)
+    
+    def increment(self, name: str, user_id: int, amount: float = 1):
+        """Add an event to a counter board in every window."""
+        for window in self.windows(name):
+            self._board(name, window).add(user_id, amount)
+    
+    def add_ratio(self, name: str, user_id: int, numerator: float, denominator: float):
+        """Add an event to a ratio board in every window."""
+        for window in self.windows(name):
+            self._board(name, window).add(user_id, numerator, denominator)
+    
+    # ============ ЗАГРУЗКА ============
+    
+    async def ensure_loaded(self, session: AsyncSession):
+        """Rebuild all boards if stale, otherwise reload only dirty users."""
+        now = datetime.utcnow()
+        if not self._loaded_at or now - self._loaded_at >= LEADERBOARD_REFRESH_INTERVAL:
+            async with self._lock:
+                if not self._loaded_at or now - self._loaded_at >= LEADERBOARD_REFRESH_INTERVAL:
+                    await self._rebuild(session, now)
+                    return
+        
+        if self._dirty:
+            user_ids, self._dirty = self._dirty, set()
+            await self._load_gauges(session, user_ids)
+    
+    async def _load_gauges(self, session: AsyncSession, user_ids: set[int] = None):
+        """Reload balance and income for given users (all users if None)."""
+        income = func.coalesce(func.sum(Bear.coins_per_hour), 0)
+        query = (
+            select(User.id, User.coins, income)
+            .outerjoin(Bear, (Bear.owner_id == User.id) & (Bear.is_on_sale == False))
+            .group_by(User.id)
+        )
+        if user_ids is not None:
+            query = query.where(User.id.in_(user_ids))
+        result = await session.execute(query)
+        
+        richest = self._board('richest', 'all')
+        income_board = self._board('income', 'all')
+        for user_id, coins, coins_per_hour in result.all():
+            richest.set(user_id, round(coins or 0, 2))
+            if coins_per_hour:
+                income_board.set(user_id, round(coins_per_hour, 2))
+            else:
+                income_board.remove(user_id)
+    
+    async def _rebuild(self, session: AsyncSession, now: datetime):
+        """Load every board from the DB: one query per board."""
+        self._boards = {}
+        self._dirty = set()
+        await self._load_gauges(session)
+        
+        day_start = _window_start('day', now)
+        week_start = _window_start('week', now)
+        
+        def windowed(column, value):
+            return (
+                func.sum(case((column >= day_start, value), else_=0)),
+                func.sum(case((column >= week_start, value), else_=0)),
+                func.sum(value),
+            )
+        
+        # Рефералы: приглашённые пользователи по времени регистрации
+        result = await session.execute(
+            select(User.referred_by, *windowed(User.created_at, 1))
+            .where(User.referred_by.is_not(None))
+            .group_by(User.referred_by)
+        )
+        for referrer_id, *counts in result.all():
+            for window, count in zip(LEADERBOARD_WINDOWS, counts):
+                if count:
+                    self._board('referrers', window, now).add(referrer_id, count)
+        
+        # Удача в кейсах: возврат / стоимость в коиновом эквиваленте
+        returned = case(
+            (CaseHistory.reward_type == 'ton', CaseHistory.reward_value / settings.COIN_TO_TON_RATE),
+            else_=CaseHistory.reward_value,
+        )
+        result = await session.execute(
+            select(
+                CaseHistory.user_id,
+                *windowed(CaseHistory.opened_at, returned),
+                *windowed(CaseHistory.opened_at, CaseHistory.case_cost),
+            ).group_by(CaseHistory.user_id)
+        )
+        for user_id, *sums in result.all():
+            for window, numerator, denominator in zip(LEADERBOARD_WINDOWS, sums[:3], sums[3:]):
+                if denominator:
+                    self._board('case_luck', window, now).add(user_id, float(numerator), float(denominator))
+        
+        self._loaded_at = now
+        logger.info(f"🏆 Leaderboards rebuilt: {len(self._board('richest', 'all'))} players")
+    
+    # ============ ЧТЕНИЕ ============
+    
+    def top(self, name: str, window: str = 'all', limit: int = LEADERBOARD_TOP_DEFAULT) -> list[tuple]:
+        """(place, user_id, score) of the best players."""
+        return self._ranked(name, window).top(limit)
+    
+    def rank(self, name: str, window: str, user_id: int) -> int | None:
+        """1-based place of a player, or None."""
+        return self._ranked(name, window).rank(user_id)
+    
+    def around(self, name: str, window: str, user_id: int, radius: int = 2) -> list[tuple]:
+        """(place, user_id, score) of a player and neighbours."""
+        return self._ranked(name, window).around(user_id, radius)
+    
+    def size(self, name: str, window: str = 'all') -> int:
+        """Number of ranked players."""
+        return len(self._ranked(name, window))
+
+
+leaderboards = LeaderboardService()
+
+
+@event.listens_for(Session, 'after_flush')
+def _mark_dirty_on_flush(session, flush_context):
+    """Mark users whose balance or bears changed in an ORM flush."""
+    # Только уже загруженные значения - без ленивой загрузки внутри flush
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, User):
+            user_id = inspect(obj).dict.get('id')
+        elif isinstance(obj, Bear):
+            user_id = inspect(obj).dict.get('owner_id')
+        else:
+            continue
+        if user_id is not None:
+            leaderboards.mark_dirty(user_id)
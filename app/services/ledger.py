@@ -0,0 +1,198 @@
+"""CoinTransaction ledger writer: plain tuples, multi-row INSERT / COPY, sync or buffered."""
+import asyncio
+import logging
+import time
+from collections import deque
+from datetime import datetime
+from sqlalchemy import insert, event
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from app.database.db import get_session
+from app.database.models import CoinTransaction
+
+logger = logging.getLogger(__name__)
+
+LEDGER_FLUSH_INTERVAL = 1.0  # Секунд между сбросами буфера
+LEDGER_BATCH_SIZE = 1000  # Сброс раньше интервала, если набралось столько записей
+LEDGER_COPY_THRESHOLD = 500  # С этого размера пачки - COPY вместо INSERT
+LEDGER_BUFFER_MAX = 200000  # Сверх этого записи отбрасываются (с предупреждением)
+
+# Порядок полей записи: (user_id, amount, transaction_type, description)
+LEDGER_COLUMNS = ('user_id', 'amount', 'transaction_type', 'description', 'created_at')
+
+
+class LedgerWriter:
+    """
+    Writes CoinTransaction rows without the ORM unit of work.
+    
+    Entries are plain (user_id, amount, transaction_type, description) tuples.
+    Two durability modes:
+    
+    - write(session, entries): same transaction. One multi-row INSERT in the
+      caller's transaction, so the ledger commits or rolls back together with
+      the balance change. Use it for purchases, exchanges and payouts.
+    - defer(session, entries): async buffered. Entries join an in-memory
+      buffer only when the caller's transaction commits (dropped on rollback)
+      and are flushed in the background with one INSERT (or COPY for large
+      batches) per flush. Entries still buffered when the process dies are
+      lost, so use it only for informational entries (rewards, referral
+      commissions, battle results).
+    """
+    
+    def __init__(self):
+        self._buffer: deque = deque()
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._flush_lock = asyncio.Lock()
+        self.flushed_total = 0
+        self.dropped_total = 0
+        self.flush_count = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self._flush_ms_total = 0.0
+    
+    @staticmethod
+    def _rows(entries, now: datetime) -> list[dict]:
+        return [
+            {
+                'user_id': user_id,
+                'amount': amount,
+                'transaction_type': transaction_type,
+                'description': description,
+                'created_at': now,
+            }
+            for user_id, amount, transaction_type, description in entries
+        ]
+    
+    # ============ В ТОЙ ЖЕ ТРАНЗАКЦИИ ============
+    
+    async def write(self, session: AsyncSession, entries: list[tuple]):
+        """Insert entries in the caller's transaction with one statement. Only executes."""
+        if entries:
+            await session.execute(insert(CoinTransaction), self._rows(entries, datetime.utcnow()))
+    
+    # ============ БУФЕРИЗОВАННО ============
+    
+    def defer(self, session: AsyncSession, entries: list[tuple]):
+        """Buffer entries once the session's transaction commits."""
+        if entries:
+            now = datetime.utcnow()
+            session.sync_session.info.setdefault('ledger_deferred', []).extend(
+                (*entry, now) for entry in entries
+            )
+    
+    def record(self, entries: list[tuple]):
+        """Buffer entries right away (no transaction to wait for)."""
+        now = datetime.utcnow()
+        self._push([(*entry, now) for entry in entries])
+    
+    def _push(self, records: list[tuple]):
+        free = LEDGER_BUFFER_MAX - len(self._buffer)
+        if len(records) > free:
+            self.dropped_total += len(records) - max(free, 0)
+            logger.warning(f"⚠️ Ledger buffer full, dropped {len(records) - max(free, 0)} entries")
+            records = records[:max(free, 0)]
+        self._buffer.extend(records)
+        if len(self._buffer) >= LEDGER_BATCH_SIZE:
+            self._wakeup.set()
+    
+    async def flush(self) -> int:
+        """Write everything buffered so far; returns the number of rows written."""
+        async with self._flush_lock:
+            if not self._buffer:
+                return 0
+            records = [self._buffer.popleft() for _ in range(len(self._buffer))]
+            started = time.perf_counter()
+            try:
+                async with get_session() as session:
+                    copied = len(records) >= LEDGER_COPY_THRESHOLD and await self._copy(session, records)
+                    if not copied:
+                        await session.execute(insert(CoinTransaction), [dict(zip(LEDGER_COLUMNS, r)) for r in records])
+            except Exception:
+                # Вернём записи в начало буфера - повторим при следующем сбросе
+                self._buffer.extendleft(reversed(records))
+                raise
+            
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            self.flushed_total += len(records)
+            self.flush_count += 1
+            self.last_flush_ms = elapsed_ms
+            self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+            self._flush_ms_total += elapsed_ms
+            return len(records)
+    
+    @staticmethod
+    async def _copy(session: AsyncSession, records: list[tuple]) -> bool:
+        """COPY records via asyncpg; False if the driver does not support it."""
+        connection = await session.connection()
+        raw = await connection.get_raw_connection()
+        driver = raw.driver_connection
+        if not hasattr(driver, 'copy_records_to_table'):
+            return False
+        await driver.copy_records_to_table(
+            CoinTransaction.__tablename__, records=records, columns=LEDGER_COLUMNS
+        )
+        return True
+    
+    # ============ ФОНОВЫЙ СБРОС ============
+    
+    def start(self):
+        """Start the background flusher."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        """Stop the flusher and write what is left."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error(f"❌ Final ledger flush failed, {len(self._buffer)} entries lost: {e}")
+    
+    async def _run(self):
+        while True:
+            try:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=LEDGER_FLUSH_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ Ledger flush failed ({len(self._buffer)} buffered): {e}", exc_info=True)
+                await asyncio.sleep(LEDGER_FLUSH_INTERVAL)
+    
+    # ============ МЕТРИКИ ============
+    
+    def metrics(self) -> dict:
+        """Buffer depth and flush latency."""
+        return {
+            'buffer_depth': len(self._buffer),
+            'flushed_total': self.flushed_total,
+            'dropped_total': self.dropped_total,
+            'flush_count': self.flush_count,
+            'last_flush_ms': round(self.last_flush_ms, 2),
+            'avg_flush_ms': round(self._flush_ms_total / self.flush_count, 2) if self.flush_count else 0.0,
+            'max_flush_ms': round(self.max_flush_ms, 2),
+        }
+
+
+ledger = LedgerWriter()
+
+
+@event.listens_for(Session, 'after_commit')
+def _buffer_deferred_entries(session):
+    """Deferred entries become durable candidates only after their transaction commits."""
+    records = session.info.pop('ledger_deferred', None)
+    if records:
+        ledger._push(records)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _drop_deferred_entries(session):
+    session.info.pop('ledger_deferred', None)
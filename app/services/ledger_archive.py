@@ -0,0 +1,312 @@
+"""Monthly partitions of coin_transactions and archival of closed months to JSONL.gz files."""
+import asyncio
+import gzip
+import json
+import logging
+import os
+import re
+from datetime import datetime
+from pathlib import Path
+from sqlalchemy import select, func, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database.db import get_session
+from app.database.models import CoinTransaction, CoinTransactionTotal
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+LEDGER_PARTITIONS_AHEAD = 2  # Месяцев вперёд, для которых партиции создаются заранее
+LEDGER_HOT_MONTHS = 6  # Месяцев в БД (включая текущий), более старые уходят в архив
+LEDGER_ARCHIVE_INTERVAL = 6 * 3600  # Секунд между проходами воркера
+LEDGER_ARCHIVE_CHUNK = 5000  # Строк на одну запись в файл / один upsert итогов
+LEDGER_ARCHIVE_LOCK = 420042  # Ключ advisory-блокировки: обслуживание партиций - один процесс за раз
+
+ARCHIVE_COLUMNS = ('user_id', 'created_at', 'id', 'amount', 'transaction_type', 'description')
+_PARTITION_RE = re.compile(r'^coin_transactions_y(\d{4})m(\d{2})$')
+
+
+def month_start(dt: datetime) -> datetime:
+    return datetime(dt.year, dt.month, 1)
+
+
+def add_months(month: datetime, months: int) -> datetime:
+    index = month.year * 12 + month.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month: datetime) -> str:
+    return f'coin_transactions_y{month:%Y}m{month:%m}'
+
+
+def archive_path(month: datetime) -> Path:
+    return settings.LEDGER_ARCHIVE_DIR / f'{partition_name(month)}.jsonl.gz'
+
+
+def _parse_month(name: str) -> datetime | None:
+    match = _PARTITION_RE.match(name)
+    return datetime(int(match.group(1)), int(match.group(2)), 1) if match else None
+
+
+def _read_user_rows(path: Path, user_id: int, transaction_types: set | None) -> list[dict]:
+    """Rows of one user from an archive file (oldest first). Lines are sorted by user_id, so the scan stops early."""
+    prefix_len = len('{"user_id": ')
+    rows = []
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            line_user = int(line[prefix_len:line.index(',', prefix_len)])
+            if line_user < user_id:
+                continue
+            if line_user > user_id:
+                break
+            record = json.loads(line)
+            if transaction_types is None or record['transaction_type'] in transaction_types:
+                rows.append(record)
+    return rows
+
+
+class LedgerArchiveService:
+    """
+    coin_transactions is RANGE-partitioned by month on created_at.
+    
+    Partitions are created ahead of time (rows that land in the default
+    partition are moved when their month's partition is created). Months
+    older than LEDGER_HOT_MONTHS are streamed into one JSONL.gz file each,
+    sorted by (user_id, created_at); the per-user sums of the month are
+    added to coin_transaction_totals, and the partition is detached and
+    dropped in the same transaction. Full history and all-time totals are
+    read through get_user_history / get_user_total, which merge the live
+    table with the archive.
+    """
+    
+    # ============ ПАРТИЦИИ ============
+    
+    @staticmethod
+    async def _try_lock(session: AsyncSession) -> bool:
+        result = await session.execute(text('SELECT pg_try_advisory_xact_lock(:key)'), {'key': LEDGER_ARCHIVE_LOCK})
+        return bool(result.scalar())
+    
+    @staticmethod
+    async def list_partitions(session: AsyncSession) -> dict[datetime, str]:
+        """Monthly partitions attached to coin_transactions: {month: table name}."""
+        result = await session.execute(text(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = 'coin_transactions'::regclass"
+        ))
+        partitions = {}
+        for (name,) in result.all():
+            month = _parse_month(name)
+            if month is not None:
+                partitions[month] = name
+        return partitions
+    
+    @staticmethod
+    async def _create_partition(session: AsyncSession, month: datetime) -> str:
+        """Create and attach one month's partition, moving its rows out of the default partition."""
+        name = partition_name(month)
+        bounds = {'start': month, 'end': add_months(month, 1)}
+        await session.execute(text(
+            f'CREATE TABLE {name} (LIKE coin_transactions INCLUDING DEFAULTS INCLUDING CONSTRAINTS)'
+        ))
+        await session.execute(text(
+            f'WITH moved AS ('
+            f'DELETE FROM coin_transactions_default WHERE created_at >= :start AND created_at < :end RETURNING *'
+            f') INSERT INTO {name} SELECT * FROM moved'
+        ), bounds)
+        await session.execute(text(
+            f"ALTER TABLE coin_transactions ATTACH PARTITION {name} "
+            f"FOR VALUES FROM ('{bounds['start']:%Y-%m-%d}') TO ('{bounds['end']:%Y-%m-%d}')"
+        ))
+        return name
+    
+    @staticmethod
+    async def ensure_partitions(session: AsyncSession, now: datetime = None) -> list[str]:
+        """
+        Create missing partitions from the current month to LEDGER_PARTITIONS_AHEAD
+        months ahead, plus partitions for months older than the hot window
+        that still sit in the default partition (so they can be archived).
+        Returns the created names. Only executes - the caller commits.
+        """
+        now = now or datetime.utcnow()
+        if not await LedgerArchiveService._try_lock(session):
+            return []
+        
+        existing = await LedgerArchiveService.list_partitions(session)
+        current = month_start(now)
+        months = {add_months(current, offset) for offset in range(LEDGER_PARTITIONS_AHEAD + 1)}
+        stray = await session.execute(text(
+            "SELECT DISTINCT date_trunc('month', created_at) FROM coin_transactions_default WHERE created_at < :cutoff"
+        ), {'cutoff': add_months(current, -(LEDGER_HOT_MONTHS - 1))})
+        months.update(month for (month,) in stray.all())
+        
+        created = []
+        for month in sorted(months - existing.keys()):
+            created.append(await LedgerArchiveService._create_partition(session, month))
+        return created
+    
+    # ============ АРХИВ ============
+    
+    @staticmethod
+    async def archive_month(month: datetime) -> Path | None:
+        """
+        Stream one month into its archive file, record its totals, then detach
+        and drop the partition. Returns the file path (None if another process
+        holds the maintenance lock or the partition does not exist).
+        """
+        name = partition_name(month)
+        path = archive_path(month)
+        tmp_path = path.with_name(path.name + '.tmp')
+        
+        async with get_session() as session:
+            if not await LedgerArchiveService._try_lock(session):
+                return None
+            if month not in await LedgerArchiveService.list_partitions(session):
+                return None
+            
+            # Закрытый месяц не должен меняться, пока мы его выгружаем
+            await session.execute(text(f'LOCK TABLE {name} IN SHARE MODE'))
+            expected = (await session.execute(text(f'SELECT count(*) FROM {name}'))).scalar()
+            
+            await asyncio.to_thread(path.parent.mkdir, parents=True, exist_ok=True)
+            totals: dict[tuple, list] = {}
+            written = 0
+            archive = await asyncio.to_thread(gzip.open, tmp_path, 'wt', encoding='utf-8')
+            try:
+                # Явный курсор: закрывается до DROP TABLE в этой же транзакции
+                await session.execute(text(
+                    f'DECLARE ledger_archive NO SCROLL CURSOR FOR '
+                    f'SELECT {", ".join(ARCHIVE_COLUMNS)} FROM {name} ORDER BY user_id, created_at, id'
+                ))
+                while True:
+                    chunk = (await session.execute(text(f'FETCH {LEDGER_ARCHIVE_CHUNK} FROM ledger_archive'))).all()
+                    if not chunk:
+                        break
+                    lines = []
+                    for user_id, created_at, row_id, amount, transaction_type, description in chunk:
+                        lines.append(json.dumps({
+                            'user_id': user_id,
+                            'created_at': created_at.isoformat(),
+                            'id': row_id,
+                            'amount': amount,
+                            'transaction_type': transaction_type,
+                            'description': description,
+                        }, ensure_ascii=False) + '\n')
+                        total = totals.setdefault((user_id, transaction_type), [0.0, 0])
+                        total[0] += amount
+                        total[1] += 1
+                    await asyncio.to_thread(archive.writelines, lines)
+                    written += len(lines)
+                await session.execute(text('CLOSE ledger_archive'))
+            finally:
+                await asyncio.to_thread(archive.close)
+            
+            if written != expected:
+                await asyncio.to_thread(tmp_path.unlink, missing_ok=True)
+                raise RuntimeError(f"{name}: archived {written} rows, expected {expected}")
+            await asyncio.to_thread(os.replace, tmp_path, path)
+            
+            items = [
+                {'user_id': user_id, 'transaction_type': transaction_type, 'amount': amount, 'count': count}
+                for (user_id, transaction_type), (amount, count) in totals.items()
+            ]
+            for start in range(0, len(items), LEDGER_ARCHIVE_CHUNK):
+                stmt = pg_insert(CoinTransactionTotal).values(items[start:start + LEDGER_ARCHIVE_CHUNK])
+                await session.execute(stmt.on_conflict_do_update(
+                    index_elements=['user_id', 'transaction_type'],
+                    set_={
+                        'amount': CoinTransactionTotal.amount + stmt.excluded.amount,
+                        'count': CoinTransactionTotal.count + stmt.excluded.count,
+                    },
+                ))
+            
+            await session.execute(text(f'ALTER TABLE coin_transactions DETACH PARTITION {name}'))
+            await session.execute(text(f'DROP TABLE {name}'))
+        
+        logger.info(f"📦 Archived {name}: {written} rows -> {path}")
+        return path
+    
+    @staticmethod
+    async def archive_closed(now: datetime = None) -> list[Path]:
+        """Archive every partition older than LEDGER_HOT_MONTHS."""
+        cutoff = add_months(month_start(now or datetime.utcnow()), -(LEDGER_HOT_MONTHS - 1))
+        async with get_session() as session:
+            months = sorted(m for m in await LedgerArchiveService.list_partitions(session) if m < cutoff)
+        
+        paths = []
+        for month in months:
+            path = await LedgerArchiveService.archive_month(month)
+            if path is not None:
+                paths.append(path)
+        return paths
+    
+    @staticmethod
+    def archived_months() -> list[datetime]:
+        """Months available in the archive directory, newest first."""
+        if not settings.LEDGER_ARCHIVE_DIR.is_dir():
+            return []
+        months = (
+            _parse_month(path.name[:-len('.jsonl.gz')])
+            for path in settings.LEDGER_ARCHIVE_DIR.glob('coin_transactions_y*.jsonl.gz')
+        )
+        return sorted((m for m in months if m is not None), reverse=True)
+    
+    # ============ ЧТЕНИЕ ============
+    
+    @staticmethod
+    async def get_user_history(
+        session: AsyncSession,
+        user_id: int,
+        transaction_types: list[str] = None,
+        limit: int = None
+    ) -> list[CoinTransaction]:
+        """
+        A user's transactions, newest first: live partitions, then archived
+        months until `limit` is reached. Archived rows come back as detached
+        CoinTransaction objects.
+        """
+        query = select(CoinTransaction).where(CoinTransaction.user_id == user_id)
+        if transaction_types:
+            query = query.where(CoinTransaction.transaction_type.in_(transaction_types))
+        query = query.order_by(CoinTransaction.created_at.desc(), CoinTransaction.id.desc()).limit(limit)
+        history = list((await session.execute(query)).scalars().all())
+        
+        types = set(transaction_types) if transaction_types else None
+        for month in LedgerArchiveService.archived_months():
+            if limit is not None and len(history) >= limit:
+                break
+            rows = await asyncio.to_thread(_read_user_rows, archive_path(month), user_id, types)
+            for row in reversed(rows):
+                row['created_at'] = datetime.fromisoformat(row['created_at'])
+                history.append(CoinTransaction(**row))
+        
+        return history[:limit] if limit is not None else history
+    
+    @staticmethod
+    async def get_user_total(session: AsyncSession, user_id: int, transaction_types: list[str]) -> float:
+        """All-time sum of a user's transactions of the given types (live + archived)."""
+        live = select(func.coalesce(func.sum(CoinTransaction.amount), 0.0)).where(
+            CoinTransaction.user_id == user_id,
+            CoinTransaction.transaction_type.in_(transaction_types)
+        ).scalar_subquery()
+        archived = select(func.coalesce(func.sum(CoinTransactionTotal.amount), 0.0)).where(
+            CoinTransactionTotal.user_id == user_id,
+            CoinTransactionTotal.transaction_type.in_(transaction_types)
+        ).scalar_subquery()
+        result = await session.execute(select(live + archived))
+        return float(result.scalar() or 0)
+
+
+async def ledger_archive_worker():
+    """Background loop: keep partitions ahead of time and archive cold months."""
+    while True:
+        try:
+            async with get_session() as session:
+                created = await LedgerArchiveService.ensure_partitions(session)
+            if created:
+                logger.info(f"🗂 Created ledger partitions: {', '.join(created)}")
+            await LedgerArchiveService.archive_closed()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"❌ Error in ledger archive worker: {e}", exc_info=True)
+        await asyncio.sleep(LEDGER_ARCHIVE_INTERVAL)
@@ -1,11 +1,16 @@
 """Push notifications system."""
+import asyncio
 import logging
 from datetime import datetime, timedelta
 from typing import Optional
 from aiogram import Bot
+from aiogram.exceptions import TelegramForbiddenError, TelegramRetryAfter
 
 logger = logging.getLogger(__name__)
 
+NOTIFY_RATE_PER_SECOND = 25  # Ниже глобального лимита Telegram (~30 сообщений/сек)
+NOTIFY_QUEUE_MAX = 50000
+
 
 class NotificationService:
     """Service for sending push notifications."""
@@ -85,3 +90,76 @@ class NotificationService:
             logger.info(f"✅ Sent event notification to user {user_telegram_id}: {event_title}")
         except Exception as e:
             logger.error(f"❌ Error sending event notification: {e}")
+
+
+class NotificationQueue:
+    """
+    Throttled background sender for bulk notifications.
+    
+    Producers enqueue messages without waiting; a single worker sends at most
+    NOTIFY_RATE_PER_SECOND messages per second and honours Telegram flood
+    waits, so a batch of thousands of messages cannot stall handlers or hit limits.
+    """
+    
+    def __init__(self, rate_per_second: float = NOTIFY_RATE_PER_SECOND, maxsize: int = NOTIFY_QUEUE_MAX):
+        self.rate_per_second = rate_per_second
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self._bot: Optional[Bot] = None
+        self._task: Optional[asyncio.Task] = None
+    
+    def enqueue(self, chat_id: int, text: str, parse_mode: Optional[str] = None) -> bool:
+        """Queue a message; returns False (and drops it) if the queue is full."""
+        try:
+            self._queue.put_nowait((chat_id, text, parse_mode))
+            return True
+        except asyncio.QueueFull:
+            logger.warning(f"⚠️ Notification queue full, dropped message to {chat_id}")
+            return False
+    
+    def pending(self) -> int:
+        """Number of queued messages."""
+        return self._queue.qsize()
+    
+    def start(self, bot: Bot):
+        """Start the sender task."""
+        self._bot = bot
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        """Stop the sender task (unsent messages are dropped)."""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+    
+    async def _run(self):
+        interval = 1 / self.rate_per_second
+        while True:
+            chat_id, text, parse_mode = await self._queue.get()
+            try:
+                await self._send(chat_id, text, parse_mode)
+            finally:
+                self._queue.task_done()
+            await asyncio.sleep(interval)
+    
+    async def _send(self, chat_id: int, text: str, parse_mode: Optional[str]):
+        try:
+            await self._bot.send_message(chat_id=chat_id, text=text, parse_mode=parse_mode)
+        except TelegramRetryAfter as e:
+            logger.warning(f"⏳ Flood wait {e.retry_after}s while sending notifications")
+            await asyncio.sleep(e.retry_after)
+            try:
+                await self._bot.send_message(chat_id=chat_id, text=text, parse_mode=parse_mode)
+            except Exception as retry_error:
+                logger.error(f"❌ Error sending notification to {chat_id}: {retry_error}")
+        except TelegramForbiddenError:
+            logger.info(f"🚫 User {chat_id} blocked the bot, notification skipped")
+        except Exception as e:
+            logger.error(f"❌ Error sending notification to {chat_id}: {e}")
+
+
+notification_queue = NotificationQueue()
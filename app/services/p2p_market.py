@@ -0,0 +1,350 @@
+"""P2P order book: filtered, keyset-paginated listing queries and the market price index."""
+import asyncio
+import bisect
+import logging
+from datetime import datetime, timedelta
+from sqlalchemy import select, and_, or_
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database.models import User, Bear, P2PListing
+
+logger = logging.getLogger(__name__)
+
+# Сортировки стакана: 'newest' - новые сверху, 'cheapest' - дешёвые сверху
+P2P_SORTS = ('newest', 'cheapest')
+P2P_PAGE_LIMIT_MAX = 100
+
+_EPOCH = datetime(1970, 1, 1)
+
+# Индекс цен: корзины уровней, окно медианы и глубина прогрева после рестарта
+PRICE_LEVEL_BUCKETS = [1, 2, 6, 11, 21, 36]  # 1 | 2-5 | 6-10 | 11-20 | 21-35 | 36-50
+PRICE_WINDOW = timedelta(days=7)
+PRICE_WARMUP_LIMIT = 10000
+PRICE_MIN_SAMPLES = 5
+
+
+class P2PMarketService:
+    """Order-book queries over active P2P listings."""
+    
+    @staticmethod
+    def encode_cursor(listing: dict, sort: str) -> str:
+        """
+        Encode keyset cursor '<key>_<listing_id>' from the last listing of a page.
+        Short enough to fit into Telegram callback_data.
+        """
+        if sort == 'cheapest':
+            key = repr(float(listing['price_coins']))
+        else:
+            key = str((listing['created_at'] - _EPOCH) // timedelta(microseconds=1))
+        return f"{key}_{listing['listing_id']}"
+    
+    @staticmethod
+    def decode_cursor(cursor: str, sort: str) -> tuple:
+        """
+        Decode keyset cursor into (sort key, listing id).
+        """
+        try:
+            key, listing_id = cursor.rsplit('_', 1)
+            if sort == 'cheapest':
+                return float(key), int(listing_id)
+            return _EPOCH + timedelta(microseconds=int(key)), int(listing_id)
+        except ValueError:
+            raise ValueError("Неверный курсор страницы")
+    
+    @staticmethod
+    async def get_listings(
+        session: AsyncSession,
+        limit: int = 50,
+        cursor: str = None,
+        sort: str = 'newest',
+        bear_type: str = None,
+        variant: int = None,
+        min_level: int = None,
+        max_level: int = None,
+        min_price: float = None,
+        max_price: float = None,
+    ) -> dict:
+        """
+        Get one page of active listings with a single joined projection query.
+        
+        Filters map onto the partial ix_p2p_active_* indexes of p2p_listings.
+        Returns {'listings': [...], 'next_cursor': str | None}.
+        """
+        if sort not in P2P_SORTS:
+            raise ValueError(f"Неверная сортировка: {sort}")
+        limit = max(1, min(limit, P2P_PAGE_LIMIT_MAX))
+        
+        query = (
+            select(
+                P2PListing.id,
+                P2PListing.bear_id,
+                P2PListing.seller_id,
+                P2PListing.price_coins,
+                P2PListing.created_at,
+                Bear.bear_type,
+                Bear.variant,
+                Bear.level,
+                Bear.name,
+                Bear.coins_per_hour,
+                User.username,
+                User.first_name,
+            )
+            .join(Bear, Bear.id == P2PListing.bear_id)
+            .join(User, User.id == P2PListing.seller_id)
+            .where(P2PListing.status == 'active')
+        )
+        
+        # Фильтры по денормализованным колонкам лота (покрыты индексами)
+        if bear_type is not None:
+            query = query.where(P2PListing.bear_type == bear_type)
+        if variant is not None:
+            query = query.where(P2PListing.bear_variant == variant)
+        if min_level is not None:
+            query = query.where(P2PListing.bear_level >= min_level)
+        if max_level is not None:
+            query = query.where(P2PListing.bear_level <= max_level)
+        if min_price is not None:
+            query = query.where(P2PListing.price_coins >= min_price)
+        if max_price is not None:
+            query = query.where(P2PListing.price_coins <= max_price)
+        
+        # Keyset-пагинация вместо OFFSET
+        if sort == 'cheapest':
+            if cursor:
+                price, listing_id = P2PMarketService.decode_cursor(cursor, sort)
+                query = query.where(or_(
+                    P2PListing.price_coins > price,
+                    and_(P2PListing.price_coins == price, P2PListing.id > listing_id),
+                ))
+            query = query.order_by(P2PListing.price_coins, P2PListing.id)
+        else:
+            if cursor:
+                created_at, listing_id = P2PMarketService.decode_cursor(cursor, sort)
+                query = query.where(or_(
+                    P2PListing.created_at < created_at,
+                    and_(P2PListing.created_at == created_at, P2PListing.id < listing_id),
+                ))
+            query = query.order_by(P2PListing.created_at.desc(), P2PListing.id.desc())
+        
+        # +1 строка чтобы узнать, есть ли следующая страница
+        result = await session.execute(query.limit(limit + 1))
+        rows = result.all()
+        
+        listings = [
+            {
+                'listing_id': row.id,
+                'bear_id': row.bear_id,
+                'seller_id': row.seller_id,
+                'bear_type': row.bear_type,
+                'bear_variant': row.variant,
+                'bear_level': row.level,
+                'bear_name': row.name,
+                'coins_per_hour': row.coins_per_hour,
+                'price_coins': row.price_coins,
+                'seller_name': row.username or row.first_name,
+                'created_at': row.created_at,
+            }
+            for row in rows[:limit]
+        ]
+        
+        next_cursor = None
+        if len(rows) > limit:
+            next_cursor = P2PMarketService.encode_cursor(listings[-1], sort)
+        
+        return {'listings': listings, 'next_cursor': next_cursor}
+
+
+def level_bucket(level: int) -> int:
+    """Get the price-index level bucket (lower bound) for a bear level."""
+    return PRICE_LEVEL_BUCKETS[max(bisect.bisect_right(PRICE_LEVEL_BUCKETS, level) - 1, 0)]
+
+
+class P2Quantile:
+    """
+    Streaming quantile estimator (P² algorithm, Jain & Chlamtac).
+    Keeps five markers - O(1) memory and O(1) per observation.
+    """
+    
+    def __init__(self, p: float = 0.5):
+        self.p = p
+        self.count = 0
+        self.heights = []
+        self.positions = [1, 2, 3, 4, 5]
+        self.desired = [1, 1 + 2 * p, 1 + 4 * p, 3 + 2 * p, 5]
+        self.increments = [0, p / 2, p, (1 + p) / 2, 1]
+    
+    def add(self, x: float):
+        """Add one observation."""
+        self.count += 1
+        if self.count <= 5:
+            bisect.insort(self.heights, x)
+            return
+        
+        q, n = self.heights, self.positions
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = bisect.bisect_right(q, x) - 1
+        
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+        
+        # Корректируем средние маркеры параболической (или линейной) интерполяцией
+        for i in range(1, 4):
+            d = self.desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                candidate = q[i] + d / (n[i + 1] - n[i - 1]) * (
+                    (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+                    + (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1])
+                )
+                if not q[i - 1] < candidate < q[i + 1]:
+                    candidate = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+                q[i] = candidate
+                n[i] += d
+    
+    def value(self) -> float | None:
+        """Current quantile estimate (exact while fewer than 6 observations)."""
+        if self.count == 0:
+            return None
+        if self.count <= 5:
+            return self.heights[min(int(self.p * self.count), self.count - 1)]
+        return self.heights[2]
+
+
+class PriceStats:
+    """Incremental price stats for one market key: rolling median, last price, 24h volume."""
+    
+    def __init__(self, window_start: datetime):
+        self.window_start = window_start
+        self.median = P2Quantile(0.5)
+        self.previous_median = None
+        self.last_price = None
+        self.last_sold_at = None
+        # Кольцо из 24 часовых слотов: (час, сделок, коинов)
+        self.hourly = [(None, 0, 0.0)] * 24
+    
+    def add(self, price: float, sold_at: datetime):
+        """Record one sale."""
+        # Окно медианы скользит: текущий скетч становится предыдущим
+        while sold_at >= self.window_start + PRICE_WINDOW:
+            self.window_start += PRICE_WINDOW
+            self.previous_median, self.median = self.median, P2Quantile(0.5)
+        self.median.add(price)
+        
+        if self.last_sold_at is None or sold_at >= self.last_sold_at:
+            self.last_price = price
+            self.last_sold_at = sold_at
+        
+        hour = int((sold_at - _EPOCH).total_seconds() // 3600)
+        slot_hour, trades, coins = self.hourly[hour % 24]
+        if slot_hour != hour:
+            trades, coins = 0, 0.0
+        self.hourly[hour % 24] = (hour, trades + 1, coins + price)
+    
+    def snapshot(self, now: datetime) -> dict:
+        """Current stats as a dict (O(24) - constant)."""
+        current_hour = int((now - _EPOCH).total_seconds() // 3600)
+        trades_24h = sum(t for h, t, _ in self.hourly if h is not None and current_hour - h < 24)
+        volume_24h = sum(c for h, _, c in self.hourly if h is not None and current_hour - h < 24)
+        
+        median = self.median.value()
+        # Прошлое окно - только если в нём были сделки (после паузы дольше двух окон оно пустое)
+        if self.median.count < PRICE_MIN_SAMPLES and self.previous_median is not None and self.previous_median.count > 0:
+            median = self.previous_median.value()
+        if median is None:
+            median = self.last_price
+        
+        return {
+            'median_price': median,
+            'last_price': self.last_price,
+            'last_sold_at': self.last_sold_at,
+            'trades_24h': trades_24h,
+            'volume_24h': volume_24h,
+            'samples': self.median.count,
+        }
+
+
+class P2PPriceIndex:
+    """
+    In-process market price index per (bear_type, variant, level bucket).
+    
+    Updated on every sold listing; warmed up once from recent sales after start.
+    Coarser keys (bear_type, None, bucket) back up variants without trades.
+    """
+    
+    def __init__(self):
+        self._stats: dict[tuple, PriceStats] = {}
+        self._loaded = False
+        self._lock = asyncio.Lock()
+    
+    @staticmethod
+    def _keys(bear_type: str, variant: int, level: int) -> list[tuple]:
+        bucket = level_bucket(level)
+        return [(bear_type, variant, bucket), (bear_type, None, bucket)]
+    
+    def _add(self, bear_type: str, variant: int, level: int, price: float, sold_at: datetime):
+        for key in self._keys(bear_type, variant, level):
+            stats = self._stats.get(key)
+            if stats is None:
+                stats = self._stats[key] = PriceStats(sold_at)
+            stats.add(price, sold_at)
+    
+    async def ensure_loaded(self, session: AsyncSession):
+        """Warm up the index from recent sales (once per process)."""
+        if self._loaded:
+            return
+        async with self._lock:
+            if self._loaded:
+                return
+            since = datetime.utcnow() - 2 * PRICE_WINDOW
+            result = await session.execute(
+                select(
+                    P2PListing.bear_type,
+                    P2PListing.bear_variant,
+                    P2PListing.bear_level,
+                    P2PListing.price_coins,
+                    P2PListing.sold_at,
+                )
+                .where(P2PListing.status == 'sold', P2PListing.sold_at >= since)
+                .order_by(P2PListing.sold_at)
+                .limit(PRICE_WARMUP_LIMIT)
+            )
+            for bear_type, variant, level, price, sold_at in result.all():
+                if bear_type is not None:
+                    self._add(bear_type, variant, level or 1, price, sold_at)
+            self._loaded = True
+            logger.info(f"📊 P2P price index warmed up: {len(self._stats)} keys")
+    
+    def record_sale(self, bear_type: str, variant: int, level: int, price: float, sold_at: datetime = None):
+        """
+        Record a sold listing. Skipped until warm-up - the warm-up query picks it up instead.
+        """
+        if not self._loaded or bear_type is None:
+            return
+        self._add(bear_type, variant, level or 1, price, sold_at or datetime.utcnow())
+    
+    def get_stats(self, bear_type: str, variant: int, level: int) -> dict | None:
+        """Get market stats for a bear in O(1); falls back to the whole type's bucket."""
+        now = datetime.utcnow()
+        for key in self._keys(bear_type, variant, level):
+            stats = self._stats.get(key)
+            if stats is not None:
+                return {**stats.snapshot(now), 'exact': key[1] is not None}
+        return None
+    
+    def suggest_price(self, bear_type: str, variant: int, level: int, floor: float = 0) -> float | None:
+        """Suggested listing price: rolling median (or last price), never below floor."""
+        stats = self.get_stats(bear_type, variant, level)
+        if stats is None:
+            return None
+        price = stats['median_price'] or stats['last_price']
+        return max(round(price), floor) if price else None
+
+
+p2p_price_index = P2PPriceIndex()
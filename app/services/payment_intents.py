@@ -0,0 +1,214 @@
+"""TON wallet top-up intents: a persistent status state machine."""
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta
+from decimal import Decimal
+from typing import NamedTuple
+from uuid import uuid4
+from sqlalchemy import select, update, values, column, Integer, Numeric
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database.models import User, PaymentIntent
+from app.services.ledger import ledger
+
+logger = logging.getLogger(__name__)
+
+PAYMENT_INTENT_TTL = timedelta(hours=1)  # Время на перевод после выбора пакета
+PAYMENT_REVIEW_TTL = timedelta(days=3)  # Время на проверку админом после подтверждения пользователем
+PAYMENT_OPEN_STATUSES = ('pending', 'waiting_confirmation')
+
+# Новый статус -> статусы, из которых в него можно перейти
+PAYMENT_TRANSITIONS = {
+    'waiting_confirmation': ('pending',),
+    'approved': ('pending', 'waiting_confirmation', 'expired'),  # Поздний перевод админ может зачесть
+    'rejected': ('pending', 'waiting_confirmation'),
+    'expired': PAYMENT_OPEN_STATUSES,
+}
+
+
+class ApprovedPayment(NamedTuple):
+    intent_id: str
+    user_id: int
+    ton_amount: Decimal
+    telegram_id: int
+    ton_balance: Decimal  # Баланс после всех зачислений этой пачки
+    package_id: str
+
+
+class PaymentIntentService:
+    """
+    Payment intents live in payment_intents, so they survive restarts and
+    are shared by all bot processes. Every status change is one guarded
+    UPDATE ... WHERE status IN (allowed sources) RETURNING: of two admins
+    pressing "approve" at once (or an admin and the deposit watcher) only
+    one gets the row back, so TON is credited once. Open intents expire
+    through the expiry engine.
+    """
+    
+    @staticmethod
+    async def get_or_create(
+        session: AsyncSession,
+        user: User,
+        package_id: str,
+        ton_amount: float,
+        now: datetime = None
+    ) -> PaymentIntent:
+        """The user's open pending intent for this package, or a new one. Only flushes."""
+        now = now or datetime.utcnow()
+        result = await session.execute(
+            select(PaymentIntent)
+            .where(
+                PaymentIntent.user_id == user.id,
+                PaymentIntent.package_id == package_id,
+                PaymentIntent.status == 'pending',
+                PaymentIntent.expires_at > now,
+            )
+            .order_by(PaymentIntent.created_at.desc())
+            .limit(1)
+        )
+        intent = result.scalar_one_or_none()
+        if intent is not None:
+            return intent
+        
+        intent = PaymentIntent(
+            id=uuid4().hex,
+            user_id=user.id,
+            package_id=package_id,
+            ton_amount=Decimal(str(ton_amount)),
+            memo=f"USER_{user.telegram_id}_{package_id}",
+            status='pending',
+            created_at=now,
+            expires_at=now + PAYMENT_INTENT_TTL,
+        )
+        session.add(intent)
+        await session.flush()
+        return intent
+    
+    @staticmethod
+    async def get(session: AsyncSession, intent_id: str) -> PaymentIntent | None:
+        return await session.get(PaymentIntent, intent_id)
+    
+    @staticmethod
+    async def transition(
+        session: AsyncSession,
+        intent_id: str,
+        status: str,
+        *criteria,
+        now: datetime = None,
+        **values
+    ) -> PaymentIntent | None:
+        """
+        Move an intent to `status` if its current status allows it.
+        Returns the updated intent, or None if it does not exist or was
+        already moved elsewhere. Only executes.
+        """
+        now = now or datetime.utcnow()
+        result = await session.execute(
+            update(PaymentIntent)
+            .where(
+                PaymentIntent.id == intent_id,
+                PaymentIntent.status.in_(PAYMENT_TRANSITIONS[status]),
+                *criteria
+            )
+            .values(status=status, updated_at=now, **values)
+            .returning(PaymentIntent)
+            .execution_options(synchronize_session=False, populate_existing=True)
+        )
+        return result.scalar_one_or_none()
+    
+    @staticmethod
+    async def confirm(session: AsyncSession, intent_id: str, now: datetime = None) -> PaymentIntent | None:
+        """User says the transfer is sent: hand the intent to the admin queue."""
+        now = now or datetime.utcnow()
+        return await PaymentIntentService.transition(
+            session, intent_id, 'waiting_confirmation',
+            PaymentIntent.expires_at > now,
+            now=now,
+            expires_at=now + PAYMENT_REVIEW_TTL,
+        )
+    
+    @staticmethod
+    async def approve_many(
+        session: AsyncSession,
+        intent_ids: list[str],
+        resolved_by: int = None,
+        descriptions: dict[str, str] = None,
+        now: datetime = None
+    ) -> list[ApprovedPayment]:
+        """
+        Approve intents and credit TON in the caller's transaction: one
+        guarded UPDATE for the intents, one UPDATE ... FROM (VALUES ...) for
+        the balances, one ledger INSERT. Intents that are missing or already
+        resolved are skipped. Only executes.
+        """
+        now = now or datetime.utcnow()
+        if not intent_ids:
+            return []
+        
+        result = await session.execute(
+            update(PaymentIntent)
+            .where(PaymentIntent.id.in_(intent_ids), PaymentIntent.status.in_(PAYMENT_TRANSITIONS['approved']))
+            .values(status='approved', resolved_by=resolved_by, updated_at=now)
+            .returning(PaymentIntent.id, PaymentIntent.user_id, PaymentIntent.ton_amount, PaymentIntent.package_id)
+            .execution_options(synchronize_session=False)
+        )
+        approved = result.all()
+        if not approved:
+            return []
+        
+        credits = defaultdict(Decimal)
+        for _, user_id, ton_amount, _ in approved:
+            credits[user_id] += ton_amount
+        credit_rows = values(column('user_id', Integer), column('amount', Numeric), name='credits').data(list(credits.items()))
+        result = await session.execute(
+            update(User)
+            .where(User.id == credit_rows.c.user_id)
+            .values(ton_balance=User.ton_balance + credit_rows.c.amount)
+            .returning(User.id, User.telegram_id, User.ton_balance)
+            .execution_options(synchronize_session=False)
+        )
+        balances = {user_id: (telegram_id, ton_balance) for user_id, telegram_id, ton_balance in result.all()}
+        
+        descriptions = descriptions or {}
+        await ledger.write(session, [
+            (
+                user_id,
+                float(ton_amount),
+                'purchase_ton_wallet',
+                descriptions.get(intent_id) or f'Пополнение через TON Wallet ({package_id}, +{float(ton_amount)} TON)'
+            )
+            for intent_id, user_id, ton_amount, package_id in approved
+        ])
+        return [
+            ApprovedPayment(intent_id, user_id, ton_amount, *balances[user_id], package_id)
+            for intent_id, user_id, ton_amount, package_id in approved
+        ]
+    
+    @staticmethod
+    async def approve(
+        session: AsyncSession,
+        intent_id: str,
+        admin_id: int,
+        description: str
+    ) -> ApprovedPayment | None:
+        """
+        Approve one intent and credit TON in the same transaction.
+        None if the intent cannot be approved (missing or already resolved). Only executes.
+        """
+        approved = await PaymentIntentService.approve_many(session, [intent_id], admin_id, {intent_id: description})
+        return approved[0] if approved else None
+    
+    @staticmethod
+    async def reject(session: AsyncSession, intent_id: str, admin_id: int) -> PaymentIntent | None:
+        return await PaymentIntentService.transition(session, intent_id, 'rejected', resolved_by=admin_id)
+    
+    @staticmethod
+    async def admin_queue(session: AsyncSession, limit: int = 20) -> list[tuple[PaymentIntent, User]]:
+        """Intents waiting for the admin, oldest first (ix_payment_intents_status_created)."""
+        result = await session.execute(
+            select(PaymentIntent, User)
+            .join(User, User.id == PaymentIntent.user_id)
+            .where(PaymentIntent.status == 'waiting_confirmation')
+            .order_by(PaymentIntent.created_at)
+            .limit(limit)
+        )
+        return result.all()
@@ -0,0 +1,262 @@
+"""PvP service: bear power, rating-aware matchmaking and Elo leaderboard."""
+import asyncio
+import bisect
+import logging
+import random
+from datetime import datetime, timedelta
+from sqlalchemy import select, func, case, event
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from app.database.models import Bear, PvPStats
+from app.services.leaderboard import RankedBoard
+
+logger = logging.getLogger(__name__)
+
+# Bear power calculation
+BEAR_TYPE_POWER = {
+    "common": 1.0,
+    "rare": 1.5,
+    "epic": 2.0,
+    "legendary": 3.0,
+}
+
+# Matchmaking settings
+MATCH_WINDOW_PERCENT = 0.2  # Противник в пределах ±20% силы команды
+MATCH_WINDOW_MIN = 100  # Минимальная ширина окна
+MATCH_WINDOW_WIDENINGS = 3  # Сколько раз удваиваем окно, прежде чем брать случайного
+MATCH_SAMPLE_SIZE = 1000  # Размер заранее выбранной случайной выборки игроков
+MATCH_REFRESH_INTERVAL = timedelta(minutes=10)  # Как часто пересчитываем всю лестницу
+
+# Elo settings
+ELO_DEFAULT_RATING = 1000
+ELO_K_FACTOR = 32
+ELO_MIN_RATING = 0
+LEADERBOARD_SIZE = 100
+LEADERBOARD_REFRESH_INTERVAL = timedelta(hours=1)  # Периодическая сверка с БД
+PVP_PENDING_RATINGS_KEY = 'pvp_pending_ratings'  # session.info: рейтинги, ждущие коммита
+
+
+def calculate_bear_power(bear: Bear) -> float:
+    """Calculate bear battle power."""
+    base_power = BEAR_TYPE_POWER.get(bear.bear_type, 1.0)
+    level_bonus = bear.level * 0.1
+    return (base_power + level_bonus) * 100
+
+
+def calculate_team_power(bears: list[Bear]) -> float:
+    """Calculate total battle power of user's bears."""
+    return sum(calculate_bear_power(bear) for bear in bears)
+
+
+def bear_power_expr():
+    """SQL expression of calculate_bear_power, for aggregating team power in the DB."""
+    return (case(BEAR_TYPE_POWER, value=Bear.bear_type, else_=1.0) + Bear.level * 0.1) * 100
+
+
+class PvPMatchmaker:
+    """
+    In-process matchmaking ladder of team powers.
+    
+    Players are kept sorted by team power, so an opponent inside a power window
+    is found with two bisects (O(log n)) instead of ORDER BY random() over bears.
+    The ladder is rebuilt from one aggregate query every MATCH_REFRESH_INTERVAL;
+    players refresh their own entry whenever they open PvP.
+    """
+    
+    def __init__(self):
+        self._powers: dict[int, float] = {}
+        self._ladder: list[tuple[float, int]] = []
+        self._sample: list[int] = []
+        self._refreshed_at = None
+        self._lock = asyncio.Lock()
+    
+    async def ensure_fresh(self, session: AsyncSession):
+        """Rebuild the ladder if it was never built or is older than MATCH_REFRESH_INTERVAL."""
+        now = datetime.utcnow()
+        if self._refreshed_at and now - self._refreshed_at < MATCH_REFRESH_INTERVAL:
+            return
+        async with self._lock:
+            if self._refreshed_at and now - self._refreshed_at < MATCH_REFRESH_INTERVAL:
+                return
+            
+            result = await session.execute(
+                select(Bear.owner_id, func.sum(bear_power_expr())).group_by(Bear.owner_id)
+            )
+            powers = {owner_id: float(power) for owner_id, power in result.all()}
+            
+            self._powers = powers
+            self._ladder = sorted((power, user_id) for user_id, power in powers.items())
+            self._sample = random.sample(list(powers), min(MATCH_SAMPLE_SIZE, len(powers)))
+            self._refreshed_at = now
+            logger.info(f"⚔️ PvP ladder rebuilt: {len(self._ladder)} players")
+    
+    def update_power(self, user_id: int, power: float):
+        """Insert or move a player on the ladder."""
+        old_power = self._powers.get(user_id)
+        if old_power == power:
+            return
+        if old_power is not None:
+            self.remove(user_id)
+        self._powers[user_id] = power
+        bisect.insort(self._ladder, (power, user_id))
+    
+    def remove(self, user_id: int):
+        """Remove a player from the ladder (e.g. no bears left)."""
+        power = self._powers.pop(user_id, None)
+        if power is None:
+            return
+        idx = bisect.bisect_left(self._ladder, (power, user_id))
+        if idx < len(self._ladder) and self._ladder[idx] == (power, user_id):
+            self._ladder.pop(idx)
+    
+    def find_opponent(self, user_id: int, power: float, exclude: set = None) -> int | None:
+        """
+        Pick a random opponent within the power window, widening it if empty.
+        Falls back to the pre-computed random sample.
+        """
+        exclude = (exclude or set()) | {user_id}
+        half_width = max(power * MATCH_WINDOW_PERCENT, MATCH_WINDOW_MIN)
+        
+        for _ in range(MATCH_WINDOW_WIDENINGS + 1):
+            lo = bisect.bisect_left(self._ladder, (power - half_width, -1))
+            hi = bisect.bisect_right(self._ladder, (power + half_width, float('inf')))
+            # Несколько случайных попыток внутри окна, без копирования среза
+            for _ in range(min(hi - lo, 8)):
+                candidate = self._ladder[random.randrange(lo, hi)][1]
+                if candidate not in exclude:
+                    return candidate
+            half_width *= 2
+        
+        candidates = [candidate for candidate in self._sample if candidate not in exclude and candidate in self._powers]
+        return random.choice(candidates) if candidates else None
+
+
+pvp_matchmaker = PvPMatchmaker()
+
+
+def elo_expected(rating: int, opponent_rating: int) -> float:
+    """Expected score of a player against an opponent."""
+    return 1 / (1 + 10 ** ((opponent_rating - rating) / 400))
+
+
+def elo_update(winner_rating: int, loser_rating: int, k: int = ELO_K_FACTOR) -> tuple[int, int]:
+    """New (winner, loser) ratings after a battle."""
+    delta = round(k * (1 - elo_expected(winner_rating, loser_rating)))
+    delta = max(delta, 1)
+    return winner_rating + delta, max(loser_rating - delta, ELO_MIN_RATING)
+
+
+class PvPLeaderboard:
+    """
+    In-process rating leaderboard (RankedBoard over an indexable skiplist).
+    
+    pvp_stats is the source of truth: the board is loaded from it with one query
+    and then updated live after every battle, so top-N and a player's rank are
+    O(log n) instead of sorting all players. It is re-read from the DB every
+    LEADERBOARD_REFRESH_INTERVAL to pick up writes from other processes.
+    """
+    
+    def __init__(self):
+        self._board = RankedBoard()
+        self._loaded_at = None
+        self._lock = asyncio.Lock()
+    
+    async def ensure_loaded(self, session: AsyncSession):
+        """Load the board if it was never loaded or is older than LEADERBOARD_REFRESH_INTERVAL."""
+        now = datetime.utcnow()
+        if self._loaded_at and now - self._loaded_at < LEADERBOARD_REFRESH_INTERVAL:
+            return
+        async with self._lock:
+            if self._loaded_at and now - self._loaded_at < LEADERBOARD_REFRESH_INTERVAL:
+                return
+            
+            result = await session.execute(select(PvPStats.user_id, PvPStats.rating))
+            board = RankedBoard()
+            for user_id, rating in result.all():
+                board.set(user_id, rating)
+            
+            self._board = board
+            self._loaded_at = now
+            logger.info(f"🏆 PvP leaderboard loaded: {len(board)} players")
+    
+    def update(self, user_id: int, rating: int):
+        """Insert or move a player on the board."""
+        self._board.set(user_id, rating)
+    
+    def rank(self, user_id: int) -> int | None:
+        """1-based place of a player, or None if they have no rated battles."""
+        return self._board.rank(user_id)
+    
+    def top(self, limit: int = LEADERBOARD_SIZE) -> list[tuple[int, int]]:
+        """Top players as (user_id, rating), best first."""
+        return [(user_id, rating) for _, user_id, rating in self._board.top(limit)]
+    
+    def __len__(self) -> int:
+        return len(self._board)
+
+
+pvp_leaderboard = PvPLeaderboard()
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_ratings_on_commit(session):
+    """Move ratings of committed battles onto the leaderboard."""
+    for user_id, rating in session.info.pop(PVP_PENDING_RATINGS_KEY, {}).items():
+        pvp_leaderboard.update(user_id, rating)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _drop_ratings_on_rollback(session):
+    """Ratings of rolled back battles were never stored."""
+    session.info.pop(PVP_PENDING_RATINGS_KEY, None)
+
+
+class PvPRatingService:
+    """Persistent PvP ratings."""
+    
+    @staticmethod
+    async def get_stats(session: AsyncSession, user_id: int) -> PvPStats | None:
+        """Get user PvP stats (None if the user never fought)."""
+        result = await session.execute(select(PvPStats).where(PvPStats.user_id == user_id))
+        return result.scalar_one_or_none()
+    
+    @staticmethod
+    async def record_battle(session: AsyncSession, winner_id: int, loser_id: int) -> dict:
+        """
+        Apply Elo and win/loss counters for one battle.
+        Rows are locked in user id order so concurrent battles do not lose updates.
+        Returns {user_id: (old_rating, new_rating)}. The leaderboard is
+        updated when the caller commits.
+        """
+        user_ids = sorted({winner_id, loser_id})
+        await session.execute(
+            pg_insert(PvPStats)
+            .values([{'user_id': user_id, 'rating': ELO_DEFAULT_RATING, 'wins': 0, 'losses': 0} for user_id in user_ids])
+            .on_conflict_do_nothing(index_elements=['user_id'])
+        )
+        result = await session.execute(
+            select(PvPStats)
+            .where(PvPStats.user_id.in_(user_ids))
+            .order_by(PvPStats.user_id)
+            .with_for_update()
+            .execution_options(populate_existing=True)
+        )
+        stats = {row.user_id: row for row in result.scalars().all()}
+        winner, loser = stats[winner_id], stats[loser_id]
+        
+        old_ratings = (winner.rating, loser.rating)
+        winner.rating, loser.rating = elo_update(winner.rating, loser.rating)
+        winner.wins += 1
+        loser.losses += 1
+        await session.flush()
+        
+        # На доску рейтинга - только после коммита (см. _apply_ratings_on_commit)
+        pending = session.info.setdefault(PVP_PENDING_RATINGS_KEY, {})
+        pending[winner_id] = winner.rating
+        pending[loser_id] = loser.rating
+        
+        return {
+            winner_id: (old_ratings[0], winner.rating),
+            loser_id: (old_ratings[1], loser.rating),
+        }
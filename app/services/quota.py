@@ -0,0 +1,137 @@
+"""Daily per-user quotas for capped actions (ads, fortune wheel)."""
+import logging
+from datetime import datetime, timedelta
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database.models import UserQuota
+from config import settings
+
+try:
+    import redis.asyncio as aioredis
+    from redis.exceptions import RedisError
+except ImportError:  # Redis не обязателен - работаем через БД
+    aioredis = None
+    RedisError = OSError
+
+logger = logging.getLogger(__name__)
+
+QUOTA_REDIS_RETRY_AFTER = timedelta(seconds=60)  # Пауза перед повторной попыткой после ошибки Redis
+QUOTA_KEY_TTL_SLACK = 3600  # Ключ живёт до конца дня + час
+
+# Атомарная проверка и списание: не увеличиваем счётчик сверх лимита
+_CONSUME_SCRIPT = """
+local amount = tonumber(ARGV[1])
+local used = tonumber(redis.call('GET', KEYS[1]) or '0')
+if used + amount > tonumber(ARGV[2]) then
+    return -1
+end
+used = redis.call('INCRBY', KEYS[1], amount)
+if used == amount then
+    redis.call('EXPIRE', KEYS[1], ARGV[3])
+end
+return used
+"""
+
+
+class QuotaService:
+    """
+    Counters keyed by (user, action, UTC day).
+    
+    Redis is the primary store (an atomic Lua INCRBY + EXPIRE, so keys vanish
+    on their own). When Redis is not configured or not reachable, the same
+    check-and-consume runs as one INSERT ... ON CONFLICT DO UPDATE ... WHERE
+    used + n <= limit in the caller's transaction. Counts are not merged
+    between the two stores, so during a Redis outage a user may get up to
+    the limit once more.
+    """
+    
+    def __init__(self):
+        self._redis = None
+        self._script = None
+        self._redis_down_until = None
+    
+    def _client(self):
+        """Redis client, or None if Redis is unavailable right now."""
+        if aioredis is None or not settings.REDIS_URL:
+            return None
+        if self._redis_down_until and datetime.utcnow() < self._redis_down_until:
+            return None
+        if self._redis is None:
+            self._redis = aioredis.from_url(settings.REDIS_URL, decode_responses=True)
+            self._script = self._redis.register_script(_CONSUME_SCRIPT)
+        return self._redis
+    
+    def _redis_failed(self, e: Exception):
+        now = datetime.utcnow()
+        if not self._redis_down_until or now >= self._redis_down_until:
+            logger.warning(f"⚠️ Redis unavailable for quotas, using DB fallback: {e}")
+        self._redis_down_until = now + QUOTA_REDIS_RETRY_AFTER
+    
+    @staticmethod
+    def _key(user_id: int, action: str, now: datetime) -> str:
+        return f"quota:{action}:{now:%Y%m%d}:{user_id}"
+    
+    @staticmethod
+    def _seconds_left_today(now: datetime) -> int:
+        tomorrow = now.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+        return int((tomorrow - now).total_seconds()) + QUOTA_KEY_TTL_SLACK
+    
+    async def get_used(self, session: AsyncSession, user_id: int, action: str, now: datetime = None) -> int:
+        """How many times the action was used today."""
+        now = now or datetime.utcnow()
+        client = self._client()
+        if client is not None:
+            try:
+                return int(await client.get(self._key(user_id, action, now)) or 0)
+            except (RedisError, OSError) as e:
+                self._redis_failed(e)
+        
+        result = await session.execute(
+            select(UserQuota.used).where(
+                UserQuota.user_id == user_id,
+                UserQuota.action == action,
+                UserQuota.day == now.date(),
+            )
+        )
+        return result.scalar_one_or_none() or 0
+    
+    async def consume(
+        self,
+        session: AsyncSession,
+        user_id: int,
+        action: str,
+        limit: int,
+        amount: int = 1,
+        now: datetime = None
+    ) -> int | None:
+        """
+        Atomically use `amount` of today's quota.
+        Returns the new used count, or None if it would exceed the limit.
+        """
+        now = now or datetime.utcnow()
+        if amount > limit:
+            return None
+        
+        client = self._client()
+        if client is not None:
+            try:
+                used = await self._script(
+                    keys=[self._key(user_id, action, now)],
+                    args=[amount, limit, self._seconds_left_today(now)],
+                )
+                return None if int(used) < 0 else int(used)
+            except (RedisError, OSError) as e:
+                self._redis_failed(e)
+        
+        stmt = pg_insert(UserQuota).values(user_id=user_id, action=action, day=now.date(), used=amount)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['user_id', 'action', 'day'],
+            set_={'used': UserQuota.used + amount},
+            where=UserQuota.used + amount <= limit,
+        ).returning(UserQuota.used)
+        result = await session.execute(stmt)
+        return result.scalar_one_or_none()
+
+
+quota_service = QuotaService()
@@ -2,7 +2,8 @@
 import logging
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
-from app.database.models import User, CoinTransaction
+from app.database.models import User
+from app.services.ledger import ledger
 from datetime import datetime
 
 logger = logging.getLogger(__name__)
@@ -12,6 +13,8 @@ REFERRAL_COMMISSION_TIER1 = 0.20  # 20% для 1-го круга
 REFERRAL_COMMISSION_TIER2 = 0.10  # 10% для 2-го круга
 REFERRAL_COMMISSION_TIER3 = 0.05  # 5% для 3-го круга
 
+REFERRAL_BONUS = 100  # Bonus for both referrer and referred user
+
 
 class ReferralService:
     """Service for referral system with 3-tier commissions."""
@@ -42,6 +45,7 @@ class ReferralService:
             return {'tier1': 0, 'tier2': 0, 'tier3': 0}
         
         earnings = {'tier1': 0, 'tier2': 0, 'tier3': 0}
+        ledger_entries = []  # Информационные записи - в буфер после коммита
         
         try:
             # Get user who spent coins
@@ -67,13 +71,12 @@ class ReferralService:
                 earnings['tier1'] = tier1_earnings
                 
                 # Log transaction
-                transaction = CoinTransaction(
-                    user_id=tier1_referrer.id,
-                    amount=tier1_earnings,
-                    transaction_type='referral_tier1',
-                    description=f'Комиссия 20% от трат реферала ({amount_spent:.0f} коинов)'
-                )
-                session.add(transaction)
+                ledger_entries.append((
+                    tier1_referrer.id,
+                    tier1_earnings,
+                    'referral_tier1',
+                    f'Комиссия 20% от трат реферала ({amount_spent:.0f} коинов)'
+                ))
                 
                 logger.info(f"💰 Tier 1: User {tier1_referrer.id} earned {tier1_earnings:.2f} coins")
                 
@@ -94,13 +97,12 @@ class ReferralService:
                         earnings['tier2'] = tier2_earnings
                         
                         # Log transaction
-                        transaction = CoinTransaction(
-                            user_id=tier2_referrer.id,
-                            amount=tier2_earnings,
-                            transaction_type='referral_tier2',
-                            description=f'Комиссия 10% от трат реферала 2-го круга ({amount_spent:.0f} коинов)'
-                        )
-                        session.add(transaction)
+                        ledger_entries.append((
+                            tier2_referrer.id,
+                            tier2_earnings,
+                            'referral_tier2',
+                            f'Комиссия 10% от трат реферала 2-го круга ({amount_spent:.0f} коинов)'
+                        ))
                         
                         logger.info(f"💰 Tier 2: User {tier2_referrer.id} earned {tier2_earnings:.2f} coins")
                         
@@ -121,16 +123,16 @@ class ReferralService:
                                 earnings['tier3'] = tier3_earnings
                                 
                                 # Log transaction
-                                transaction = CoinTransaction(
-                                    user_id=tier3_referrer.id,
-                                    amount=tier3_earnings,
-                                    transaction_type='referral_tier3',
-                                    description=f'Комиссия 5% от трат реферала 3-го круга ({amount_spent:.0f} коинов)'
-                                )
-                                session.add(transaction)
+                                ledger_entries.append((
+                                    tier3_referrer.id,
+                                    tier3_earnings,
+                                    'referral_tier3',
+                                    f'Комиссия 5% от трат реферала 3-го круга ({amount_spent:.0f} коинов)'
+                                ))
                                 
                                 logger.info(f"💰 Tier 3: User {tier3_referrer.id} earned {tier3_earnings:.2f} coins")
             
+            ledger.defer(session, ledger_entries)
             await session.commit()
             
         except Exception as e:
@@ -0,0 +1,85 @@
+"""Idempotent crediting of Telegram Stars payments."""
+import logging
+from datetime import datetime
+from decimal import Decimal
+from typing import NamedTuple
+from sqlalchemy import select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database.models import User, StarsPayment
+from app.services.ledger import ledger
+
+logger = logging.getLogger(__name__)
+
+
+class StarsCredit(NamedTuple):
+    user_id: int
+    balance: float  # Новый баланс: TON для 'ton', коины для 'coins'
+
+
+class StarsPaymentService:
+    """
+    Every successful_payment is recorded in stars_payments under its
+    telegram_payment_charge_id before anything is credited, with INSERT
+    ... ON CONFLICT DO NOTHING in the same transaction as the credit. A
+    repeated delivery (retry, webhook replay, two workers) inserts nothing
+    and credits nothing; a concurrent duplicate waits on the unique key
+    and is skipped once the first transaction commits.
+    """
+    
+    @staticmethod
+    async def credit(
+        session: AsyncSession,
+        telegram_payment_charge_id: str,
+        provider_payment_charge_id: str | None,
+        telegram_id: int,
+        product: str,
+        package_id: str,
+        stars: int,
+        amount: float,
+        description: str
+    ) -> StarsCredit | None:
+        """
+        Record the payment and credit `amount` (TON for 'ton', coins for 'coins').
+        Returns None if this charge was already processed. Only executes - the
+        caller commits.
+        """
+        user_id = (await session.execute(select(User.id).where(User.telegram_id == telegram_id))).scalar_one_or_none()
+        if user_id is None:
+            raise ValueError(f"Пользователь {telegram_id} не найден")
+        
+        result = await session.execute(
+            pg_insert(StarsPayment)
+            .values(
+                telegram_payment_charge_id=telegram_payment_charge_id,
+                provider_payment_charge_id=provider_payment_charge_id,
+                user_id=user_id,
+                product=product,
+                package_id=package_id,
+                stars=stars,
+                amount=amount,
+                created_at=datetime.utcnow(),
+            )
+            .on_conflict_do_nothing(index_elements=['telegram_payment_charge_id'])
+            .returning(StarsPayment.telegram_payment_charge_id)
+        )
+        if result.scalar_one_or_none() is None:
+            logger.info(f"Stars payment {telegram_payment_charge_id} already processed, skipped")
+            return None
+        
+        if product == 'ton':
+            values = {'ton_balance': User.ton_balance + Decimal(str(amount))}
+            balance_column = User.ton_balance
+        else:
+            values = {'coins': User.coins + amount}
+            balance_column = User.coins
+        result = await session.execute(
+            update(User)
+            .where(User.id == user_id)
+            .values(**values)
+            .returning(balance_column)
+            .execution_options(synchronize_session=False)
+        )
+        balance = result.scalar_one()
+        await ledger.write(session, [(user_id, amount, 'purchase_stars', description)])
+        return StarsCredit(user_id, float(balance))
@@ -0,0 +1,257 @@
+"""TON deposit watcher: polls the deposit address and credits transfers whose memo matches a payment intent."""
+import asyncio
+import logging
+from datetime import datetime
+from decimal import Decimal
+import aiohttp
+from sqlalchemy import select, update, func, case
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database.db import get_session
+from app.database.models import PaymentIntent, TonDeposit
+from app.services.analytics import analytics
+from app.services.notifications import notification_queue
+from app.services.payment_intents import PaymentIntentService, PAYMENT_TRANSITIONS
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+TON_DEPOSIT_ADDRESS = settings.TON_WALLET_ADDRESS or "UQBLaN9mzDOTceNlEGqo5JCjjWi8deYPYddGFzG_CqF4zXXg"
+TON_WATCHER_INTERVAL = 15  # Секунд между опросами (пользователь может разбудить раньше)
+TON_API_PAGE_SIZE = 100
+TON_API_TIMEOUT = 10  # Секунд на запрос
+TON_API_POOL_SIZE = 4  # Соединений в пуле
+NANOTON = Decimal(10 ** 9)
+
+
+class TonApiClient:
+    """Minimal tonapi.io v2 client on one pooled aiohttp session (keep-alive, shared connector)."""
+    
+    def __init__(self, base_url: str, api_key: str = ''):
+        self.base_url = base_url.rstrip('/')
+        self.api_key = api_key
+        self._session: aiohttp.ClientSession | None = None
+    
+    def _client(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            headers = {'Authorization': f'Bearer {self.api_key}'} if self.api_key else {}
+            self._session = aiohttp.ClientSession(
+                headers=headers,
+                timeout=aiohttp.ClientTimeout(total=TON_API_TIMEOUT),
+                connector=aiohttp.TCPConnector(limit=TON_API_POOL_SIZE, keepalive_timeout=60),
+            )
+        return self._session
+    
+    async def get_transactions(self, address: str, after_lt: int = 0, limit: int = TON_API_PAGE_SIZE) -> list[dict]:
+        """Account transactions with lt > after_lt, oldest first."""
+        params = {'limit': limit, 'sort_order': 'asc'}
+        if after_lt:
+            params['after_lt'] = after_lt
+        async with self._client().get(
+            f'{self.base_url}/v2/blockchain/accounts/{address}/transactions', params=params
+        ) as response:
+            response.raise_for_status()
+            data = await response.json()
+        return data.get('transactions', [])
+    
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+def parse_deposit(tx: dict) -> dict | None:
+    """Incoming transfer fields from a tonapi transaction, or None if it is not a deposit."""
+    in_msg = tx.get('in_msg') or {}
+    value = int(in_msg.get('value') or 0)
+    if tx.get('success') is False or not in_msg.get('source') or value <= 0:
+        return None
+    memo = (in_msg.get('decoded_body') or {}).get('text') if in_msg.get('decoded_op_name') == 'text_comment' else None
+    return {
+        'tx_hash': tx['hash'],
+        'lt': int(tx['lt']),
+        'source': (in_msg['source'] or {}).get('address'),
+        'amount': Decimal(value) / NANOTON,
+        'memo': memo.strip()[:255] if memo else None,
+    }
+
+
+class DepositWatcher:
+    """
+    Polls the deposit address and credits payment intents automatically.
+    
+    The cursor is the highest logical time seen (MAX(ton_deposits.lt) after
+    a restart). Every page of new transactions is handled in one
+    transaction: deposits are inserted with ON CONFLICT (tx_hash) DO NOTHING,
+    so a transfer seen twice (several bot processes, a retried page) is
+    processed once. Memos of the new deposits are matched against payment
+    intents with one query, and matches are approved in bulk through
+    PaymentIntentService.approve_many. Deposits without a matching intent
+    (unknown memo, short amount, intent already resolved) are stored as
+    'unmatched' and reported to the admin.
+    """
+    
+    def __init__(self, client: TonApiClient, address: str, enabled: bool = False):
+        self.client = client
+        self.address = address
+        self._enabled = enabled
+        self._cursor: int | None = None
+        self._wakeup = asyncio.Event()
+    
+    @property
+    def enabled(self) -> bool:
+        """Only when switched on explicitly; otherwise deposits go through admin approval."""
+        return bool(self._enabled and self.client.base_url and self.address)
+    
+    def wake(self):
+        """Poll right away (the user says the transfer is sent)."""
+        self._wakeup.set()
+    
+    @staticmethod
+    async def match(session: AsyncSession, deposits: list[dict]) -> dict[str, str]:
+        """{tx_hash: intent_id} for deposits whose memo and amount fit an approvable intent."""
+        memos = {d['memo'] for d in deposits if d['memo']}
+        if not memos:
+            return {}
+        
+        result = await session.execute(
+            select(PaymentIntent.id, PaymentIntent.memo, PaymentIntent.ton_amount)
+            .where(PaymentIntent.memo.in_(memos), PaymentIntent.status.in_(PAYMENT_TRANSITIONS['approved']))
+            # Сначала открытые заявки, затем истёкшие; внутри - старые первыми
+            .order_by(case((PaymentIntent.status == 'expired', 1), else_=0), PaymentIntent.created_at)
+        )
+        candidates: dict[str, list] = {}
+        for intent_id, memo, ton_amount in result.all():
+            candidates.setdefault(memo, []).append((intent_id, ton_amount))
+        
+        matches = {}
+        for deposit in deposits:
+            for index, (intent_id, ton_amount) in enumerate(candidates.get(deposit['memo'], ())):
+                if deposit['amount'] >= ton_amount:
+                    matches[deposit['tx_hash']] = intent_id
+                    del candidates[deposit['memo']][index]
+                    break
+        return matches
+    
+    async def process(self, session: AsyncSession, deposits: list[dict]) -> tuple[list, list]:
+        """
+        Store new deposits and credit the matching intents.
+        Returns (approved payments, unmatched deposits). Only executes - the caller commits.
+        """
+        if not deposits:
+            return [], []
+        
+        now = datetime.utcnow()
+        result = await session.execute(
+            pg_insert(TonDeposit)
+            .values([{**d, 'status': 'unmatched', 'created_at': now} for d in deposits])
+            .on_conflict_do_nothing(index_elements=['tx_hash'])
+            .returning(TonDeposit.tx_hash)
+        )
+        new_hashes = set(result.scalars().all())
+        deposits = [d for d in deposits if d['tx_hash'] in new_hashes]
+        
+        matches = await self.match(session, deposits)
+        approved = await PaymentIntentService.approve_many(session, list(matches.values()), now=now)
+        approved_ids = {payment.intent_id for payment in approved}
+        credited = [
+            {'tx_hash': tx_hash, 'status': 'credited', 'intent_id': intent_id}
+            for tx_hash, intent_id in matches.items()
+            if intent_id in approved_ids
+        ]
+        if credited:
+            await session.execute(update(TonDeposit), credited)
+        
+        credited_hashes = {row['tx_hash'] for row in credited}
+        return approved, [d for d in deposits if d['tx_hash'] not in credited_hashes]
+    
+    async def poll_once(self) -> dict:
+        """Fetch every transaction after the cursor and process it page by page."""
+        stats = {'deposits': 0, 'credited': 0, 'unmatched': 0}
+        if self._cursor is None:
+            async with get_session() as session:
+                self._cursor = (await session.execute(select(func.max(TonDeposit.lt)))).scalar() or 0
+        
+        while True:
+            transactions = await self.client.get_transactions(self.address, after_lt=self._cursor)
+            if not transactions:
+                break
+            deposits = [d for d in map(parse_deposit, transactions) if d is not None]
+            async with get_session() as session:
+                approved, unmatched = await self.process(session, deposits)
+            self._cursor = max(self._cursor, *(int(tx['lt']) for tx in transactions))
+            
+            stats['deposits'] += len(approved) + len(unmatched)
+            stats['credited'] += len(approved)
+            stats['unmatched'] += len(unmatched)
+            self._notify(approved, unmatched)
+            for payment in approved:
+                await analytics.track_event(payment.user_id, 'payment_completed', {
+                    'method': 'ton_deposit', 'product': 'ton', 'package_id': payment.package_id,
+                    'amount': float(payment.ton_amount), 'currency': 'TON',
+                })
+            if len(transactions) < TON_API_PAGE_SIZE:
+                break
+        return stats
+    
+    @staticmethod
+    def _notify(approved: list, unmatched: list):
+        for payment in approved:
+            notification_queue.enqueue(
+                payment.telegram_id,
+                f"✅ Платёж получен!\n\n"
+                f"💎 Начислено: {float(payment.ton_amount)} TON\n"
+                f"💼 Баланс: {float(payment.ton_balance):.4f} TON"
+            )
+        if unmatched and settings.ADMIN_ID:
+            lines = [f"• {float(d['amount'])} TON, комментарий: {d['memo'] or '—'}" for d in unmatched[:20]]
+            more = f"\n…и ещё {len(unmatched) - 20}" if len(unmatched) > 20 else ""
+            notification_queue.enqueue(
+                settings.ADMIN_ID,
+                "⚠️ Переводы без подходящей заявки (проверьте вручную, /admin_payments):\n" + "\n".join(lines) + more
+            )
+    
+    async def run(self):
+        """Background loop: poll, then sleep until the interval passes or someone wakes us."""
+        while True:
+            try:
+                stats = await self.poll_once()
+                if stats['deposits']:
+                    logger.info(
+                        f"💎 TON deposits: {stats['deposits']} new, {stats['credited']} credited, "
+                        f"{stats['unmatched']} unmatched"
+                    )
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ Error in TON deposit watcher: {e}", exc_info=True)
+            
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=TON_WATCHER_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+    
+    async def stop(self):
+        await self.client.close()
+
+
+def _watcher_enabled() -> bool:
+    # Автозачисление - только для явно настроенного кошелька на mainnet: иначе бесплатные
+    # testnet-переводы с подходящим memo зачислялись бы как настоящие TON
+    if not settings.TON_WATCHER_ENABLED:
+        return False
+    if not settings.TON_WALLET_ADDRESS:
+        logger.error("❌ TON_WATCHER_ENABLED is set but TON_WALLET_ADDRESS is empty, deposit watcher disabled")
+        return False
+    if 'testnet' in settings.TON_API_URL:
+        logger.error(f"❌ TON_WATCHER_ENABLED is set but TON_API_URL is a testnet endpoint ({settings.TON_API_URL}), deposit watcher disabled")
+        return False
+    return True
+
+
+deposit_watcher = DepositWatcher(
+    TonApiClient(settings.TON_API_URL, settings.TON_API_KEY),
+    TON_DEPOSIT_ADDRESS,
+    enabled=_watcher_enabled(),
+)
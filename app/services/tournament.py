@@ -0,0 +1,414 @@
+"""Weekly PvP tournament: registration, batched Swiss simulation, prizes."""
+import asyncio
+import logging
+import math
+import random
+from datetime import datetime, timedelta
+from sqlalchemy import select, update, insert, func, bindparam
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database.db import get_session
+from app.database.models import User, Bear, CoinTransaction, Tournament, TournamentEntry, TournamentMatch
+from app.services.leaderboard import leaderboards
+from app.services.notifications import notification_queue
+from app.services.pvp import bear_power_expr, pvp_matchmaker
+
+logger = logging.getLogger(__name__)
+
+# Tournament settings
+TOURNAMENT_ENTRY_FEE = 1000
+TOURNAMENT_HOUSE_CUT = 0.1  # Комиссия с взносов
+TOURNAMENT_MIN_PLAYERS = 4  # Меньше - турнир отменяется, взносы возвращаются
+TOURNAMENT_MAX_ROUNDS = 7
+TOURNAMENT_START_WEEKDAY = 6  # Воскресенье
+TOURNAMENT_START_HOUR = 18  # UTC
+TOURNAMENT_CHECK_INTERVAL = 60  # Секунд между проверками воркера
+TOURNAMENT_PAIR_LOOKAHEAD = 8  # Сколько соседей просматриваем, избегая повторных пар
+TOURNAMENT_PRIZE_SHARES = [0.4, 0.2, 0.12, 0.08, 0.05, 0.05, 0.04, 0.03, 0.02, 0.01]
+
+
+def tournament_week_start(now: datetime) -> datetime:
+    """Monday 00:00 UTC of the week containing now."""
+    day_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    return day_start - timedelta(days=day_start.weekday())
+
+
+def swiss_rounds(players_count: int) -> int:
+    """Number of Swiss rounds for a field: enough to separate a single winner."""
+    if players_count < 2:
+        return 0
+    return min(TOURNAMENT_MAX_ROUNDS, math.ceil(math.log2(players_count)))
+
+
+def prize_shares(players_count: int) -> list[float]:
+    """Prize pool shares by place, renormalized when fewer players than paid places."""
+    shares = TOURNAMENT_PRIZE_SHARES[:players_count]
+    total = sum(shares)
+    return [share / total for share in shares]
+
+
+def simulate_swiss(powers: dict[int, float], rounds: int, rng: random.Random = None) -> tuple[list[tuple], list[tuple]]:
+    """
+    Simulate a Swiss tournament in memory.
+    
+    Each round pairs players with equal or close scores (avoiding rematches
+    within a small lookahead), then resolves every match of the round in one
+    pass: P(win) = power / (power + opponent power), as in quick battles.
+    A bye goes to the lowest-ranked player who has not had one and counts as a win.
+    
+    Returns (matches, standings):
+    matches - (round, player1_id, player2_id or None, winner_id),
+    standings - (user_id, score, buchholz), best first.
+    """
+    rng = rng or random.Random()
+    scores = {user_id: 0 for user_id in powers}
+    opponents = {user_id: [] for user_id in powers}
+    had_bye = set()
+    matches = []
+    
+    for round_number in range(1, rounds + 1):
+        order = sorted(powers, key=lambda u: (-scores[u], -powers[u], u))
+        
+        if len(order) % 2:
+            bye_index = next((i for i in range(len(order) - 1, -1, -1) if order[i] not in had_bye), len(order) - 1)
+            bye = order.pop(bye_index)
+            had_bye.add(bye)
+            scores[bye] += 1
+            matches.append((round_number, bye, None, bye))
+        
+        # Пары: ближайший по таблице соперник, с которым ещё не играли
+        pairs = []
+        used = set()
+        for i, player in enumerate(order):
+            if player in used:
+                continue
+            used.add(player)
+            partner = fallback = None
+            checked = 0
+            for candidate in order[i + 1:i + 1 + TOURNAMENT_PAIR_LOOKAHEAD * 2]:
+                if candidate in used:
+                    continue
+                fallback = fallback or candidate
+                if candidate not in opponents[player]:
+                    partner = candidate
+                    break
+                checked += 1
+                if checked >= TOURNAMENT_PAIR_LOOKAHEAD:
+                    break
+            partner = partner or fallback
+            if partner is None:
+                partner = next(candidate for candidate in order[i + 1:] if candidate not in used)
+            used.add(partner)
+            pairs.append((player, partner))
+        
+        # Все бои раунда - одним проходом
+        draws = [rng.random() for _ in pairs]
+        for (player, partner), draw in zip(pairs, draws):
+            total_power = powers[player] + powers[partner]
+            win_chance = powers[player] / total_power if total_power > 0 else 0.5
+            winner = player if draw < win_chance else partner
+            scores[winner] += 1
+            opponents[player].append(partner)
+            opponents[partner].append(player)
+            matches.append((round_number, player, partner, winner))
+    
+    buchholz = {user_id: sum(scores[opponent] for opponent in opponents[user_id]) for user_id in powers}
+    standings = sorted(
+        ((user_id, scores[user_id], buchholz[user_id]) for user_id in powers),
+        key=lambda row: (-row[1], -row[2], -powers[row[0]], row[0])
+    )
+    return matches, standings
+
+
+class TournamentService:
+    """Weekly PvP tournament."""
+    
+    @staticmethod
+    async def get_current(session: AsyncSession) -> Tournament:
+        """Get (or create) this week's tournament."""
+        now = datetime.utcnow()
+        week_start = tournament_week_start(now)
+        registration_ends_at = week_start + timedelta(days=TOURNAMENT_START_WEEKDAY, hours=TOURNAMENT_START_HOUR)
+        
+        await session.execute(
+            pg_insert(Tournament)
+            .values(
+                week_start=week_start,
+                status='registration',
+                registration_ends_at=registration_ends_at,
+                entry_fee=TOURNAMENT_ENTRY_FEE,
+                prize_pool=0,
+                players_count=0,
+                rounds=0,
+                created_at=now,
+            )
+            .on_conflict_do_nothing(index_elements=['week_start'])
+        )
+        result = await session.execute(select(Tournament).where(Tournament.week_start == week_start))
+        return result.scalar_one()
+    
+    @staticmethod
+    async def get_entry(session: AsyncSession, tournament_id: int, user_id: int) -> TournamentEntry | None:
+        """Get user's entry in a tournament."""
+        result = await session.execute(
+            select(TournamentEntry).where(
+                TournamentEntry.tournament_id == tournament_id,
+                TournamentEntry.user_id == user_id,
+            )
+        )
+        return result.scalar_one_or_none()
+    
+    @staticmethod
+    async def get_last_finished(session: AsyncSession) -> Tournament | None:
+        """Most recent finished tournament."""
+        result = await session.execute(
+            select(Tournament)
+            .where(Tournament.status == 'finished')
+            .order_by(Tournament.week_start.desc())
+            .limit(1)
+        )
+        return result.scalar_one_or_none()
+    
+    @staticmethod
+    async def register(session: AsyncSession, user_id: int) -> TournamentEntry:
+        """Register user for this week's tournament and charge the entry fee."""
+        tournament = await TournamentService.get_current(session)
+        if tournament.status != 'registration' or datetime.utcnow() >= tournament.registration_ends_at:
+            raise ValueError("Регистрация на турнир закрыта")
+        
+        team_power = await session.scalar(
+            select(func.coalesce(func.sum(bear_power_expr()), 0)).where(Bear.owner_id == user_id)
+        )
+        if not team_power:
+            raise ValueError("У вас нет медведей для турнира!")
+        
+        fee = tournament.entry_fee
+        try:
+            async with session.begin_nested():
+                entry = TournamentEntry(tournament_id=tournament.id, user_id=user_id, team_power=float(team_power))
+                session.add(entry)
+                await session.flush()
+                
+                debit = await session.execute(
+                    update(User)
+                    .where(User.id == user_id, User.coins >= fee)
+                    .values(coins=User.coins - fee)
+                    .returning(User.coins)
+                    .execution_options(synchronize_session=False)
+                )
+                if debit.scalar_one_or_none() is None:
+                    raise ValueError(f"Недостаточно коинов! Взнос: {fee:,.0f}")
+        except IntegrityError:
+            raise ValueError("Вы уже зарегистрированы в турнире!")
+        
+        await session.execute(
+            update(Tournament)
+            .where(Tournament.id == tournament.id)
+            .values(
+                prize_pool=Tournament.prize_pool + fee * (1 - TOURNAMENT_HOUSE_CUT),
+                players_count=Tournament.players_count + 1,
+            )
+            .execution_options(synchronize_session=False)
+        )
+        session.add(CoinTransaction(
+            user_id=user_id,
+            amount=-fee,
+            transaction_type='tournament_fee',
+            description=f'Взнос за турнир недели {tournament.week_start:%d.%m}'
+        ))
+        await session.commit()
+        leaderboards.mark_dirty(user_id)
+        return entry
+    
+    @staticmethod
+    async def claim_due(session: AsyncSession) -> list[int]:
+        """Atomically move tournaments whose registration ended to 'running'."""
+        result = await session.execute(
+            update(Tournament)
+            .where(Tournament.status == 'registration', Tournament.registration_ends_at <= datetime.utcnow())
+            .values(status='running')
+            .returning(Tournament.id)
+            .execution_options(synchronize_session=False)
+        )
+        return list(result.scalars().all())
+    
+    @staticmethod
+    async def run_tournament(session: AsyncSession, tournament_id: int) -> dict:
+        """
+        Play a claimed tournament: one aggregate for team powers, in-memory
+        simulation, bulk writes for matches, standings, prizes and ledger.
+        Does not commit - the caller commits (a failure leaves it claimable again)
+        and only then sends result['notifications'] ((telegram_id, text) pairs).
+        """
+        tournament = await session.get(Tournament, tournament_id, populate_existing=True)
+        
+        result = await session.execute(
+            select(TournamentEntry.user_id, User.telegram_id)
+            .join(User, User.id == TournamentEntry.user_id)
+            .where(TournamentEntry.tournament_id == tournament_id)
+        )
+        telegram_ids = dict(result.all())
+        
+        if len(telegram_ids) < TOURNAMENT_MIN_PLAYERS:
+            return await TournamentService._cancel(session, tournament, telegram_ids)
+        
+        # Актуальная сила команд одним запросом
+        result = await session.execute(
+            select(Bear.owner_id, func.sum(bear_power_expr()))
+            .join(TournamentEntry, TournamentEntry.user_id == Bear.owner_id)
+            .where(TournamentEntry.tournament_id == tournament_id)
+            .group_by(Bear.owner_id)
+        )
+        powers = {user_id: 0.0 for user_id in telegram_ids}
+        powers.update({user_id: float(power) for user_id, power in result.all()})
+        
+        rounds = swiss_rounds(len(powers))
+        matches, standings = simulate_swiss(powers, rounds)
+        
+        now = datetime.utcnow()
+        await session.execute(insert(TournamentMatch), [
+            {
+                'tournament_id': tournament_id,
+                'round': round_number,
+                'player1_id': player1,
+                'player2_id': player2,
+                'winner_id': winner,
+                'created_at': now,
+            }
+            for round_number, player1, player2, winner in matches
+        ])
+        
+        shares = prize_shares(len(standings))
+        prizes = {
+            user_id: round(tournament.prize_pool * share, 2)
+            for (user_id, _, _), share in zip(standings, shares)
+        }
+        
+        entries = TournamentEntry.__table__
+        await session.execute(
+            update(entries)
+            .where(entries.c.tournament_id == tournament_id, entries.c.user_id == bindparam('b_user_id'))
+            .values(
+                team_power=bindparam('b_power'),
+                score=bindparam('b_score'),
+                place=bindparam('b_place'),
+                prize_coins=bindparam('b_prize'),
+            ),
+            [
+                {
+                    'b_user_id': user_id,
+                    'b_power': powers[user_id],
+                    'b_score': score,
+                    'b_place': place,
+                    'b_prize': prizes.get(user_id, 0),
+                }
+                for place, (user_id, score, _) in enumerate(standings, start=1)
+            ]
+        )
+        
+        await TournamentService._credit(
+            session, prizes, 'tournament_prize', f'Приз турнира недели {tournament.week_start:%d.%m}'
+        )
+        
+        tournament.status = 'finished'
+        tournament.rounds = rounds
+        tournament.finished_at = now
+        await session.flush()
+        
+        for user_id, power in powers.items():
+            if power:
+                pvp_matchmaker.update_power(user_id, power)
+        
+        # Уведомления отправит вызывающий после коммита
+        notifications = []
+        for place, (user_id, score, _) in enumerate(standings, start=1):
+            text = (
+                f"🏆 Турнир недели завершён!\n\n"
+                f"📍 Ваше место: {place} из {len(standings)}\n"
+                f"✅ Побед: {score} из {rounds}\n"
+            )
+            if prizes.get(user_id):
+                text += f"💰 Приз: +{prizes[user_id]:,.0f} коинов"
+            notifications.append((telegram_ids[user_id], text))
+        
+        logger.info(
+            f"🏆 Tournament {tournament_id} finished: {len(standings)} players, "
+            f"{rounds} rounds, {len(matches)} matches"
+        )
+        return {
+            'players': len(standings),
+            'rounds': rounds,
+            'matches': len(matches),
+            'prizes': prizes,
+            'notifications': notifications,
+        }
+    
+    @staticmethod
+    async def _cancel(session: AsyncSession, tournament: Tournament, telegram_ids: dict[int, int]) -> dict:
+        """Cancel a tournament with too few players and refund entry fees."""
+        refunds = {user_id: tournament.entry_fee for user_id in telegram_ids}
+        await TournamentService._credit(
+            session, refunds, 'tournament_refund', f'Возврат взноса: турнир недели {tournament.week_start:%d.%m} отменён'
+        )
+        tournament.status = 'cancelled'
+        tournament.finished_at = datetime.utcnow()
+        await session.flush()
+        
+        text = f"😔 Турнир недели отменён - мало участников.\n💰 Взнос {tournament.entry_fee:,.0f} коинов возвращён."
+        logger.info(f"🏆 Tournament {tournament.id} cancelled: {len(telegram_ids)} players")
+        return {
+            'players': len(telegram_ids),
+            'rounds': 0,
+            'matches': 0,
+            'prizes': {},
+            'notifications': [(telegram_id, text) for telegram_id in telegram_ids.values()],
+        }
+    
+    @staticmethod
+    async def _credit(session: AsyncSession, amounts: dict[int, float], transaction_type: str, description: str):
+        """Credit coins to many users with one executemany UPDATE and one ledger INSERT."""
+        amounts = {user_id: amount for user_id, amount in amounts.items() if amount > 0}
+        if not amounts:
+            return
+        
+        users = User.__table__
+        await session.execute(
+            update(users)
+            .where(users.c.id == bindparam('b_user_id'))
+            .values(coins=users.c.coins + bindparam('b_amount')),
+            [{'b_user_id': user_id, 'b_amount': amount} for user_id, amount in amounts.items()]
+        )
+        now = datetime.utcnow()
+        await session.execute(insert(CoinTransaction), [
+            {
+                'user_id': user_id,
+                'amount': amount,
+                'transaction_type': transaction_type,
+                'description': description,
+                'created_at': now,
+            }
+            for user_id, amount in amounts.items()
+        ])
+        leaderboards.mark_dirty(*amounts)
+
+
+async def tournament_worker():
+    """Background loop: keep this week's tournament open and play tournaments that are due."""
+    while True:
+        try:
+            notifications = []
+            async with get_session() as session:
+                for tournament_id in await TournamentService.claim_due(session):
+                    result = await TournamentService.run_tournament(session, tournament_id)
+                    notifications.extend(result['notifications'])
+                await session.commit()
+                # Итоги и возвраты - только после коммита начислений
+                for telegram_id, text in notifications:
+                    notification_queue.enqueue(telegram_id, text)
+                await TournamentService.get_current(session)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"❌ Error in tournament worker: {e}", exc_info=True)
+        await asyncio.sleep(TOURNAMENT_CHECK_INTERVAL)
@@ -0,0 +1,372 @@
+"""Permanent upgrades: config, costs and a cached per-user modifier vector."""
+import logging
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from sqlalchemy import select, func, event, inspect
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from app.database.models import User, UserUpgrade, CoinTransaction
+
+logger = logging.getLogger(__name__)
+
+MODIFIERS_CACHE_TTL = timedelta(minutes=10)  # Страховка на случай записи из другого процесса
+MODIFIERS_CACHE_SIZE = 50000
+MAX_SHOP_DISCOUNT = 0.5
+MAX_COMMISSION_REDUCE = 1.0
+
+# Конфигурация улучшений
+UPGRADES_CONFIG = {
+    # 👤 ПРОФИЛЬ
+    'bear_slots': {
+        'name': '📦 Слоты для медведей',
+        'category': 'profile',
+        'emoji': '📦',
+        'description': 'Увеличивает количество мест для медведей',
+        'max_level': 10,
+        'base_cost': 5000,
+        'cost_multiplier': 1.8,
+        'effect_per_level': 2,  # +2 слота за уровень
+        'effect_type': 'flat',
+        'base_value': 10,  # Начальное значение без улучшений
+    },
+    'income_multiplier': {
+        'name': '💰 Множитель дохода',
+        'category': 'profile',
+        'emoji': '💰',
+        'description': 'Увеличивает весь доход от медведей',
+        'max_level': 15,
+        'base_cost': 10000,
+        'cost_multiplier': 2.0,
+        'effect_per_level': 5,  # +5% за уровень
+        'effect_type': 'percent',
+        'base_value': 0,
+    },
+    'auto_collect': {
+        'name': '⚡ Автосбор монет',
+        'category': 'profile',
+        'emoji': '⚡',
+        'description': 'Автоматически собирает монеты каждые N часов',
+        'max_level': 5,
+        'base_cost': 50000,
+        'cost_multiplier': 2.5,
+        'effect_per_level': -2,  # -2 часа за уровень (с 24 до 14 часов)
+        'effect_type': 'time',
+        'base_value': 24,  # 24 часа изначально
+    },
+    'case_bonus': {
+        'name': '🎁 Бонус к кейсам',
+        'category': 'profile',
+        'emoji': '🎁',
+        'description': 'Увеличивает награды из кейсов',
+        'max_level': 10,
+        'base_cost': 20000,
+        'cost_multiplier': 2.0,
+        'effect_per_level': 10,  # +10% за уровень
+        'effect_type': 'percent',
+        'base_value': 0,
+    },
+    'referral_bonus': {
+        'name': '👥 Реферальный бонус',
+        'category': 'profile',
+        'emoji': '👥',
+        'description': 'Увеличивает доход с рефералов',
+        'max_level': 10,
+        'base_cost': 15000,
+        'cost_multiplier': 2.2,
+        'effect_per_level': 5,  # +5% за уровень
+        'effect_type': 'percent',
+        'base_value': 0,
+    },
+    'rare_chance': {
+        'name': '🍀 Шанс редкости',
+        'category': 'profile',
+        'emoji': '🍀',
+        'description': 'Увеличивает шанс редких медведей',
+        'max_level': 8,
+        'base_cost': 30000,
+        'cost_multiplier': 2.5,
+        'effect_per_level': 5,  # +5% за уровень
+        'effect_type': 'percent',
+        'base_value': 0,
+    },
+    
+    # 🏭 ПРОИЗВОДСТВО
+    'production_speed': {
+        'name': '⏰ Скорость производства',
+        'category': 'production',
+        'emoji': '⏰',
+        'description': 'Медведи производят монеты быстрее',
+        'max_level': 12,
+        'base_cost': 8000,
+        'cost_multiplier': 1.9,
+        'effect_per_level': 10,  # +10% за уровень
+        'effect_type': 'percent',
+        'base_value': 0,
+    },
+    'coin_quality': {
+        'name': '💎 Качество монет',
+        'category': 'production',
+        'emoji': '💎',
+        'description': 'Больше монет за каждый сбор',
+        'max_level': 10,
+        'base_cost': 12000,
+        'cost_multiplier': 2.1,
+        'effect_per_level': 15,  # +15% за уровень
+        'effect_type': 'percent',
+        'base_value': 0,
+    },
+    'auto_reinvest': {
+        'name': '🔄 Авто-реинвест',
+        'category': 'production',
+        'emoji': '🔄',
+        'description': 'Автоматически покупает новых медведей',
+        'max_level': 3,
+        'base_cost': 100000,
+        'cost_multiplier': 3.0,
+        'effect_per_level': 1,  # Уровни: выкл, обычные, редкие, эпические
+        'effect_type': 'tier',
+        'base_value': 0,
+    },
+    
+    # 💼 БИЗНЕС
+    'shop_discount': {
+        'name': '🏪 Скидка в магазине',
+        'category': 'business',
+        'emoji': '🏪',
+        'description': 'Скидка на покупки в магазине',
+        'max_level': 10,
+        'base_cost': 15000,
+        'cost_multiplier': 2.0,
+        'effect_per_level': 3,  # +3% за уровень
+        'effect_type': 'percent',
+        'base_value': 0,
+    },
+    'exchange_rate': {
+        'name': '💱 Курс обмена',
+        'category': 'business',
+        'emoji': '💱',
+        'description': 'Лучший курс обмена монет на TON',
+        'max_level': 8,
+        'base_cost': 25000,
+        'cost_multiplier': 2.3,
+        'effect_per_level': 5,  # +5% за уровень
+        'effect_type': 'percent',
+        'base_value': 0,
+    },
+    'commission_reduce': {
+        'name': '📉 Снижение комиссий',
+        'category': 'business',
+        'emoji': '📉',
+        'description': 'Уменьшает комиссии за все операции',
+        'max_level': 10,
+        'base_cost': 20000,
+        'cost_multiplier': 2.2,
+        'effect_per_level': 5,  # -5% за уровень
+        'effect_type': 'percent',
+        'base_value': 0,
+    },
+}
+
+
+def calculate_upgrade_cost(upgrade_type: str, current_level: int) -> int:
+    """Рассчитать стоимость следующего уровня улучшения."""
+    config = UPGRADES_CONFIG[upgrade_type]
+    cost = config['base_cost'] * (config['cost_multiplier'] ** current_level)
+    return int(cost)
+
+
+def calculate_upgrade_effect(upgrade_type: str, level: int) -> float:
+    """Рассчитать эффект улучшения на определенном уровне."""
+    config = UPGRADES_CONFIG[upgrade_type]
+    if config['effect_type'] == 'percent':
+        return config['effect_per_level'] * level
+    elif config['effect_type'] == 'flat':
+        return config['base_value'] + (config['effect_per_level'] * level)
+    elif config['effect_type'] == 'time':
+        return max(2, config['base_value'] + (config['effect_per_level'] * level))  # Минимум 2 часа
+    elif config['effect_type'] == 'tier':
+        return level
+    return 0
+
+
+UPGRADE_TYPES = tuple(UPGRADES_CONFIG)
+_UPGRADE_INDEX = {upgrade_type: i for i, upgrade_type in enumerate(UPGRADE_TYPES)}
+
+
+class UpgradeModifiers:
+    """
+    Effective gameplay modifiers of one user, derived from upgrade levels.
+    
+    Multipliers are applied as value * multiplier at the point of use.
+    """
+    __slots__ = (
+        'levels', 'income_multiplier', 'case_reward_multiplier', 'shop_price_multiplier',
+        'exchange_rate_multiplier', 'commission_multiplier', 'bear_slots',
+        'auto_collect_hours', 'auto_reinvest_tier',
+    )
+    
+    def __init__(self, levels: tuple[int, ...]):
+        self.levels = levels
+        
+        def effect(upgrade_type: str) -> float:
+            return calculate_upgrade_effect(upgrade_type, levels[_UPGRADE_INDEX[upgrade_type]])
+        
+        # Доход: множитель дохода, скорость производства и качество монет складываются мультипликативно
+        self.income_multiplier = (
+            (1 + effect('income_multiplier') / 100)
+            * (1 + effect('production_speed') / 100)
+            * (1 + effect('coin_quality') / 100)
+        )
+        self.case_reward_multiplier = 1 + effect('case_bonus') / 100
+        self.shop_price_multiplier = 1 - min(effect('shop_discount') / 100, MAX_SHOP_DISCOUNT)
+        self.exchange_rate_multiplier = 1 + effect('exchange_rate') / 100
+        self.commission_multiplier = 1 - min(effect('commission_reduce') / 100, MAX_COMMISSION_REDUCE)
+        self.bear_slots = int(effect('bear_slots'))
+        self.auto_collect_hours = int(effect('auto_collect'))
+        self.auto_reinvest_tier = int(effect('auto_reinvest'))
+    
+    def level(self, upgrade_type: str) -> int:
+        """Current level of an upgrade (0 if never bought)."""
+        return self.levels[_UPGRADE_INDEX[upgrade_type]]
+
+
+BASE_MODIFIERS = UpgradeModifiers((0,) * len(UPGRADE_TYPES))
+
+
+class UpgradesService:
+    """
+    Upgrade levels and modifiers.
+    
+    All levels of a user are read with one query; missing rows mean level 0
+    and are not created until the first purchase. The resulting modifier
+    vector is cached in-process and dropped when a transaction that changed
+    the user's UserUpgrade rows commits (and after MODIFIERS_CACHE_TTL).
+    """
+    
+    _cache: OrderedDict = OrderedDict()
+    
+    @staticmethod
+    def invalidate(*user_ids: int):
+        """Drop cached modifiers of these users."""
+        for user_id in user_ids:
+            UpgradesService._cache.pop(user_id, None)
+    
+    @staticmethod
+    async def _load_levels(session: AsyncSession, user_id: int) -> tuple[int, ...]:
+        result = await session.execute(
+            select(UserUpgrade.upgrade_type, func.max(UserUpgrade.current_level))
+            .where(UserUpgrade.user_id == user_id)
+            .group_by(UserUpgrade.upgrade_type)
+        )
+        levels = [0] * len(UPGRADE_TYPES)
+        for upgrade_type, level in result.all():
+            if upgrade_type in _UPGRADE_INDEX:
+                levels[_UPGRADE_INDEX[upgrade_type]] = level or 0
+        return tuple(levels)
+    
+    @staticmethod
+    async def get_modifiers(session: AsyncSession, user_id: int) -> UpgradeModifiers:
+        """Modifier vector of a user (internal id), cached."""
+        cache = UpgradesService._cache
+        now = datetime.utcnow()
+        entry = cache.get(user_id)
+        if entry is not None and now - entry[0] < MODIFIERS_CACHE_TTL:
+            cache.move_to_end(user_id)
+            return entry[1]
+        
+        levels = await UpgradesService._load_levels(session, user_id)
+        modifiers = BASE_MODIFIERS if not any(levels) else UpgradeModifiers(levels)
+        cache[user_id] = (now, modifiers)
+        cache.move_to_end(user_id)
+        while len(cache) > MODIFIERS_CACHE_SIZE:
+            cache.popitem(last=False)
+        return modifiers
+    
+    @staticmethod
+    async def buy_upgrade(session: AsyncSession, user_id: int, upgrade_type: str) -> int:
+        """
+        Buy the next level of an upgrade. Returns the new level.
+        
+        The user row is locked so concurrent purchases of the same user are
+        serialized (and the first purchase creates exactly one row). Only
+        flushes - the caller commits.
+        """
+        config = UPGRADES_CONFIG.get(upgrade_type)
+        if config is None:
+            raise ValueError("Неизвестное улучшение")
+        
+        result = await session.execute(
+            select(User).where(User.id == user_id)
+            .with_for_update()
+            .execution_options(populate_existing=True)
+        )
+        user = result.scalar_one_or_none()
+        if user is None:
+            raise ValueError("Пользователь не найден")
+        
+        result = await session.execute(
+            select(UserUpgrade).where(
+                UserUpgrade.user_id == user_id,
+                UserUpgrade.upgrade_type == upgrade_type
+            ).order_by(UserUpgrade.current_level.desc()).limit(1)
+        )
+        upgrade = result.scalar_one_or_none()
+        current_level = upgrade.current_level if upgrade else 0
+        
+        if current_level >= config['max_level']:
+            raise ValueError("Это улучшение уже на максимальном уровне!")
+        
+        cost = calculate_upgrade_cost(upgrade_type, current_level)
+        if user.coins < cost:
+            raise ValueError(f"Недостаточно монет! Нужно: {cost:,.0f}, у вас: {user.coins:,.0f}")
+        
+        user.coins -= cost
+        if upgrade is None:
+            upgrade = UserUpgrade(
+                user_id=user_id,
+                upgrade_type=upgrade_type,
+                current_level=1,
+                max_level=config['max_level']
+            )
+            session.add(upgrade)
+        else:
+            upgrade.current_level = current_level + 1
+            upgrade.updated_at = datetime.utcnow()
+        
+        # Автосбор: ставим пользователя в расписание воркера (или сокращаем интервал)
+        if upgrade_type == 'auto_collect':
+            user.last_auto_collect_at = user.last_auto_collect_at or datetime.utcnow()
+            interval_hours = calculate_upgrade_effect(upgrade_type, current_level + 1)
+            user.next_auto_collect_at = user.last_auto_collect_at + timedelta(hours=interval_hours)
+        
+        session.add(CoinTransaction(
+            user_id=user_id,
+            amount=-cost,
+            transaction_type='upgrade',
+            description=f"Улучшение: {config['name']} до уровня {current_level + 1}"
+        ))
+        await session.flush()
+        return current_level + 1
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_changed_upgrades(session, flush_context):
+    """Remember users whose upgrade rows were written in this transaction."""
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, UserUpgrade):
+            user_id = inspect(obj).dict.get('user_id')
+            if user_id is not None:
+                session.info.setdefault('upgrades_changed', set()).add(user_id)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_changed_upgrades(session):
+    """Drop cached modifiers once the new levels are visible to other sessions."""
+    user_ids = session.info.pop('upgrades_changed', None)
+    if user_ids:
+        UpgradesService.invalidate(*user_ids)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_changed_upgrades(session):
+    session.info.pop('upgrades_changed', None)
@@ -0,0 +1,348 @@
+"""Withdrawal pipeline: pending payouts are claimed in batches, sent as batched TON transfers and confirmed by tx_hash."""
+import asyncio
+import hashlib
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta
+from uuid import uuid4
+from sqlalchemy import select, update, values, column, text, Integer, Float
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database.db import get_session
+from app.database.models import User, Withdrawal
+from app.services.ledger import ledger
+from app.services.notifications import notification_queue
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+WITHDRAW_WORKER_INTERVAL = 30  # Секунд между проходами
+WITHDRAW_BATCHES_PER_PASS = 25  # Переводов за один проход
+WITHDRAW_SEND_TIMEOUT = timedelta(minutes=10)  # Пачка без tx_hash дольше этого - отправляем повторно (тот же batch_id)
+WITHDRAW_CHECK_LEASE = timedelta(seconds=60)  # На это время проверка забирается одним воркером
+WITHDRAW_CHECK_LIMIT = 500  # Выплат на одну проверку подтверждений
+WITHDRAW_CONFIRM_BASE_DELAY = 10  # Секунд до первой проверки, дальше удваивается
+WITHDRAW_CONFIRM_MAX_DELAY = 3600
+WITHDRAW_CONFIRM_WARN_ATTEMPTS = 12  # После стольких проверок без ответа - предупреждение в лог
+
+
+class TonSender:
+    """
+    Payout backend interface.
+    
+    send_batch must be idempotent per batch_id: after a crash the pipeline
+    re-sends a batch that has no tx_hash yet with the same id and the same
+    transfers, and that must not pay twice (derive the wallet seqno /
+    query_id from batch_id).
+    """
+    
+    max_messages = 4  # Исходящих сообщений в одном переводе (wallet v4)
+    
+    async def send_batch(self, batch_id: str, transfers: list[tuple[int, str, float]]) -> str:
+        """Send (withdrawal_id, address, ton_amount) transfers as one transaction; returns its tx_hash."""
+        raise NotImplementedError
+    
+    async def get_status(self, tx_hash: str) -> str:
+        """'pending', 'confirmed' or 'failed'."""
+        raise NotImplementedError
+    
+    async def close(self):
+        pass
+
+
+class StubTonSender(TonSender):
+    """
+    Local stand-in for tests: keeps transfers in memory and confirms them
+    after `confirm_after` status checks. Never sends anything, so it is not
+    in TON_SENDERS - build WithdrawalPipeline(StubTonSender()) directly.
+    """
+    
+    max_messages = 255
+    
+    def __init__(self, confirm_after: int = 1, fail_batches: set = None):
+        self.confirm_after = confirm_after
+        self.fail_batches = fail_batches or set()
+        self.sent: dict[str, tuple[str, list]] = {}
+        self._batches: dict[str, str] = {}
+        self._checks: dict[str, int] = defaultdict(int)
+    
+    async def send_batch(self, batch_id: str, transfers: list[tuple[int, str, float]]) -> str:
+        if batch_id not in self.sent:
+            tx_hash = hashlib.sha256(batch_id.encode()).hexdigest()
+            self.sent[batch_id] = (tx_hash, list(transfers))
+            self._batches[tx_hash] = batch_id
+        return self.sent[batch_id][0]
+    
+    async def get_status(self, tx_hash: str) -> str:
+        if self._batches.get(tx_hash) in self.fail_batches:
+            return 'failed'
+        self._checks[tx_hash] += 1
+        return 'confirmed' if self._checks[tx_hash] >= self.confirm_after else 'pending'
+
+
+# Отправители, выбираемые через TON_WITHDRAW_SENDER; только настоящие кошельки
+TON_SENDERS: dict[str, type[TonSender]] = {}
+
+
+def _confirm_delay(attempts: int) -> timedelta:
+    return timedelta(seconds=min(WITHDRAW_CONFIRM_BASE_DELAY * 2 ** attempts, WITHDRAW_CONFIRM_MAX_DELAY))
+
+
+class WithdrawalPipeline:
+    """
+    Drains the withdrawals queue: pending -> processing -> completed / failed.
+    
+    A batch of up to sender.max_messages pending withdrawals is claimed with
+    one UPDATE ... WHERE id IN (SELECT ... FOR UPDATE SKIP LOCKED) that sets
+    status='processing' and a fresh batch_id, and is committed before
+    anything is sent, so several worker processes never claim the same row.
+    The batch is then sent as one transfer and its tx_hash recorded. A batch
+    left without tx_hash (crash, sender error) is re-sent with the same
+    batch_id after WITHDRAW_SEND_TIMEOUT, under an advisory lock per batch.
+    Confirmations are polled per tx_hash with exponential backoff
+    (next_check_at); failed transfers refund the coins.
+    """
+    
+    def __init__(self, sender: TonSender | None):
+        self.sender = sender
+    
+    @property
+    def enabled(self) -> bool:
+        return self.sender is not None
+    
+    # ============ ОТПРАВКА ============
+    
+    @staticmethod
+    async def claim_batch(session: AsyncSession, limit: int, now: datetime = None) -> tuple[str, list]:
+        """Move up to `limit` oldest pending withdrawals to processing under a new batch_id. Only executes."""
+        now = now or datetime.utcnow()
+        batch_id = uuid4().hex
+        due = (
+            select(Withdrawal.id)
+            .where(Withdrawal.status == 'pending')
+            .order_by(Withdrawal.created_at)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+            .cte('due')
+        )
+        result = await session.execute(
+            update(Withdrawal)
+            .where(Withdrawal.id == due.c.id)
+            .values(status='processing', batch_id=batch_id, claimed_at=now)
+            .returning(Withdrawal.id, Withdrawal.wallet_address, Withdrawal.amount_crypto)
+            .execution_options(synchronize_session=False)
+        )
+        return batch_id, [tuple(row) for row in result.all()]
+    
+    @staticmethod
+    async def claim_stale_batch(session: AsyncSession, batch_id: str, now: datetime = None) -> list:
+        """Re-claim a batch that was never confirmed as sent; [] if another worker has it. Only executes."""
+        now = now or datetime.utcnow()
+        locked = await session.execute(text('SELECT pg_try_advisory_xact_lock(hashtext(:batch_id))'), {'batch_id': batch_id})
+        if not locked.scalar():
+            return []
+        result = await session.execute(
+            update(Withdrawal)
+            .where(
+                Withdrawal.batch_id == batch_id,
+                Withdrawal.status == 'processing',
+                Withdrawal.tx_hash.is_(None),
+                Withdrawal.claimed_at < now - WITHDRAW_SEND_TIMEOUT,
+            )
+            .values(claimed_at=now)
+            .returning(Withdrawal.id, Withdrawal.wallet_address, Withdrawal.amount_crypto)
+            .execution_options(synchronize_session=False)
+        )
+        return [tuple(row) for row in result.all()]
+    
+    async def send(self, batch_id: str, transfers: list, now: datetime = None) -> str | None:
+        """Send a claimed batch and record its tx_hash; None if the sender failed (retried after the timeout)."""
+        now = now or datetime.utcnow()
+        try:
+            tx_hash = await self.sender.send_batch(batch_id, transfers)
+        except Exception as e:
+            logger.error(f"❌ Withdrawal batch {batch_id} ({len(transfers)} transfers) not sent: {e}", exc_info=True)
+            return None
+        
+        async with get_session() as session:
+            await session.execute(
+                update(Withdrawal)
+                .where(Withdrawal.batch_id == batch_id, Withdrawal.status == 'processing')
+                .values(tx_hash=tx_hash, check_attempts=0, next_check_at=now + _confirm_delay(0))
+                .execution_options(synchronize_session=False)
+            )
+        return tx_hash
+    
+    # ============ ПОДТВЕРЖДЕНИЕ ============
+    
+    async def check_confirmations(self, now: datetime = None) -> dict[str, int]:
+        """Poll due tx hashes once; returns counts of completed / failed withdrawals."""
+        now = now or datetime.utcnow()
+        counts = {'completed': 0, 'failed': 0}
+        
+        async with get_session() as session:
+            due = (
+                select(Withdrawal.id)
+                .where(
+                    Withdrawal.status == 'processing',
+                    Withdrawal.tx_hash.is_not(None),
+                    Withdrawal.next_check_at <= now,
+                )
+                .order_by(Withdrawal.next_check_at)
+                .limit(WITHDRAW_CHECK_LIMIT)
+                .with_for_update(skip_locked=True)
+                .cte('due')
+            )
+            result = await session.execute(
+                update(Withdrawal)
+                .where(Withdrawal.id == due.c.id)
+                .values(next_check_at=now + WITHDRAW_CHECK_LEASE)
+                .returning(Withdrawal.tx_hash, Withdrawal.check_attempts)
+                .execution_options(synchronize_session=False)
+            )
+            attempts = {tx_hash: check_attempts for tx_hash, check_attempts in result.all()}
+        
+        for tx_hash, check_attempts in attempts.items():
+            try:
+                status = await self.sender.get_status(tx_hash)
+            except Exception as e:
+                logger.warning(f"⚠️ Could not check withdrawal tx {tx_hash}: {e}")
+                continue
+            
+            async with get_session() as session:
+                if status == 'confirmed':
+                    rows = await self._finish(session, tx_hash, 'completed', now)
+                    counts['completed'] += len(rows)
+                elif status == 'failed':
+                    rows = await self._finish(session, tx_hash, 'failed', now)
+                    await self._refund(session, rows)
+                    counts['failed'] += len(rows)
+                else:
+                    if check_attempts + 1 == WITHDRAW_CONFIRM_WARN_ATTEMPTS:
+                        logger.warning(f"⚠️ Withdrawal tx {tx_hash} still unconfirmed after {check_attempts + 1} checks")
+                    await session.execute(
+                        update(Withdrawal)
+                        .where(Withdrawal.tx_hash == tx_hash, Withdrawal.status == 'processing')
+                        .values(check_attempts=check_attempts + 1, next_check_at=now + _confirm_delay(check_attempts + 1))
+                        .execution_options(synchronize_session=False)
+                    )
+                    continue
+                telegram_ids = await self._telegram_ids(session, {user_id for user_id, _, _ in rows})
+            self._notify(status, rows, telegram_ids)
+        return counts
+    
+    @staticmethod
+    async def _finish(session: AsyncSession, tx_hash: str, status: str, now: datetime) -> list:
+        result = await session.execute(
+            update(Withdrawal)
+            .where(Withdrawal.tx_hash == tx_hash, Withdrawal.status == 'processing')
+            .values(status=status, completed_at=now)
+            .returning(Withdrawal.user_id, Withdrawal.amount_coins, Withdrawal.amount_crypto)
+            .execution_options(synchronize_session=False)
+        )
+        return result.all()
+    
+    @staticmethod
+    async def _refund(session: AsyncSession, rows: list):
+        """Return the coins of failed withdrawals (one UPDATE ... FROM VALUES + one ledger INSERT)."""
+        if not rows:
+            return
+        refunds = defaultdict(float)
+        for user_id, amount_coins, _ in rows:
+            refunds[user_id] += amount_coins
+        refund_rows = values(column('user_id', Integer), column('amount', Float), name='refunds').data(list(refunds.items()))
+        await session.execute(
+            update(User)
+            .where(User.id == refund_rows.c.user_id)
+            .values(coins=User.coins + refund_rows.c.amount)
+            .execution_options(synchronize_session=False)
+        )
+        await ledger.write(session, [
+            (user_id, amount_coins, 'withdraw_refund', f'Возврат: вывод {amount_crypto:.4f} TON не прошёл')
+            for user_id, amount_coins, amount_crypto in rows
+        ])
+    
+    @staticmethod
+    async def _telegram_ids(session: AsyncSession, user_ids: set) -> dict[int, int]:
+        result = await session.execute(select(User.id, User.telegram_id).where(User.id.in_(user_ids)))
+        return dict(result.all())
+    
+    @staticmethod
+    def _notify(status: str, rows: list, telegram_ids: dict):
+        for user_id, amount_coins, amount_crypto in rows:
+            if status == 'completed':
+                text = f"✅ Вывод {amount_crypto:.4f} TON выполнен!"
+            else:
+                text = f"❌ Вывод {amount_crypto:.4f} TON не прошёл.\n\n🪙 {amount_coins:,.0f} коинов возвращены на баланс."
+            notification_queue.enqueue(telegram_ids[user_id], text)
+    
+    # ============ ВОРКЕР ============
+    
+    async def run_once(self, now: datetime = None) -> dict:
+        """One pass: re-send stale batches, send new batches, poll confirmations."""
+        now = now or datetime.utcnow()
+        stats = {'batches': 0, 'sent': 0, 'completed': 0, 'failed': 0}
+        
+        async with get_session() as session:
+            result = await session.execute(
+                select(Withdrawal.batch_id)
+                .where(
+                    Withdrawal.status == 'processing',
+                    Withdrawal.tx_hash.is_(None),
+                    Withdrawal.claimed_at < now - WITHDRAW_SEND_TIMEOUT,
+                )
+                .distinct()
+                .limit(WITHDRAW_BATCHES_PER_PASS)
+            )
+            stale = result.scalars().all()
+        for batch_id in stale:
+            async with get_session() as session:
+                transfers = await self.claim_stale_batch(session, batch_id, now)
+            if transfers and await self.send(batch_id, transfers, now):
+                logger.warning(f"⚠️ Re-sent stale withdrawal batch {batch_id} ({len(transfers)} transfers)")
+                stats['batches'] += 1
+                stats['sent'] += len(transfers)
+        
+        for _ in range(WITHDRAW_BATCHES_PER_PASS):
+            async with get_session() as session:
+                batch_id, transfers = await self.claim_batch(session, self.sender.max_messages, now)
+            if not transfers:
+                break
+            if await self.send(batch_id, transfers, now):
+                stats['batches'] += 1
+                stats['sent'] += len(transfers)
+        
+        stats.update(await self.check_confirmations(now))
+        return stats
+    
+    async def run(self):
+        """Background loop over run_once."""
+        while True:
+            try:
+                stats = await self.run_once()
+                if any(stats.values()):
+                    logger.info(
+                        f"💸 Withdrawals: sent {stats['sent']} in {stats['batches']} batches, "
+                        f"completed {stats['completed']}, failed {stats['failed']}"
+                    )
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ Error in withdrawal pipeline: {e}", exc_info=True)
+            await asyncio.sleep(WITHDRAW_WORKER_INTERVAL)
+    
+    async def stop(self):
+        if self.sender is not None:
+            await self.sender.close()
+
+
+def _configured_sender() -> TonSender | None:
+    name = settings.TON_WITHDRAW_SENDER
+    if not name:
+        return None
+    if name not in TON_SENDERS:
+        logger.error(f"❌ Unknown TON_WITHDRAW_SENDER '{name}', withdrawals will not be processed")
+        return None
+    return TON_SENDERS[name]()
+
+
+withdrawal_pipeline = WithdrawalPipeline(_configured_sender())
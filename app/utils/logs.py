@@ -0,0 +1,135 @@
+"""Non-blocking structured logging: QueueHandler on the event loop, formatting and I/O in a listener thread."""
+import atexit
+import copy
+import json
+import logging
+import queue
+import random
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from pathlib import Path
+
+TEXT_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+# Поля текущего апдейта (update_id, user_id, handler); ставит LoggingMiddleware
+log_context: ContextVar[dict] = ContextVar('log_context', default={})
+
+# Атрибуты любой LogRecord - всё остальное пришло через extra= и попадает в JSON
+_RECORD_ATTRS = set(logging.makeLogRecord({}).__dict__) | {'message', 'asctime', 'taskName'}
+
+
+def parse_sampling(spec: str) -> dict[str, float]:
+    """'callback=0.1,message=0.5' -> {'callback': 0.1, 'message': 0.5}; raises ValueError."""
+    rates = {}
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        category, _, rate = item.partition('=')
+        rate = float(rate)
+        if not 0 <= rate <= 1:
+            raise ValueError(f"Sampling rate for '{category}' must be within [0, 1], got {rate}")
+        rates[category.strip()] = rate
+    return rates
+
+
+class ContextFilter(logging.Filter):
+    """Copies log_context onto the record while still on the emitting task."""
+    
+    def filter(self, record: logging.LogRecord) -> bool:
+        for key, value in log_context.get().items():
+            if not hasattr(record, key):
+                setattr(record, key, value)
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps a `rate` share of records of each category (extra={'category': ...}).
+    Records without a category and WARNING or above are always kept; kept
+    sampled records carry sample_rate so counts can be scaled back up.
+    """
+    
+    def __init__(self, rates: dict[str, float]):
+        super().__init__()
+        self.rates = rates
+        self.dropped: dict[str, int] = {}
+    
+    def filter(self, record: logging.LogRecord) -> bool:
+        rate = self.rates.get(getattr(record, 'category', None))
+        if rate is None or rate >= 1 or record.levelno >= logging.WARNING:
+            return True
+        if random.random() >= rate:
+            self.dropped[record.category] = self.dropped.get(record.category, 0) + 1
+            return False
+        record.sample_rate = rate
+        return True
+
+
+class StructuredQueueHandler(QueueHandler):
+    """
+    QueueHandler that only merges the message and renders the traceback
+    to text before enqueueing (args and exc_info may not be picklable or
+    may change later); extra fields stay on the record for the formatter.
+    """
+    
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg, record.args = record.message, None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, logger, msg, context and extra fields, exc."""
+    
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and value is not None:
+                data[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data['exc'] = record.exc_text
+        if record.stack_info:
+            data['stack'] = record.stack_info
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+def setup_logging(level: str, log_file: Path | None, fmt: str = 'json', sampling: str = '') -> QueueListener:
+    """
+    Route the root logger through an unbounded queue: the event loop only
+    copies the record and enqueues it, a QueueListener thread formats and
+    writes to stderr and `log_file`. The listener is stopped (queue
+    drained) at interpreter exit.
+    """
+    formatter = JsonFormatter() if fmt == 'json' else logging.Formatter(TEXT_FORMAT)
+    handlers = [logging.StreamHandler()]
+    if log_file is not None:
+        handlers.append(logging.FileHandler(log_file, encoding='utf-8'))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    
+    log_queue = queue.SimpleQueue()
+    queue_handler = StructuredQueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(parse_sampling(sampling)))
+    queue_handler.addFilter(ContextFilter())
+    
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+        handler.close()
+    root.addHandler(queue_handler)
+    root.setLevel(getattr(logging, level.upper(), logging.INFO))
+    
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
@@ -0,0 +1,131 @@
+"""Indexable skiplist - sorted set with O(log n) insert, remove, rank and index lookup."""
+import random
+
+MAX_LEVEL = 32
+
+
+class _Node:
+    """Skiplist node: key plus per-level forward links and link widths."""
+    __slots__ = ('key', 'next', 'width')
+
+    def __init__(self, key, level: int):
+        self.key = key
+        self.next = [None] * level
+        self.width = [1] * level
+
+
+class IndexableSkipList:
+    """
+    Order-statistic set of unique, comparable keys.
+
+    Each link stores how many bottom-level steps it skips, so position lookups
+    (rank of a key, key at position i) are O(log n) like insert and remove.
+    """
+
+    def __init__(self):
+        self._nil = _Node(None, MAX_LEVEL)
+        self._head = _Node(None, MAX_LEVEL)
+        self._head.next = [self._nil] * MAX_LEVEL
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _predecessors(self, key) -> tuple[list[_Node], list[int]]:
+        """Rightmost node with node.key < key on every level, and steps taken per level."""
+        chain = [None] * MAX_LEVEL
+        steps = [0] * MAX_LEVEL
+        node = self._head
+        for level in reversed(range(MAX_LEVEL)):
+            while node.next[level] is not self._nil and node.next[level].key < key:
+                steps[level] += node.width[level]
+                node = node.next[level]
+            chain[level] = node
+        return chain, steps
+
+    def insert(self, key):
+        """Insert key (keys must be unique)."""
+        chain, steps_at_level = self._predecessors(key)
+
+        # Геометрическое распределение высоты узла
+        level = 1
+        while level < MAX_LEVEL and random.random() < 0.5:
+            level += 1
+
+        node = _Node(key, level)
+        steps = 0
+        for i in range(level):
+            prev = chain[i]
+            node.next[i] = prev.next[i]
+            prev.next[i] = node
+            node.width[i] = prev.width[i] - steps
+            prev.width[i] = steps + 1
+            steps += steps_at_level[i]
+        for i in range(level, MAX_LEVEL):
+            chain[i].width[i] += 1
+        self._size += 1
+
+    def remove(self, key):
+        """Remove key; raises KeyError if it is missing."""
+        chain, _ = self._predecessors(key)
+        node = chain[0].next[0]
+        if node is self._nil or node.key != key:
+            raise KeyError(key)
+
+        level = len(node.next)
+        for i in range(level):
+            prev = chain[i]
+            prev.width[i] += node.width[i] - 1
+            prev.next[i] = node.next[i]
+        for i in range(level, MAX_LEVEL):
+            chain[i].width[i] -= 1
+        self._size -= 1
+
+    def rank(self, key) -> int | None:
+        """0-based position of key, or None if it is missing."""
+        node = self._head
+        position = 0
+        for level in reversed(range(MAX_LEVEL)):
+            while node.next[level] is not self._nil and node.next[level].key < key:
+                position += node.width[level]
+                node = node.next[level]
+        node = node.next[0]
+        if node is self._nil or node.key != key:
+            return None
+        return position
+
+    def count_less(self, key) -> int:
+        """Number of keys strictly less than key."""
+        _, steps = self._predecessors(key)
+        return sum(steps)
+
+    def _node_at(self, index: int) -> _Node:
+        """Node at 0-based position (index must be in range)."""
+        node = self._head
+        remaining = index + 1
+        for level in reversed(range(MAX_LEVEL)):
+            while node.width[level] <= remaining:
+                remaining -= node.width[level]
+                node = node.next[level]
+        return node
+
+    def __getitem__(self, index: int):
+        """Key at 0-based position."""
+        if index < 0:
+            index += self._size
+        if not 0 <= index < self._size:
+            raise IndexError(index)
+        return self._node_at(index).key
+
+    def slice(self, start: int, stop: int) -> list:
+        """Keys at positions [start, stop)."""
+        start = max(start, 0)
+        stop = min(stop, self._size)
+        if start >= stop:
+            return []
+        node = self._node_at(start)
+        result = [node.key]
+        for _ in range(stop - start - 1):
+            node = node.next[0]
+            result.append(node.key)
+        return result
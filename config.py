@@ -21,11 +21,13 @@ class Settings:
     
     # Redis
     REDIS_URL: str = os.getenv('REDIS_URL', 'redis://localhost:6379')
+    ACTIVITY_STORE: str = os.getenv('ACTIVITY_STORE', 'db')  # Битмапы активности: 'db' или 'redis'
     
     # Crypto Integration
     TON_API_URL: str = os.getenv('TON_API_URL', 'https://testnet.tonapi.io')
     TON_WALLET_ADDRESS: str = os.getenv('TON_WALLET_ADDRESS', '')
     TON_API_KEY: str = os.getenv('TON_API_KEY', '')
+    TON_WATCHER_ENABLED: bool = os.getenv('TON_WATCHER_ENABLED', 'False').lower() == 'true'  # Автозачисление депозитов; нужны TON_WALLET_ADDRESS и mainnet TON_API_URL
     
     # Payment
     STRIPE_API_KEY: str = os.getenv('STRIPE_API_KEY', '')
@@ -34,11 +36,14 @@ class Settings:
     # App Settings
     DEBUG: bool = os.getenv('DEBUG', 'True').lower() == 'true'
     LOG_LEVEL: str = os.getenv('LOG_LEVEL', 'INFO')
+    LOG_FORMAT: str = os.getenv('LOG_FORMAT', 'json')  # 'json' - объект JSON на строку, 'text' - для локальной отладки
+    LOG_SAMPLING: str = os.getenv('LOG_SAMPLING', '')  # Доля записей по категориям, напр. 'callback=0.1,message=0.5'; WARNING и выше пишутся всегда
     
     # Game Economy
     MIN_WITHDRAW: float = float(os.getenv('MIN_WITHDRAW', '1.0'))  # Минимальный вывод 1 TON
     MAX_WITHDRAW: float = float(os.getenv('MAX_WITHDRAW', '100'))
     WITHDRAW_COMMISSION: float = float(os.getenv('WITHDRAW_COMMISSION', '0.05'))  # Комиссия 5% (0.05)
+    TON_WITHDRAW_SENDER: str = os.getenv('TON_WITHDRAW_SENDER', '')  # Отправитель выплат из TON_SENDERS; пусто - выплаты не обрабатываются
     COIN_TO_TON_RATE: float = float(os.getenv('COIN_TO_TON_RATE', '0.000002'))  # 1 Coin = 0.000002 TON (1 TON = 500,000 Coins)
     
     # Channel Task
@@ -49,6 +54,9 @@ class Settings:
     BASE_DIR: Path = Path(__file__).parent
     APP_DIR: Path = BASE_DIR / 'app'
     LOG_DIR: Path = BASE_DIR / 'logs'
+    LEDGER_ARCHIVE_DIR: Path = Path(os.getenv('LEDGER_ARCHIVE_DIR', str(BASE_DIR / 'archive' / 'coin_transactions')))  # Архив старых месяцев coin_transactions
+    ANALYTICS_EVENTS_SINK: str = os.getenv('ANALYTICS_EVENTS_SINK', 'db')  # 'db' - таблица analytics_events, 'jsonl' - файлы .jsonl.gz
+    ANALYTICS_EVENTS_DIR: Path = Path(os.getenv('ANALYTICS_EVENTS_DIR', str(BASE_DIR / 'archive' / 'events')))
     
     def __init__(self):
         self.LOG_DIR.mkdir(exist_ok=True)
@@ -15,16 +15,10 @@ except Exception as e:
     print(f"Python path: {sys.path}")
     sys.exit(1)
 
-# Configure logging
+# Configure logging: formatting and file I/O run in a listener thread, not on the event loop
 try:
-    logging.basicConfig(
-        level=getattr(logging, settings.LOG_LEVEL),
-        format='%(asctime)s - %(levelname)s - %(message)s',  # Simplified format
-        handlers=[
-            logging.FileHandler(settings.LOG_DIR / 'bot.log', encoding='utf-8'),
-            logging.StreamHandler()
-        ]
-    )
+    from app.utils.logs import setup_logging
+    setup_logging(settings.LOG_LEVEL, settings.LOG_DIR / 'bot.log', settings.LOG_FORMAT, settings.LOG_SAMPLING)
 except Exception as e:
     print(f"❌ Error setting up logging: {e}")
     logging.basicConfig(
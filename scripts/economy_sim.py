@@ -0,0 +1,437 @@
+"""
+Offline whole-economy simulator for balancing changes.
+
+Models N synthetic players over M days with NumPy arrays (one array per
+player attribute, one vectorized step per day) using the real formula
+tables from the services: bear stats and upgrade costs (BearsService),
+loot tables (cases), daily streak rewards, UPGRADES_CONFIG, referral
+bonus, withdrawal rate and commission. Change a table, run the
+simulator, compare the curves. Needs numpy (requirements-scripts.txt).
+
+    python -m scripts.economy_sim --players 100000 --days 30
+    python -m scripts.economy_sim --players 200000 --days 60 --set case_rate=0.5 --csv sim.csv
+
+Outputs per day: coin supply, minted / burned coins, inflation, share of
+players with a legendary bear and median time to it, TON outflow.
+
+Assumptions: bear income is collected 24h per day - every day with the
+auto_collect upgrade, otherwise on days the player is active. Players
+buy the best affordable bears of their best allowed class (legendary
+only for premium; savers skip classes below their target), level one
+main bear, buy the cheapest next profile upgrade, open the most
+expensive affordable case and cash out coins and TON once over
+MIN_WITHDRAW.
+"""
+import argparse
+import csv
+import logging
+import os
+import time
+
+import numpy as np
+
+os.environ.setdefault('BOT_TOKEN', '0:offline-simulator')  # config требует токен, сеть не используется
+
+from app.services.bears import BearsService, BEAR_CLASSES, MAX_BEAR_LEVEL, MAX_BEARS_PER_RARITY_LEVEL_1
+from app.services.cases import CASE_TYPES, LOOT_TABLES
+from app.services.features import DAILY_STREAK_REWARDS, DAILY_STREAK_CYCLE
+from app.services.referrals import REFERRAL_BONUS
+from app.services.upgrades import UPGRADES_CONFIG, calculate_upgrade_cost, calculate_upgrade_effect
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+STARTING_COINS = 1000  # Стартовый бонус (handlers/start.py)
+VARIANTS = 15
+BEAR_TYPES = tuple(BEAR_CLASSES)  # common, rare, epic, legendary
+LEGENDARY = BEAR_TYPES.index('legendary')
+SIM_UPGRADES = ('income_multiplier', 'production_speed', 'coin_quality', 'case_bonus', 'shop_discount', 'auto_collect')
+COIN_CASES = tuple(c for c in CASE_TYPES if CASE_TYPES[c]['cost_coins'] > 0)
+TON_CASES = tuple(c for c in CASE_TYPES if CASE_TYPES[c]['cost_ton'] > 0)
+
+# Поведение игроков; меняется через --set key=value
+BEHAVIOUR = {
+    'initial_share': 0.3,  # Доля игроков, пришедших в день 0
+    'organic_joins': 0.01,  # Доля от N, приходящая сама каждый день
+    'invite_rate': 0.02,  # Приглашений на активного игрока в день
+    'churn': 0.02,  # Вероятность уйти навсегда за день
+    'engagement_a': 2.0,  # Beta(a, b) - вероятность зайти в игру в конкретный день
+    'engagement_b': 2.0,
+    'premium_share': 0.05,  # Могут покупать легендарных медведей
+    'saver_share': 0.3,  # Копят на лучший доступный класс (легендарный / эпический), дешёвых не покупают
+    'bear_budget': 0.6,  # Доля коинов на медведей
+    'level_rate': 0.3,  # Вероятность улучшить медведя за активный день
+    'level_budget': 0.5,
+    'upgrade_rate': 0.2,  # Вероятность купить улучшение профиля за активный день
+    'upgrade_budget': 0.5,
+    'case_rate': 0.3,  # Вероятность открыть кейс за активный день
+    'case_budget': 0.2,
+    'cashout_rate': 0.1,  # Вероятность вывести, когда набралось на MIN_WITHDRAW
+}
+
+
+def build_tables() -> dict:
+    """Formula tables from the services as arrays."""
+    bear_cost = np.array([[BearsService.get_bear_stats(t, v)['cost'] for v in range(1, VARIANTS + 1)] for t in BEAR_TYPES], dtype=float)
+    bear_income = np.array([[BearsService.get_bear_stats(t, v)['income'] for v in range(1, VARIANTS + 1)] for t in BEAR_TYPES])
+    
+    # Стоимость улучшения медведя с уровня L на L+1 (индекс L-1); с максимального - бесконечность
+    level_cost = np.full((len(BEAR_TYPES), MAX_BEAR_LEVEL), np.inf)
+    for i, t in enumerate(BEAR_TYPES):
+        level_cost[i, :-1] = [BearsService.get_upgrade_cost(t, level) for level in range(1, MAX_BEAR_LEVEL)]
+    level_income = np.array([BearsService.get_bear_income_for_level(1.0, level) for level in range(1, MAX_BEAR_LEVEL + 1)])
+    
+    width = max(UPGRADES_CONFIG[u]['max_level'] for u in SIM_UPGRADES) + 1
+    upgrade_cost = np.full((len(SIM_UPGRADES), width), np.inf)
+    upgrade_effect = np.zeros((len(SIM_UPGRADES), width))
+    for i, u in enumerate(SIM_UPGRADES):
+        max_level = UPGRADES_CONFIG[u]['max_level']
+        upgrade_cost[i, :max_level] = [calculate_upgrade_cost(u, level) for level in range(max_level)]
+        upgrade_effect[i, :max_level + 1] = [calculate_upgrade_effect(u, level) for level in range(max_level + 1)]
+        upgrade_effect[i, max_level + 1:] = upgrade_effect[i, max_level]
+    
+    daily = np.array([0] + [DAILY_STREAK_REWARDS.get(day, 50) for day in range(1, DAILY_STREAK_CYCLE + 1)], dtype=float)
+    
+    loot = {}
+    for case_type, table in LOOT_TABLES.items():
+        weights = np.array([weight for *_, weight in table], dtype=float)
+        bears = [value.split(':') if reward_type == 'bear' else ('common', '1') for reward_type, value, _, _ in table]
+        loot[case_type] = {
+            'cum': np.cumsum(weights) / weights.sum(),
+            'coins': np.array([value if reward_type == 'coins' else 0 for reward_type, value, _, _ in table], dtype=float),
+            'ton': np.array([value if reward_type == 'ton' else 0 for reward_type, value, _, _ in table], dtype=float),
+            'is_bear': np.array([reward_type == 'bear' for reward_type, *_ in table]),
+            'bear_type': np.array([BEAR_TYPES.index(t) for t, _ in bears]),
+            'bear_variant': np.array([int(v) - 1 for _, v in bears]),
+        }
+    
+    return {
+        'bear_cost': bear_cost,
+        'bear_income': bear_income,
+        'level_cost': level_cost,
+        'level_income': level_income,
+        'upgrade_cost': upgrade_cost,
+        'upgrade_effect': upgrade_effect,
+        'daily': daily,
+        'loot': loot,
+    }
+
+
+class EconomySimulator:
+    """State of all players as arrays; step() advances everyone by one day."""
+    
+    def __init__(self, players: int, seed: int = 1, behaviour: dict = None):
+        self.n = players
+        self.b = {**BEHAVIOUR, **(behaviour or {})}
+        self.t = build_tables()
+        self.rng = np.random.default_rng(seed)
+        rng, n = self.rng, players
+        
+        self.joined = np.zeros(n, dtype=bool)
+        self.join_day = np.full(n, -1)
+        self.churned = np.zeros(n, dtype=bool)
+        self.engagement = rng.beta(self.b['engagement_a'], self.b['engagement_b'], n)
+        self.premium = rng.random(n) < self.b['premium_share']
+        self.target_type = np.where(
+            rng.random(n) < self.b['saver_share'],
+            np.where(self.premium, LEGENDARY, BEAR_TYPES.index('epic')),
+            0,
+        )
+        self.coins = np.zeros(n)
+        self.ton = np.zeros(n)
+        self.income = np.zeros(n)  # Базовый доход медведей, коинов/час
+        self.level1 = np.zeros((n, len(BEAR_TYPES)), dtype=np.int32)  # Медведи 1-го уровня по классам
+        self.main_type = np.full(n, -1)  # Главный (улучшаемый) медведь
+        self.main_base = np.zeros(n)
+        self.main_level = np.ones(n, dtype=np.int32)
+        self.upgrades = np.zeros((n, len(SIM_UPGRADES)), dtype=np.int32)
+        self.streak = np.zeros(n, dtype=np.int32)
+        self.claimed_yesterday = np.zeros(n, dtype=bool)
+        self.legendary_day = np.full(n, -1)
+        self.n_joined = 0
+        self.day = 0
+        self.ton_outflow_total = 0.0
+    
+    # ============ ВСПОМОГАТЕЛЬНОЕ ============
+    
+    def _effect(self, upgrade_type: str, idx=slice(None)) -> np.ndarray:
+        u = SIM_UPGRADES.index(upgrade_type)
+        return self.t['upgrade_effect'][u, self.upgrades[idx, u]]
+    
+    def _income_multiplier(self) -> np.ndarray:
+        return (
+            (1 + self._effect('income_multiplier') / 100)
+            * (1 + self._effect('production_speed') / 100)
+            * (1 + self._effect('coin_quality') / 100)
+        )
+    
+    def _add_bears(self, idx: np.ndarray, bear_type: np.ndarray, variant: np.ndarray, quantity: np.ndarray):
+        """Give level-1 bears; the first bear of a player becomes the main one."""
+        np.add.at(self.income, idx, self.t['bear_income'][bear_type, variant] * quantity)
+        np.add.at(self.level1, (idx, bear_type), quantity)
+        first = self.main_type[idx] < 0
+        self.main_type[idx[first]] = bear_type[first]
+        self.main_base[idx[first]] = self.t['bear_income'][bear_type[first], variant[first]]
+        got_legendary = idx[(bear_type == LEGENDARY) & (self.legendary_day[idx] < 0)]
+        self.legendary_day[got_legendary] = self.day
+    
+    def _join(self, count: int, invited: int) -> int:
+        """Activate the next `count` player slots; the first `invited` came by referral."""
+        start, end = self.n_joined, min(self.n, self.n_joined + count)
+        if end <= start:
+            return 0
+        self.joined[start:end] = True
+        self.join_day[start:end] = self.day
+        self.coins[start:end] = STARTING_COINS
+        invited = min(invited, end - start)
+        self.coins[start:start + invited] += REFERRAL_BONUS
+        self.n_joined = end
+        return end - start
+    
+    # ============ ДЕНЬ ============
+    
+    def step(self) -> dict:
+        """Simulate one day; returns the day's metrics."""
+        rng, b, t = self.rng, self.b, self.t
+        minted = dict.fromkeys(('start', 'referral', 'daily', 'income', 'cases'), 0.0)
+        burned = dict.fromkeys(('bears', 'levels', 'upgrades', 'cases', 'withdrawals'), 0.0)
+        supply_before = self.coins.sum()
+        
+        # Приход: день 0 - начальная когорта, дальше органика + приглашения активных вчера
+        if self.day == 0:
+            joined = self._join(int(self.n * b['initial_share']), 0)
+            invites = 0
+        else:
+            active_prev = int((self.joined & ~self.churned).sum() * self.engagement.mean())
+            invites = int(rng.binomial(active_prev, b['invite_rate'])) if active_prev else 0
+            joined = self._join(invites + int(self.n * b['organic_joins']), invites)
+            invites = min(invites, joined)
+        if invites:
+            referrers = rng.choice(np.flatnonzero(self.joined & ~self.churned), invites)
+            np.add.at(self.coins, referrers, REFERRAL_BONUS)
+        minted['start'] = joined * STARTING_COINS
+        minted['referral'] = invites * REFERRAL_BONUS * 2
+        
+        self.churned |= self.joined & (rng.random(self.n) < b['churn'])
+        active = self.joined & ~self.churned & (rng.random(self.n) < self.engagement)
+        
+        # Ежедневная награда: серия растёт, если забирали вчера, после цикла - сначала
+        self.streak = np.where(
+            active,
+            np.where(self.claimed_yesterday & (self.streak < DAILY_STREAK_CYCLE), self.streak + 1, 1),
+            self.streak,
+        )
+        daily = np.where(active, t['daily'][self.streak], 0)
+        self.coins += daily
+        minted['daily'] = daily.sum()
+        self.claimed_yesterday = active.copy()
+        
+        # Доход медведей за сутки
+        collects = self.joined & (active | (self.upgrades[:, SIM_UPGRADES.index('auto_collect')] > 0))
+        income = np.where(collects, self.income * self._income_multiplier() * 24, 0)
+        self.coins += income
+        minted['income'] = income.sum()
+        
+        self._open_cases(active, minted, burned)
+        self._buy_bears(active, burned)
+        self._level_main_bear(active, burned)
+        self._buy_upgrades(active, burned)
+        ton_outflow = self._cash_out(active, burned)
+        self.ton_outflow_total += ton_outflow
+        
+        supply = self.coins.sum()
+        has_legendary = self.legendary_day >= 0
+        days_to_legendary = (self.legendary_day - self.join_day)[has_legendary]
+        metrics = {
+            'day': self.day,
+            'players': self.n_joined,
+            'active': int(active.sum()),
+            'coin_supply': supply,
+            'minted': sum(minted.values()),
+            'burned': sum(burned.values()),
+            'inflation_pct': (supply - supply_before) / supply_before * 100 if supply_before else 0.0,
+            'legendary_share_pct': has_legendary.sum() / max(self.n_joined, 1) * 100,
+            'days_to_legendary_median': float(np.median(days_to_legendary)) if days_to_legendary.size else float('nan'),
+            'days_to_legendary_p90': float(np.percentile(days_to_legendary, 90)) if days_to_legendary.size else float('nan'),
+            'ton_outflow': ton_outflow,
+            'ton_outflow_total': self.ton_outflow_total,
+            'ton_liability': self.ton.sum(),
+            **{f'minted_{k}': v for k, v in minted.items()},
+            **{f'burned_{k}': v for k, v in burned.items()},
+        }
+        self.day += 1
+        return metrics
+    
+    def _open_cases(self, active: np.ndarray, minted: dict, burned: dict):
+        """The most expensive affordable case (coins or TON); reward drawn from the loot table."""
+        t = self.t
+        wants = active & (self.rng.random(self.n) < self.b['case_rate'])
+        budget = self.coins * self.b['case_budget']
+        chosen = np.full(self.n, '', dtype=object)
+        for case_type in sorted(COIN_CASES, key=lambda c: CASE_TYPES[c]['cost_coins']):
+            chosen[wants & (budget >= CASE_TYPES[case_type]['cost_coins'])] = case_type
+        for case_type in sorted(TON_CASES, key=lambda c: CASE_TYPES[c]['cost_ton']):
+            chosen[wants & (self.ton >= CASE_TYPES[case_type]['cost_ton'])] = case_type
+        
+        case_multiplier = 1 + self._effect('case_bonus') / 100
+        for case_type, loot in t['loot'].items():
+            idx = np.flatnonzero(chosen == case_type)
+            if not idx.size:
+                continue
+            cost_coins, cost_ton = CASE_TYPES[case_type]['cost_coins'], CASE_TYPES[case_type]['cost_ton']
+            self.coins[idx] -= cost_coins
+            self.ton[idx] -= cost_ton
+            burned['cases'] += cost_coins * idx.size
+            
+            roll = np.searchsorted(loot['cum'], self.rng.random(idx.size), side='right')
+            coins = np.round(loot['coins'][roll] * case_multiplier[idx])
+            self.coins[idx] += coins
+            self.ton[idx] += np.round(loot['ton'][roll] * case_multiplier[idx], 4)
+            minted['cases'] += coins.sum()
+            
+            bear = loot['is_bear'][roll]
+            if bear.any():
+                self._add_bears(idx[bear], loot['bear_type'][roll[bear]], loot['bear_variant'][roll[bear]], np.ones(bear.sum(), dtype=np.int32))
+    
+    def _buy_bears(self, active: np.ndarray, burned: dict):
+        """Best affordable variant of the best allowed class with free level-1 slots (savers: target class only)."""
+        t = self.t
+        price_multiplier = 1 - np.minimum(self._effect('shop_discount') / 100, 0.5)
+        budget = np.where(active, self.coins * self.b['bear_budget'], 0)
+        pending = active.copy()
+        for bear_type in range(len(BEAR_TYPES) - 1, -1, -1):
+            allowed = pending & (self.target_type <= bear_type)
+            if BEAR_CLASSES[BEAR_TYPES[bear_type]]['require_premium']:
+                allowed &= self.premium
+            free = MAX_BEARS_PER_RARITY_LEVEL_1 - self.level1[:, bear_type]
+            # Лучший вариант, на который хватает: searchsorted по возрастающим ценам
+            variant = np.searchsorted(t['bear_cost'][bear_type], budget / price_multiplier, side='right') - 1
+            buyers = np.flatnonzero(allowed & (free > 0) & (variant >= 0))
+            if not buyers.size:
+                continue
+            unit_price = np.floor(t['bear_cost'][bear_type, variant[buyers]] * price_multiplier[buyers])
+            quantity = np.minimum(budget[buyers] // unit_price, free[buyers]).astype(np.int32)
+            self._add_bears(buyers, np.full(buyers.size, bear_type), variant[buyers], quantity)
+            spent = unit_price * quantity
+            self.coins[buyers] -= spent
+            burned['bears'] += spent.sum()
+            pending[buyers] = False
+    
+    def _level_main_bear(self, active: np.ndarray, burned: dict):
+        """Level the main bear once if the level budget covers BearsService.get_upgrade_cost."""
+        t = self.t
+        has_main = self.main_type >= 0
+        cost = np.full(self.n, np.inf)
+        cost[has_main] = t['level_cost'][self.main_type[has_main], self.main_level[has_main] - 1]
+        idx = np.flatnonzero(
+            active & has_main & (self.rng.random(self.n) < self.b['level_rate'])
+            & (self.coins * self.b['level_budget'] >= cost)
+        )
+        if not idx.size:
+            return
+        level = self.main_level[idx]
+        self.coins[idx] -= cost[idx]
+        burned['levels'] += cost[idx].sum()
+        self.income[idx] += self.main_base[idx] * (t['level_income'][level] - t['level_income'][level - 1])
+        # Медведь уходит с 1-го уровня - освобождает слот
+        first_level = level == 1
+        np.subtract.at(self.level1, (idx[first_level], self.main_type[idx[first_level]]), 1)
+        self.main_level[idx] = level + 1
+    
+    def _buy_upgrades(self, active: np.ndarray, burned: dict):
+        """The cheapest next profile upgrade level, if the upgrade budget covers it."""
+        t = self.t
+        costs = t['upgrade_cost'][np.arange(len(SIM_UPGRADES)), self.upgrades]
+        choice = costs.argmin(axis=1)
+        cost = costs[np.arange(self.n), choice]
+        idx = np.flatnonzero(
+            active & (self.rng.random(self.n) < self.b['upgrade_rate'])
+            & (self.coins * self.b['upgrade_budget'] >= cost)
+        )
+        self.coins[idx] -= cost[idx]
+        burned['upgrades'] += cost[idx].sum()
+        self.upgrades[idx, choice[idx]] += 1
+    
+    def _cash_out(self, active: np.ndarray, burned: dict) -> float:
+        """Withdraw coins (calculate_withdrawal: commission, then COIN_TO_TON_RATE) and case TON."""
+        rate, commission = settings.COIN_TO_TON_RATE, settings.WITHDRAW_COMMISSION
+        min_coins = settings.MIN_WITHDRAW / rate / (1 - commission)
+        max_coins = settings.MAX_WITHDRAW / rate / (1 - commission)
+        wants = active & (self.rng.random(self.n) < self.b['cashout_rate'])
+        
+        idx = np.flatnonzero(wants & (self.coins >= min_coins))
+        coins = np.minimum(self.coins[idx], max_coins)
+        self.coins[idx] -= coins
+        burned['withdrawals'] += coins.sum()
+        outflow = (coins * (1 - commission) * rate).sum()
+        
+        idx = np.flatnonzero(wants & (self.ton >= settings.MIN_WITHDRAW))
+        ton = np.minimum(self.ton[idx], settings.MAX_WITHDRAW)
+        self.ton[idx] -= ton
+        return float(outflow + ton.sum())
+    
+    def run(self, days: int) -> list[dict]:
+        return [self.step() for _ in range(days)]
+
+
+REPORT_COLUMNS = (
+    ('day', '{:>4}'),
+    ('players', '{:>9,}'),
+    ('active', '{:>8,}'),
+    ('coin_supply', '{:>15,.0f}'),
+    ('minted', '{:>13,.0f}'),
+    ('burned', '{:>13,.0f}'),
+    ('inflation_pct', '{:>8.2f}'),
+    ('legendary_share_pct', '{:>8.2f}'),
+    ('days_to_legendary_median', '{:>6.1f}'),
+    ('ton_outflow', '{:>10.2f}'),
+    ('ton_outflow_total', '{:>11.2f}'),
+)
+
+
+def format_report(rows: list[dict]) -> str:
+    header = 'day   players   active     coin_supply        minted        burned  infl%    leg%  d→leg  TON/day   TON total'
+    lines = [header]
+    for row in rows:
+        lines.append(' '.join(fmt.format(row[key]) for key, fmt in REPORT_COLUMNS))
+    return '\n'.join(lines)
+
+
+def _parse_overrides(pairs: list[str]) -> dict:
+    overrides = {}
+    for pair in pairs:
+        key, _, value = pair.partition('=')
+        if key not in BEHAVIOUR:
+            raise SystemExit(f"Unknown behaviour parameter '{key}' (known: {', '.join(BEHAVIOUR)})")
+        overrides[key] = float(value)
+    return overrides
+
+
+def main(argv: list[str] = None):
+    parser = argparse.ArgumentParser(description='Simulate the BearsMoney economy with synthetic players.')
+    parser.add_argument('--players', type=int, default=100000)
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--set', action='append', default=[], metavar='KEY=VALUE', help='Override a BEHAVIOUR parameter')
+    parser.add_argument('--csv', help='Write all daily metrics to this CSV file')
+    args = parser.parse_args(argv)
+    
+    started = time.perf_counter()
+    simulator = EconomySimulator(args.players, args.seed, _parse_overrides(args.set))
+    rows = simulator.run(args.days)
+    elapsed = time.perf_counter() - started
+    
+    print(format_report(rows))
+    player_days = sum(row['players'] for row in rows)
+    print(f"\n{player_days:,} player-days in {elapsed:.2f}s")
+    
+    if args.csv:
+        with open(args.csv, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+            writer.writeheader()
+            writer.writerows(rows)
+        print(f"Metrics written to {args.csv}")
+
+
+if __name__ == "__main__":
+    main()
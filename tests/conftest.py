@@ -0,0 +1,32 @@
+"""
+Test setup: the services run against a real PostgreSQL given by TEST_DATABASE_URL
+(e.g. postgresql+asyncpg://postgres@localhost/bearsmoney_test). The database is
+wiped, so it must be a dedicated one; without the variable DB tests are skipped.
+"""
+import os
+
+import pytest
+import pytest_asyncio
+
+TEST_DATABASE_URL = os.getenv('TEST_DATABASE_URL', '')
+
+# До импорта config: движок создаётся при импорте app.database.db
+os.environ.setdefault('BOT_TOKEN', '0:test')
+if TEST_DATABASE_URL:
+    os.environ['DATABASE_URL'] = TEST_DATABASE_URL
+
+
+@pytest_asyncio.fixture
+async def db():
+    """Fresh schema in the test database; yields the engine."""
+    if not TEST_DATABASE_URL:
+        pytest.skip("TEST_DATABASE_URL is not set")
+    
+    from app.database.db import engine, Base
+    import app.database.models  # noqa: F401 - регистрирует таблицы в Base.metadata
+    
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+    yield engine
+    await engine.dispose()
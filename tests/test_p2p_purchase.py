@@ -0,0 +1,59 @@
+"""Concurrent P2P purchases: one listing, hundreds of simultaneous buyers."""
+import asyncio
+
+import pytest
+from sqlalchemy import select, func
+
+BUYERS = 300
+PRICE = 500
+BUYER_COINS = 1000
+
+
+@pytest.mark.asyncio
+async def test_concurrent_buys_have_exactly_one_winner(db):
+    from app.database.db import get_session
+    from app.database.models import User, Bear, P2PListing
+    from app.services.bears import BearsService
+    from app.services.features import FeaturesService
+    
+    async with get_session() as session:
+        seller = User(telegram_id=1, username='seller', coins=0)
+        buyers = [User(telegram_id=100 + i, username=f'buyer{i}', coins=BUYER_COINS) for i in range(BUYERS)]
+        session.add_all([seller, *buyers])
+        await session.flush()
+        bear = await BearsService.create_bear(session, seller.id, 'rare', 5)
+        listing = await FeaturesService.list_bear_for_sale(session, bear.id, seller.id, PRICE)
+        seller_id, bear_id, listing_id = seller.id, bear.id, listing.id
+        buyer_ids = [buyer.id for buyer in buyers]
+    
+    async with get_session() as session:
+        coins_before = (await session.execute(select(func.sum(User.coins)))).scalar()
+    
+    async def attempt(buyer_id: int):
+        async with get_session() as session:
+            try:
+                await FeaturesService.buy_bear_from_player(session, listing_id, buyer_id)
+                return buyer_id
+            except ValueError:
+                return None
+    
+    results = await asyncio.gather(*(attempt(buyer_id) for buyer_id in buyer_ids))
+    winners = [buyer_id for buyer_id in results if buyer_id is not None]
+    assert len(winners) == 1
+    winner_id = winners[0]
+    
+    async with get_session() as session:
+        statuses = (await session.execute(
+            select(P2PListing.status, P2PListing.buyer_id).where(P2PListing.bear_id == bear_id)
+        )).all()
+        assert statuses == [('sold', winner_id)]
+        
+        bear = await session.get(Bear, bear_id)
+        assert bear.owner_id == winner_id
+        assert bear.is_on_sale is False
+        
+        coins = dict((await session.execute(select(User.id, User.coins))).all())
+        assert coins[seller_id] == PRICE
+        assert coins[winner_id] == BUYER_COINS - PRICE
+        assert all(coins[buyer_id] == BUYER_COINS for buyer_id in buyer_ids if buyer_id != winner_id)
+        assert sum(coins.values()) == coins_before